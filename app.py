@@ -3,19 +3,28 @@ import logging
 from fastapi import Request, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from lib.blocking_detector import blocking_detector
 from lib.config import DOMAIN
 from lib.const import USER_NAME_COOKIE_KEY
+from lib.db_compactor import db_compactor
 from lib.exception import UserAuthorizationExpiredException
-from lib.token_util import delete_cookie_token
-from routers import user,  openai_v1, stripe, workflow
+from lib.load_shedder import LoadSheddingMiddleware, load_shedder
+from lib.log_pipeline import log_pipeline
+from lib.session_middleware import SessionRefreshMiddleware
+from lib.sql_profiler import sql_profiler
+from lib.static_files import CachedStaticFiles
+from lib.stripe_webhook import stripe_event_processor
+from lib.token_util import delete_cookie_token, delete_cookie_refresh_token
+from lib.tracing import TracingMiddleware, trace_exporter
+from routers import health, user,  openai_v1, stripe, workflow
 
 
 logger = logging.getLogger("uvicorn.error")
-logger.setLevel(logging.DEBUG)
+log_pipeline.start(["uvicorn", "uvicorn.access"])
 
 
 app = FastAPI()
+app.add_middleware(SessionRefreshMiddleware)
 
 
 # TODO limit the CORS
@@ -37,13 +46,46 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
+# Around the others, so the trace covers them.
+app.add_middleware(TracingMiddleware)
+# Outermost, so the shed requests cost as little as possible.
+app.add_middleware(LoadSheddingMiddleware)
 
+# Before the static files mount, which takes all the other paths.
+app.include_router(health.router)
 app.include_router(user.router, prefix="/user")
 app.include_router(openai_v1.router, prefix="/openai")
 app.include_router(stripe.router, prefix="/payment")
 app.include_router(workflow.router, prefix="/workflow")
-app.mount("/", StaticFiles(directory="static/build/", html=True), name="index")
+app.mount(
+    "/",
+    CachedStaticFiles(directory="static/build/", html=True),
+    name="index",
+)
+
+
+@app.on_event("startup")
+async def startup():
+    blocking_detector.start()
+    stripe_event_processor.start()
+    db_compactor.start()
+    load_shedder.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stripe_event_processor.stop()
+    await db_compactor.stop()
+    await load_shedder.stop()
+    try:
+        sql_profiler.dump()
+    except Exception as e:
+        logger.error("Failed to write the SQL profile: %s", e)
+    trace_exporter.stop()
+    log_pipeline.stop()
+    blocking_detector.stop()
 
 
 @app.exception_handler(UserAuthorizationExpiredException)
@@ -51,8 +93,9 @@ async def unicorn_exception_handler(
     req: Request,
     exp: UserAuthorizationExpiredException,
 ):
-    logger.debug(f"Deleted expired cookie due to: {exp}")
+    logger.debug("Deleted expired cookie due to: %s", exp)
     rsp = RedirectResponse(url=DOMAIN)
     delete_cookie_token(rsp)
+    delete_cookie_refresh_token(rsp)
     rsp.delete_cookie(key=USER_NAME_COOKIE_KEY)
     return rsp
@@ -1,13 +1,16 @@
 from typing import Any, Dict, Optional
 import logging
-import requests
 
 from lib.exception import UserProfileNotFound, CanNotFoundEndPoint
-from oauthlib.oauth2 import Client
+from lib.lazy_import import lazy_import
+from lib.tracing import traced
 
 
 logger = logging.getLogger("uvicorn.error")
 
+oauth2 = lazy_import("oauthlib.oauth2")
+requests = lazy_import("requests")
+
 DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
 
 
@@ -17,24 +20,25 @@ class GoogleOpenIdClient:
         # Following link for Credentials definition: 
         # https://github.com/googleapis/google-auth-library-python-oauthlib/blob/main/google_auth_oauthlib/helpers.py#L140
         logger.debug(
-            f"get google client with client id={credentials.client_id},"
-            f" token={credentials.token}"
-            f"scopes={credentials.scopes}"
+            "get google client with client id=%s, scopes=%s",
+            credentials.client_id,
+            credentials.scopes,
         )
-        self.client = Client(
+        self.client = oauth2.Client(
             client_id=credentials.client_id,
             refresh_token=credentials.refresh_token,
             access_token=credentials.token,
             scopes=credentials.scopes,
         )
 
+    @traced("google.userinfo")
     async def get_user_email(self) -> str:
         endpoint = await self._get_userinfo_endpoint()
         uri, headers, body = self.client.add_token(endpoint)
         userinfo_rsp = requests.get(uri, headers=headers, data=body)
-        logger.debug(f"Got userinfo response:\n{userinfo_rsp}")
+        logger.debug("Got userinfo response:\n%s", userinfo_rsp)
         userinfo_json = userinfo_rsp.json()
-        logger.debug(f"usrinfo_json={userinfo_json}")
+        logger.debug("usrinfo_json=%s", userinfo_json)
 
         # usrinfo_json={
         # 'sub': '123412312312312312',
@@ -44,10 +48,12 @@ class GoogleOpenIdClient:
         if userinfo_json.get("email_verified"):
             return userinfo_json["email"]
         logger.error(
-            f"Failed to get user email from response json: {userinfo_json}"
+            "Failed to get user email from response json: %s",
+            userinfo_json,
         )
         raise UserProfileNotFound("Failed to get user email")
 
+    @traced("google.discovery")
     async def _get_userinfo_endpoint(self) -> str:
         doc: Optional[Dict[str, Any]] = None
         try:
@@ -0,0 +1,123 @@
+import hmac
+import logging
+import time
+
+from typing import Dict
+
+from lib.config import API_KEY_SYNC_S
+from lib.exception import (
+    RateLimitException,
+    UserAuthorizationException,
+    UserForbiddenException,
+)
+from models.api_key import ApiKey, Scope, hash_key
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class TokenBucket:
+    """
+    Allow `rate_per_minute` requests per minute, with bursts up to the
+    same amount.
+    """
+
+    def __init__(self, rate_per_minute: int) -> None:
+        self.capacity = float(rate_per_minute)
+        self.refill_per_s = rate_per_minute / 60
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated_at) * self.refill_per_s,
+        )
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ApiKeyIndex:
+    """
+    In-memory key_hash -> ApiKey index of the active keys, so checking an
+    API key costs one hash and one dict lookup, not a query.
+
+    Keys created or revoked by this process are applied right away; the
+    index is reloaded every `API_KEY_SYNC_S` to pick up the changes of the
+    other processes.
+    """
+
+    def __init__(self, sync_interval_s: float) -> None:
+        self._sync_interval_s = sync_interval_s
+        self._keys: Dict[str, ApiKey] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        # Load on the first check, whatever the host uptime.
+        self._last_sync = float("-inf")
+
+    def add(self, api_key: ApiKey) -> None:
+        self._keys[api_key.key_hash] = api_key
+
+    def remove(self, key_hash: str) -> None:
+        api_key = self._keys.pop(key_hash, None)
+        if api_key:
+            self._buckets.pop(api_key.id, None)
+
+    def authenticate(self, key: str, scope: Scope) -> int:
+        """
+        Return the user id owning `key` if it is active, allowed for `scope`
+        and under its rate limit.
+        """
+        self._maybe_sync()
+        key_hash = hash_key(key)
+        api_key = self._keys.get(key_hash)
+        # The dict lookup already matched, compare_digest only guards
+        # against a timing leak on the last step.
+        if not api_key or not hmac.compare_digest(api_key.key_hash, key_hash):
+            # Only the hash, even a part of an unknown key may be a secret.
+            logger.error(
+                "Authroization denied to unknown api key with sha256: %s...",
+                key_hash[:12],
+            )
+            raise UserAuthorizationException()
+        if scope not in api_key.scopes:
+            logger.error(
+                "Api key: %s of user: %s lacks scope: %s",
+                api_key.id, api_key.user_id, scope.value,
+            )
+            raise UserForbiddenException()
+
+        bucket = self._buckets.get(api_key.id)
+        if not bucket:
+            bucket = self._buckets[api_key.id] = TokenBucket(
+                api_key.rate_limit
+            )
+        if not bucket.take():
+            raise RateLimitException(
+                f"Api key {api_key.prefix}... is limited to "
+                f"{api_key.rate_limit} requests per minute."
+            )
+        return api_key.user_id
+
+    def _maybe_sync(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sync < self._sync_interval_s:
+            return
+        self._last_sync = now
+        try:
+            api_keys = ApiKey.list_active()
+        except Exception as e:
+            logger.error("Failed to load api keys due to: %s", e)
+            return
+        self._keys = {k.key_hash: k for k in api_keys}
+        active_ids = {k.id for k in api_keys}
+        self._buckets = {
+            id: bucket for id, bucket in self._buckets.items()
+            if id in active_ids
+        }
+
+
+api_key_index = ApiKeyIndex(API_KEY_SYNC_S)
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from typing import Any, Dict, List, Optional
+
+from lib.config import (
+    BLOCKING_DETECTOR_ENABLED,
+    BLOCKING_DETECTOR_THRESHOLD_MS,
+    BLOCKING_DETECTOR_FAIL,
+)
+
+
+logger = logging.getLogger("uvicorn.error")
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTERS_DIR = os.path.join(ROOT_DIR, "routers")
+
+
+class BlockingCallError(AssertionError):
+    pass
+
+
+def _is_own(file: str) -> bool:
+    return file.startswith(ROOT_DIR) and "site-packages" not in file
+
+
+def describe(frames: List[traceback.FrameSummary]) -> Dict[str, str]:
+    """
+    The call site, the innermost frame of our code, and the route, the
+    outermost routers/* frame, of a stack listed outermost first.
+    """
+    site = route = "?"
+    for frame in frames:
+        if not _is_own(frame.filename):
+            continue
+        file = os.path.relpath(frame.filename, ROOT_DIR)
+        site = f"{file}:{frame.lineno} {frame.name}"
+        if route == "?" and frame.filename.startswith(ROUTERS_DIR):
+            route = f"{file} {frame.name}"
+    return {"site": site, "route": route}
+
+
+class SiteStats:
+    __slots__ = ("count", "total_ms", "max_ms", "route", "stack")
+
+    def __init__(self, route: str, stack: str) -> None:
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.route = route
+        self.stack = stack
+
+
+class BlockingDetector:
+    """
+    Debug and staging aid: find the synchronous calls, sqlite, requests,
+    the Stripe SDK..., that hold the event loop for more than
+    `threshold_ms`, during which no other request makes progress.
+
+    A callback on the loop beats every quarter of the threshold and a
+    watchdog thread checks the beats. When one is late the watchdog takes
+    the stack of the loop thread, still in the blocking call, and the next
+    beat logs it with how long the loop was held. The occurrences are
+    counted per call site, the innermost frame of our code.
+
+    With `fail`, `stop` raises a `BlockingCallError` if any was found, so a
+    test running the app through the startup and shutdown events fails.
+    """
+
+    def __init__(self, enabled: bool, threshold_ms: float, fail: bool):
+        self.enabled = enabled
+        self._threshold_s = threshold_ms / 1000
+        self._fail = fail
+        self._lock = threading.Lock()
+        self._stats: Dict[str, SiteStats] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handle: Optional[asyncio.Handle] = None
+        self._loop_thread_id = 0
+        self._beat_at = 0.0
+        # The stall being measured: its call site, route and stack.
+        self._stall: Optional[Dict[str, str]] = None
+        self._stopped = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+        self._since = time.time()
+
+    def start(self) -> None:
+        """
+        Watch the running loop, called from it.
+        """
+        if not self.enabled or self._watchdog:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat_at = time.perf_counter()
+        self._stopped.clear()
+        self._handle = self._loop.call_soon(self._beat)
+        self._watchdog = threading.Thread(
+            target=self._watch, name="blocking-detector", daemon=True
+        )
+        self._watchdog.start()
+        logger.info(
+            "Detecting the event loop blocked for over %.0f ms.",
+            self._threshold_s * 1000,
+        )
+
+    def stop(self) -> None:
+        if self._watchdog is None:
+            return
+        self._stopped.set()
+        self._watchdog.join()
+        self._watchdog = None
+        self._handle.cancel()
+        self._loop = None
+        if self._fail:
+            self.check()
+
+    def check(self) -> None:
+        """
+        Raise a `BlockingCallError` listing the call sites found blocking.
+        """
+        report = self.report()
+        if report["sites"]:
+            sites = "\n".join(
+                f"{s['count']}x {s['max_ms']} ms {s['site']} ({s['route']})"
+                for s in report["sites"]
+            )
+            raise BlockingCallError(f"Event loop blocked by:\n{sites}")
+
+    def _beat(self) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            stall, self._stall = self._stall, None
+            held_ms = (now - self._beat_at) * 1000
+            self._beat_at = now
+        if stall is not None:
+            self.record(stall, held_ms)
+        if not self._stopped.is_set() and self._loop is not None:
+            self._handle = self._loop.call_later(
+                self._threshold_s / 4, self._beat
+            )
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self._threshold_s / 4):
+            with self._lock:
+                late = time.perf_counter() - self._beat_at
+                if late <= self._threshold_s or self._stall is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+                frames = traceback.extract_stack(frame)
+                # From our first frame on, not the server and asyncio ones.
+                first = next(
+                    (i for i, f in enumerate(frames) if _is_own(f.filename)),
+                    0,
+                )
+                self._stall = {
+                    **describe(frames),
+                    "stack": "".join(traceback.format_list(frames[first:])),
+                }
+
+    def record(self, stall: Dict[str, str], held_ms: float) -> None:
+        with self._lock:
+            stats = self._stats.get(stall["site"])
+            if stats is None:
+                stats = self._stats[stall["site"]] = SiteStats(
+                    stall["route"], stall["stack"]
+                )
+            stats.count += 1
+            stats.total_ms += held_ms
+            stats.max_ms = max(stats.max_ms, held_ms)
+        logger.warning(
+            "Event loop blocked for %.0f ms at %s, route %s:\n%s",
+            held_ms,
+            stall["site"],
+            stall["route"],
+            stall["stack"],
+        )
+
+    def report(self) -> Dict[str, Any]:
+        """
+        The call sites found blocking the loop, the most often first.
+        """
+        with self._lock:
+            sites = [
+                {
+                    "site": site,
+                    "route": s.route,
+                    "count": s.count,
+                    "total_ms": round(s.total_ms, 1),
+                    "max_ms": round(s.max_ms, 1),
+                    "stack": s.stack,
+                }
+                for site, s in self._stats.items()
+            ]
+        sites.sort(key=lambda s: (s["count"], s["total_ms"]), reverse=True)
+        return {"since": int(self._since), "sites": sites}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._since = time.time()
+
+
+blocking_detector = BlockingDetector(
+    enabled=BLOCKING_DETECTOR_ENABLED,
+    threshold_ms=BLOCKING_DETECTOR_THRESHOLD_MS,
+    fail=BLOCKING_DETECTOR_FAIL,
+)
@@ -0,0 +1,174 @@
+import zlib
+
+from fastapi import Response
+from typing import Hashable, Iterable, Iterator, List, Mapping, Optional
+
+from lib.config import (
+    COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_BROTLI_QUALITY,
+    COMPRESSION_CACHE_SIZE,
+    COMPRESSION_CACHE_TTL_S,
+    COMPRESSION_CACHE_MAX_ITEM_BYTES,
+)
+from lib.ttl_cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # Optional, gzip only without it.
+    brotli = None
+
+GZIP = "gzip"
+BROTLI = "br"
+
+
+def supported_encodings() -> List[str]:
+    """
+    Supported content codings, the preferred first on equal q-values.
+    """
+    return [BROTLI, GZIP] if brotli else [GZIP]
+
+
+def negotiate(
+    accept_encoding: Optional[str],
+    encodings: Optional[Iterable[str]] = None,
+) -> Optional[str]:
+    """
+    The content coding to answer with for an `Accept-Encoding` header,
+    None for identity. Out of `encodings`, preferred first, if given, as
+    for precompressed files, else of the supported ones.
+    """
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for coding in encodings or supported_encodings():
+        q = qualities.get(coding, qualities.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class Compressor:
+    """
+    Incremental gzip or brotli compressor.
+    """
+
+    def __init__(self, encoding: str) -> None:
+        self._encoding = encoding
+        if encoding == GZIP:
+            # wbits 16 + 15: gzip header and trailer.
+            self._zlib = zlib.compressobj(COMPRESSION_GZIP_LEVEL, wbits=31)
+        elif encoding == BROTLI and brotli:
+            self._brotli = brotli.Compressor(
+                quality=COMPRESSION_BROTLI_QUALITY
+            )
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        if self._encoding == GZIP:
+            return self._zlib.compress(data)
+        return self._brotli.process(data)
+
+    def flush(self) -> bytes:
+        if self._encoding == GZIP:
+            return self._zlib.flush()
+        return self._brotli.finish()
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    compressor = Compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(
+    chunks: Iterable[str],
+    encoding: str,
+) -> Iterator[bytes]:
+    compressor = Compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class CompressedCache:
+    """
+    Bounded LRU cache of compressed bodies, so an immutable body, like a
+    rendition of a given video version, is compressed once per encoding
+    and not per request. Bodies compressing to more than `max_item_bytes`
+    are streamed without being kept.
+
+    The keys must change with the content, a version or an ETag.
+    """
+
+    def __init__(self, max_size: int, ttl_s: float, max_item_bytes: int):
+        self._cache: TTLCache[bytes] = TTLCache(max_size, ttl_s)
+        self._max_item_bytes = max_item_bytes
+
+    def get(self, key: Hashable, encoding: str) -> Optional[bytes]:
+        return self._cache.get((key, encoding))
+
+    def compress(self, key: Hashable, encoding: str, data: bytes) -> bytes:
+        """
+        Compress `data`, the body for `key`, and keep it if small enough.
+        """
+        compressed = compress(data, encoding)
+        if len(compressed) <= self._max_item_bytes:
+            self._cache.set((key, encoding), compressed)
+        return compressed
+
+    def stream(
+        self,
+        key: Hashable,
+        encoding: str,
+        chunks: Iterable[str],
+    ) -> Iterator[bytes]:
+        """
+        Compress the `chunks` of the body for `key` while streaming them,
+        and keep the result if small enough.
+        """
+        kept: Optional[List[bytes]] = []
+        size = 0
+        for chunk in compress_stream(chunks, encoding):
+            if kept is not None:
+                size += len(chunk)
+                if size > self._max_item_bytes:
+                    kept = None
+                else:
+                    kept.append(chunk)
+            yield chunk
+        if kept is not None:
+            self._cache.set((key, encoding), b"".join(kept))
+
+
+def compressed_response(
+    body: bytes,
+    encoding: str,
+    media_type: str,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    rsp = Response(body, media_type=media_type, headers=headers)
+    rsp.headers["Content-Encoding"] = encoding
+    rsp.headers["Vary"] = "Accept-Encoding"
+    return rsp
+
+
+compressed_cache = CompressedCache(
+    max_size=COMPRESSION_CACHE_SIZE,
+    ttl_s=COMPRESSION_CACHE_TTL_S,
+    max_item_bytes=COMPRESSION_CACHE_MAX_ITEM_BYTES,
+)
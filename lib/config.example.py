@@ -4,22 +4,178 @@ LOGIN_REDIRECT_URL = "https://127.0.0.1:8000"
 SSL_KEY_FILE = "<hide>" 
 SSL_CERT_FILE = "<hide>" 
 
+# Contact shown to the users in error messages.
+EMAIL = "<hide>"
+
 SQLITE_DB_FILE = "<hide>" 
+# Deleted and old workflows are moved there, see lib/db_compactor.py.
+ARCHIVE_DB_FILE = "<hide>"
 # from cryptography.fernet import Fernet
 # Fernet.generate_key()
 FERNET_KEY = b'<hide>'
+# Retired keys, still accepted for decryption. Rows encrypted with them are
+# re-encrypted with FERNET_KEY lazily. To rotate, move the current
+# FERNET_KEY here and set a new one.
+FERNET_OLD_KEYS = []
+# Decrypted credentials cache.
+CREDENTIALS_CACHE_SIZE = 1024
+CREDENTIALS_CACHE_TTL_S = 300
+# Rows re-encrypted with FERNET_KEY per transaction.
+CREDENTIALS_ROTATION_BATCH_SIZE = 50
 ############# PROXY ############
 
 RETURN_RESOURCE = 1 # Pure proxy, nothing but return drectly.
 RETURN_RESOURCE_ID = 2 # write result into xdb and return id only
 PROXY_MODE = RETURN_RESOURCE_ID
 
+# Max items of one /workflow/bulk/* request.
+WORKFLOW_BULK_MAX_ITEMS = 1000
+# Rendered transcripts cache, see lib/transcript_format.py.
+TRANSCRIPT_CACHE_SIZE = 256
+TRANSCRIPT_CACHE_TTL_S = 3600
+TRANSCRIPT_CACHE_MAX_ITEM_CHARS = 2 * 1024 * 1024
+# Compressed responses and their cache, see lib/compression.py. Smaller
+# bodies go out as is.
+COMPRESSION_MIN_BYTES = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_CACHE_SIZE = 256
+COMPRESSION_CACHE_TTL_S = 3600
+COMPRESSION_CACHE_MAX_ITEM_BYTES = 1024 * 1024
+# Max results per /workflow/search page.
+WORKFLOW_SEARCH_MAX_LIMIT = 50
+# Workflow change feed, see lib/workflow_feed.py.
+WORKFLOW_FEED_POLL_S = 1
+# Max workflows per /workflow/changes response.
+WORKFLOW_FEED_MAX_ITEMS = 200
+WORKFLOW_FEED_MAX_WAIT_S = 30
+# Comment line sent on idle /workflow/changes/stream connections.
+WORKFLOW_FEED_HEARTBEAT_S = 15
+# Workflow scheduler, see lib/workflow_scheduler.py. A user with weight 2
+# gets twice the turns of a user with weight 1.
+SCHEDULER_DEFAULT_WEIGHT = 1
+SCHEDULER_USER_WEIGHTS = {}  # user id -> weight
+SCHEDULER_MAX_RUNNING_PER_USER = 2
+# Priorities a user can give their workflows, from 0, the default.
+SCHEDULER_MAX_PRIORITY = 10
+# Max workflows per /workflow/claim request.
+SCHEDULER_MAX_CLAIM = 10
+SCHEDULER_LOAD_BATCH = 1000
+# How often to load the new workflows and the running counts...
+SCHEDULER_SYNC_S = 2
+# ...and to rebuild the queues from the table.
+SCHEDULER_RESYNC_S = 300
+# Archival, see lib/db_compactor.py. DONE workflows are archived this long
+# after their creation, None keeps them.
+ARCHIVE_DONE_AFTER_S = 365 * 24 * 3600
+# Deleted workflows are archived this long after their deletion. A client
+# of /workflow/changes away for longer may miss deletions, and should list
+# again from since=0.
+ARCHIVE_DELETED_AFTER_S = 30 * 24 * 3600
+ARCHIVE_INTERVAL_S = 3600
+# Workflows moved per transaction, and pause between two transactions.
+ARCHIVE_BATCH_SIZE = 200
+ARCHIVE_PAUSE_S = 0.5
+# Free pages given back to the file system per step.
+VACUUM_PAGES = 256
+
 ############# JWT ############
 JWT_SECRET = "<hide>" 
 JWT_ALGORITHM = "<hide>" 
 
 AUTH_TOKEN_EXPIRE_S = 120
 ACCESS_TOKEN_EXPIRE_S = 6 * 3600
+# Access tokens expiring within this window are re-issued silently from the
+# refresh session, see lib/session_middleware.py.
+ACCESS_TOKEN_REFRESH_WINDOW_S = 10 * 60
+# Refresh sessions expire after this much inactivity...
+REFRESH_SESSION_IDLE_S = 14 * 24 * 3600
+# ...and at the latest this long after the Google login.
+REFRESH_SESSION_MAX_AGE_S = 90 * 24 * 3600
+
+# Revoked tokens, see lib/token_revocation.py.
+REVOCATION_FILTER_CAPACITY = 10000
+REVOCATION_FILTER_ERROR_RATE = 0.001
+# How often to pick up revocations made by other processes.
+REVOCATION_SYNC_S = 5
+# How often to drop expired revocations from the filter.
+REVOCATION_REBUILD_S = 3600
+
+# Emails of the users allowed to call the admin endpoints.
+ADMIN_EMAILS = []
+
+# API keys, see lib/api_key_index.py. Rate limits are in requests per minute.
+API_KEY_DEFAULT_RATE_LIMIT = 60
+API_KEY_MAX_RATE_LIMIT = 600
+# How often to pick up keys created or revoked by other processes.
+API_KEY_SYNC_S = 30
+
+# Logging, see lib/log_pipeline.py. Levels by logger name.
+LOG_LEVELS = {
+    "uvicorn": "INFO",
+    "uvicorn.error": "INFO",
+    "uvicorn.access": "INFO",
+}
+# Records beyond are dropped rather than block.
+LOG_QUEUE_SIZE = 10000
+# At most this many DEBUG or INFO records per message per window, for the
+# loggers of LOG_SAMPLED_LOGGERS; not the access log, all one message.
+LOG_SAMPLED_LOGGERS = ["uvicorn"]
+LOG_SAMPLE_BURST = 20
+LOG_SAMPLE_WINDOW_S = 60
+
+# Request tracing, see lib/tracing.py. Sampled traces are appended to
+# TRACE_FILE, None to keep none; the slower or failed ones always are.
+TRACE_SAMPLE_RATE = 0.01
+TRACE_SLOW_MS = 1000
+TRACE_FILE = "traces.jsonl"
+TRACE_FILE_MAX_BYTES = 50 * 1024 * 1024
+TRACE_FILE_BACKUPS = 3
+# Traces waiting for the writer thread, more are dropped.
+TRACE_QUEUE_SIZE = 1000
+
+# SQL statements statistics, see lib/sql_profiler.py. Slower statements
+# are kept with their query plan. Off by default: it costs a stack walk
+# per statement, turn it on where a hotspot is being looked for.
+SQL_PROFILER_ENABLED = False
+SQL_PROFILER_SLOW_MS = 100
+# Durations kept per statement for the percentiles.
+SQL_PROFILER_SAMPLES = 1000
+SQL_PROFILER_MAX_STATEMENTS = 500
+SQL_PROFILER_SLOW_LOG_SIZE = 100
+# Written on shutdown, None to skip; see scripts/sql_profile.py.
+SQL_PROFILER_REPORT_FILE = "sql_profile.json"
+
+# UI bundle, see lib/static_files.py. Files up to STATIC_CACHE_MAX_FILE_BYTES
+# are kept in memory, STATIC_CACHE_MAX_BYTES in all.
+STATIC_CACHE_MAX_BYTES = 32 * 1024 * 1024
+STATIC_CACHE_MAX_FILE_BYTES = 256 * 1024
+# Browser cache lifetime of the fingerprinted assets, like main.3f2a9c1b.js.
+STATIC_IMMUTABLE_MAX_AGE_S = 365 * 24 * 3600
+
+# Load shedding, see lib/load_shedder.py. Past this event loop lag, or this
+# many requests in flight, requests are rejected with a 503, but the ones
+# to the LOAD_SHED_CRITICAL_PATHS.
+LOAD_SHED_LAG_MS = 200
+LOAD_SHED_MAX_IN_FLIGHT = 500
+LOAD_SHED_CHECK_INTERVAL_S = 0.1
+LOAD_SHED_CRITICAL_PATHS = [
+    "/health",
+    "/ready",
+    "/user/status",
+    "/user/oauth2-callback",
+    "/payment/stripe/succes",
+    "/payment/stripe/fail",
+    "/payment/stripe/webhook",
+]
+LOAD_SHED_RETRY_AFTER_S = 5
+
+# Debug and staging: log the calls holding the event loop for longer than
+# BLOCKING_DETECTOR_THRESHOLD_MS, see lib/blocking_detector.py. With
+# BLOCKING_DETECTOR_FAIL the shutdown raises if any, to fail the tests.
+BLOCKING_DETECTOR_ENABLED = False
+BLOCKING_DETECTOR_THRESHOLD_MS = 100
+BLOCKING_DETECTOR_FAIL = False
 
 
 ############## Google ###############
@@ -47,4 +203,28 @@ OPENAI_API_KEY = "<hide>"
 # Test keys
 STRIPE_API_KEY = "<hide>" 
 STRIPE_PRICE_ID = "<hide>" 
+# Stripe calls run on a thread pool, see lib/stripe_client.py.
+STRIPE_MAX_WORKERS = 4
+STRIPE_TIMEOUT_S = 10
+# Checkout sessions stay open this long (Stripe allows 30 min to 24 hours).
+STRIPE_CHECKOUT_EXPIRE_S = 3600
+# An open checkout session is reused only if it stays open this much longer.
+STRIPE_CHECKOUT_REUSE_MIN_TTL_S = 300
+# https://dashboard.stripe.com/test/webhooks signing secret.
+STRIPE_WEBHOOK_SECRET = "<hide>"
+# Webhook events processing, see lib/stripe_webhook.py.
+STRIPE_EVENT_WORKERS = 2
+STRIPE_EVENT_BATCH_SIZE = 50
+STRIPE_EVENT_QUEUE_SIZE = 1000
+STRIPE_EVENT_SWEEP_S = 60
+STRIPE_EVENT_MAX_ATTEMPTS = 5
+# Payments cache, see models/payment.py.
+PAYMENT_CACHE_SIZE = 1024
+PAYMENT_CACHE_TTL_S = 900
+PAYMENT_HISTORY_MAX_LIMIT = 100
+# Pending payments reconciliation, see scripts/reconcile_payments.py.
+RECONCILE_BATCH_SIZE = 100
+RECONCILE_CONCURRENCY = 8
+# Leave the users some time to finish the checkout.
+RECONCILE_MIN_AGE_S = 3600
 # TRIPE_PRICE_ID = "<hide>" 
\ No newline at end of file
@@ -1,2 +1,3 @@
 USER_NAME_COOKIE_KEY = "logged_in_user"
 COOKIE_TOKEN_KEY = "Authorization"
+REFRESH_COOKIE_KEY = "Refresh"
@@ -0,0 +1,283 @@
+import asyncio
+import hashlib
+import json
+import logging
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+from lib.config import (
+    FERNET_KEY,
+    FERNET_OLD_KEYS,
+    CREDENTIALS_CACHE_SIZE,
+    CREDENTIALS_CACHE_TTL_S,
+    CREDENTIALS_ROTATION_BATCH_SIZE,
+)
+from lib.lazy_import import lazy_import
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from lib.ttl_cache import TTLCache
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+# Pulls google.auth and requests, loaded on first use.
+google_credentials = lazy_import("google.oauth2.credentials")
+
+
+logger = logging.getLogger("uvicorn.error")
+
+UTF_8 = "utf-8"
+
+
+class _CachedCredentials(NamedTuple):
+    fingerprint: str
+    credentials: "Credentials"
+
+
+def fingerprint(credentials_raw: str) -> str:
+    return hashlib.sha256(credentials_raw.encode(UTF_8)).hexdigest()
+
+
+class CredentialStore:
+    """
+    Encrypted storage of the users' Google credentials in `users.credentials`.
+
+    - Decrypted credentials are kept in a small TTL cache, so repeated
+      reads skip the DB read, the decrypt and the json parse.
+    - Writes are skipped when the credentials did not change.
+    - `FERNET_KEY` encrypts, `FERNET_KEY` and `FERNET_OLD_KEYS` decrypt.
+      Rows still encrypted with an old key are re-encrypted with
+      `FERNET_KEY` by a background task after the read that found them,
+      a small batch at a time, instead of a blocking migration.
+    """
+
+    def __init__(
+        self,
+        primary_key: bytes,
+        old_keys: List[bytes],
+        cache_size: int,
+        cache_ttl_s: float,
+        rotation_batch_size: int,
+    ) -> None:
+        self._fernets = [Fernet(key) for key in [primary_key, *old_keys]]
+        self._multi_fernet = MultiFernet(self._fernets)
+        self._cache: TTLCache[_CachedCredentials] = TTLCache(
+            cache_size, cache_ttl_s
+        )
+        # user_id -> ciphertext still encrypted with an old key.
+        self._pending_rotation: Dict[int, bytes] = {}
+        self._rotation_batch_size = rotation_batch_size
+        self._rotation_task: Optional[asyncio.Task] = None
+
+    def get(self, user_id: int) -> Optional["Credentials"]:
+        cached = self._cache.get(user_id)
+        if cached:
+            return cached.credentials
+
+        credentials_encrypted = self._read(user_id)
+        if not credentials_encrypted:
+            logger.error(
+                "Failed to get encrypted credentials "
+                "from database for user: %s",
+                user_id,
+            )
+            return None
+        decrypted = self._decrypt(user_id, credentials_encrypted)
+        if decrypted is None:
+            return None
+        credentials_raw, key_index = decrypted
+        if key_index > 0:
+            self._schedule_rotation(user_id, credentials_encrypted)
+
+        credentials = (
+            google_credentials.Credentials.from_authorized_user_info(
+                info=json.loads(credentials_raw)
+            )
+        )
+        self._cache.set(
+            user_id,
+            _CachedCredentials(fingerprint(credentials_raw), credentials),
+        )
+        return credentials
+
+    def set(self, user_id: int, credentials: "Credentials") -> bool:
+        """
+        Encrypt and write `credentials` for the user.
+        Return False when the write was skipped as nothing changed.
+        """
+        credentials_raw = credentials.to_json()
+        new_fingerprint = fingerprint(credentials_raw)
+        if self._stored_fingerprint(user_id) == new_fingerprint:
+            logger.debug("Credentials of user: %s unchanged.", user_id)
+            self._cache.set(
+                user_id, _CachedCredentials(new_fingerprint, credentials)
+            )
+            return False
+
+        credentials_encrypted = self._fernets[0].encrypt(
+            credentials_raw.encode(UTF_8)
+        )
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    "UPDATE users SET credentials = ? WHERE id = ?",
+                    (credentials_encrypted, user_id,)
+                )
+                connection.commit()
+        except Exception as e:
+            logger.error(
+                "Failed write credentials for user: "
+                "%s to sqlite3 due to error:\n %s",
+                user_id, e,
+            )
+            self._cache.delete(user_id)
+            return False
+        self._pending_rotation.pop(user_id, None)
+        self._cache.set(
+            user_id, _CachedCredentials(new_fingerprint, credentials)
+        )
+        return True
+
+    def invalidate(self, user_id: int) -> None:
+        self._cache.delete(user_id)
+
+    def rotate_pending(self) -> int:
+        """
+        Re-encrypt with the primary key every row found encrypted with an
+        old key, `rotation_batch_size` rows per transaction. Return the
+        number of rotated rows.
+        """
+        rotated = 0
+        while self._pending_rotation:
+            rotated += self._rotate_batch()
+        return rotated
+
+    async def _rotate_in_background(self) -> None:
+        """
+        Rotate the pending rows a batch at a time, letting the requests run
+        between two batches.
+        """
+        try:
+            while self._pending_rotation:
+                self._rotate_batch()
+                await asyncio.sleep(0)
+        finally:
+            self._rotation_task = None
+
+    def _rotate_batch(self) -> int:
+        """
+        Rotate up to `rotation_batch_size` pending rows. The update only
+        applies if the row was not rewritten in the meantime.
+        """
+        batch = list(self._pending_rotation.items())[
+            :self._rotation_batch_size
+        ]
+        values: List[Tuple[bytes, int, bytes]] = []
+        for user_id, credentials_encrypted in batch:
+            del self._pending_rotation[user_id]
+            try:
+                rotated = self._multi_fernet.rotate(credentials_encrypted)
+            except InvalidToken:
+                logger.error("Can not rotate credentials of user: %s", user_id)
+                continue
+            values.append((rotated, user_id, credentials_encrypted))
+        if not values:
+            return 0
+
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.executemany(
+                    """
+                        UPDATE users
+                        SET credentials = ?
+                        WHERE id = ? AND credentials = ?
+                    """,
+                    values
+                )
+                connection.commit()
+        except Exception as e:
+            logger.error(
+                "Failed to rotate credentials for %s users due to error: %s",
+                len(values), e,
+            )
+            return 0
+        logger.info("Rotated credentials of %s users.", len(values))
+        return len(values)
+
+    def _schedule_rotation(
+        self,
+        user_id: int,
+        credentials_encrypted: bytes,
+    ) -> None:
+        self._pending_rotation[user_id] = credentials_encrypted
+        if self._rotation_task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (e.g. a script). Rotated by the next
+            # `rotate_pending` call instead.
+            return
+        self._rotation_task = loop.create_task(self._rotate_in_background())
+
+    def _stored_fingerprint(self, user_id: int) -> Optional[str]:
+        cached = self._cache.get(user_id)
+        if cached:
+            return cached.fingerprint
+        credentials_encrypted = self._read(user_id)
+        if not credentials_encrypted:
+            return None
+        decrypted = self._decrypt(user_id, credentials_encrypted)
+        if decrypted is None:
+            return None
+        return fingerprint(decrypted[0])
+
+    def _read(self, user_id: int) -> Optional[bytes]:
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    "SELECT credentials FROM users WHERE id = ?",
+                    (user_id,)
+                )
+                row = cursor.fetchone()
+        except Exception as e:
+            logger.error(
+                "Failed read credentials for user: "
+                "%s from sqlite3 due to error:\n %s",
+                user_id, e,
+            )
+            return None
+        return row[0] if row else None
+
+    def _decrypt(
+        self,
+        user_id: int,
+        credentials_encrypted: bytes,
+    ) -> Optional[Tuple[str, int]]:
+        """
+        Return the plain credentials and the index of the key that
+        decrypted them, 0 being the primary key.
+        """
+        for i, fernet in enumerate(self._fernets):
+            try:
+                return fernet.decrypt(credentials_encrypted).decode(UTF_8), i
+            except InvalidToken:
+                continue
+        logger.error(
+            "Failed to decrypt credentials of user: "
+            "%s with any of the configured keys.",
+            user_id,
+        )
+        return None
+
+
+credential_store = CredentialStore(
+    primary_key=FERNET_KEY,
+    old_keys=FERNET_OLD_KEYS,
+    cache_size=CREDENTIALS_CACHE_SIZE,
+    cache_ttl_s=CREDENTIALS_CACHE_TTL_S,
+    rotation_batch_size=CREDENTIALS_ROTATION_BATCH_SIZE,
+)
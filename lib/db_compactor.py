@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+
+from collections import Counter
+from typing import Any, List, Mapping, Optional
+
+from lib.config import (
+    ARCHIVE_DB_FILE,
+    ARCHIVE_DELETED_AFTER_S,
+    ARCHIVE_DONE_AFTER_S,
+    ARCHIVE_INTERVAL_S,
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_PAUSE_S,
+    VACUUM_PAGES,
+)
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from models.workflow import Workflow
+
+
+logger = logging.getLogger("uvicorn.error")
+
+ARCHIVE_SCHEMA = "archive"
+# Archived tables and the column pointing to the workflow id.
+ARCHIVED_TABLES = (("video", "workflow_id"), ("workflow", "id"))
+
+
+class DbCompactor:
+    """
+    Keep the hot tables small: move the workflows deleted more than
+    `deleted_after_s` ago, and the DONE ones older than `done_after_s`,
+    with their videos into the same tables of the `archive_file` DB, then
+    give the freed pages back with incremental vacuum.
+
+    Deleted workflows stay that long so the change feed reports them, see
+    `WorkflowSummary.list_changed`, to the clients away for less.
+
+    Throttled so it never holds the write lock for long: each transaction
+    moves at most `batch_size` workflows or vacuums `vacuum_pages` pages,
+    and the requests run during the `pause_s` between two of them.
+
+    A batch is copied then deleted. The archive is an attached DB, so the
+    two steps may not commit atomically; the copy replaces the rows of the
+    same workflows, so a batch interrupted between them is moved again.
+    """
+
+    def __init__(
+        self,
+        archive_file: str,
+        deleted_after_s: int,
+        done_after_s: Optional[int],
+        interval_s: float,
+        batch_size: int,
+        pause_s: float,
+        vacuum_pages: int,
+    ) -> None:
+        self._archive_file = archive_file
+        self._deleted_after_s = deleted_after_s
+        self._done_after_s = done_after_s
+        self._interval_s = interval_s
+        self._batch_size = batch_size
+        self._pause_s = pause_s
+        self._vacuum_pages = vacuum_pages
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self) -> Mapping[str, int]:
+        """
+        Archive all the archivable workflows then vacuum, return counts.
+        """
+        report: Counter = Counter()
+        self._attach()
+        now = int(time.time())
+        deleted_before = now - self._deleted_after_s
+        done_before = None
+        if self._done_after_s is not None:
+            done_before = now - self._done_after_s
+        while True:
+            ids = Workflow.list_archivable(
+                deleted_before, done_before, self._batch_size
+            )
+            if not ids:
+                break
+            self.archive(ids)
+            report["workflows"] += len(ids)
+            await asyncio.sleep(self._pause_s)
+
+        while True:
+            pages = self.vacuum_step()
+            if not pages:
+                break
+            report["pages"] += pages
+            await asyncio.sleep(self._pause_s)
+        if report:
+            logger.info("Compacted the DB: %s", dict(report))
+        return report
+
+    def archive(self, ids: List[int]) -> None:
+        """
+        Move the workflows and their videos to the archive DB.
+        """
+        marks = ', '.join(['?'] * len(ids))
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            for table, key in ARCHIVED_TABLES:
+                columns = ', '.join(self._columns(cursor, table))
+                cursor.execute(
+                    f"DELETE FROM {ARCHIVE_SCHEMA}.{table} "
+                    f"WHERE {key} IN ( {marks} )",
+                    ids
+                )
+                cursor.execute(
+                    f"INSERT INTO {ARCHIVE_SCHEMA}.{table} ( {columns} ) "
+                    f"SELECT {columns} FROM main.{table} "
+                    f"WHERE {key} IN ( {marks} )",
+                    ids
+                )
+                cursor.execute(
+                    f"DELETE FROM main.{table} WHERE {key} IN ( {marks} )",
+                    ids
+                )
+            connection.commit()
+
+    def vacuum_step(self) -> int:
+        """
+        Free up to `vacuum_pages` pages, return how many were free.
+        """
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA main.auto_vacuum")
+            if cursor.fetchone()[0] != 2:
+                # Not INCREMENTAL, see 011_incremental_vacuum.sql.
+                return 0
+            cursor.execute("PRAGMA main.freelist_count")
+            free = cursor.fetchone()[0]
+            connection.commit()
+            if free:
+                # Not cursor.execute, which runs only the first page step.
+                connection.executescript(
+                    f"PRAGMA main.incremental_vacuum({self._vacuum_pages});"
+                )
+        return min(free, self._vacuum_pages)
+
+    def _attach(self) -> None:
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA database_list")
+            if ARCHIVE_SCHEMA not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute(
+                    f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}",
+                    (self._archive_file,)
+                )
+            for table, key in ARCHIVED_TABLES:
+                # Same columns as the main table, without its constraints.
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.{table} "
+                    f"AS SELECT * FROM main.{table} WHERE 0"
+                )
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS "
+                    f"{ARCHIVE_SCHEMA}.{table}_{key} ON {table} ({key})"
+                )
+                # Follow the migrations adding columns to the main table.
+                archived = self._columns(cursor, table, ARCHIVE_SCHEMA)
+                for column in self._columns(cursor, table):
+                    if column not in archived:
+                        cursor.execute(
+                            f"ALTER TABLE {ARCHIVE_SCHEMA}.{table} "
+                            f"ADD COLUMN {column}"
+                        )
+            connection.commit()
+
+    def _columns(
+        self,
+        cursor: Any,
+        table: str,
+        schema: str = "main",
+    ) -> List[str]:
+        cursor.execute(f"PRAGMA {schema}.table_info({table})")
+        return [row[1] for row in cursor.fetchall()]
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                logger.exception("Failed to compact the DB due to: %s", e)
+            await asyncio.sleep(self._interval_s)
+
+
+db_compactor = DbCompactor(
+    archive_file=ARCHIVE_DB_FILE,
+    deleted_after_s=ARCHIVE_DELETED_AFTER_S,
+    done_after_s=ARCHIVE_DONE_AFTER_S,
+    interval_s=ARCHIVE_INTERVAL_S,
+    batch_size=ARCHIVE_BATCH_SIZE,
+    pause_s=ARCHIVE_PAUSE_S,
+    vacuum_pages=VACUUM_PAGES,
+)
@@ -0,0 +1,39 @@
+from fastapi import Request, Response
+
+from models.user_version import UserVersion
+
+
+NOT_MODIFIED = 304
+
+
+def user_etag(user_id: int) -> str:
+    """
+    Weak ETag of all the data of a user, from the user version counter kept
+    by triggers on the workflows, videos and credit: one primary key lookup.
+    """
+    return f'W/"{user_id}.{UserVersion.get(user_id)}"'
+
+
+def not_modified(req: Request, etag: str) -> bool:
+    if_none_match = req.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, RFC 9110 13.1.2.
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque
+        for tag in if_none_match.split(",")
+    )
+
+
+def set_etag(rsp: Response, etag: str) -> Response:
+    rsp.headers["ETag"] = etag
+    # Always revalidate, the check is cheap.
+    rsp.headers["Cache-Control"] = "private, no-cache"
+    return rsp
+
+
+def not_modified_response(etag: str) -> Response:
+    return set_etag(Response(status_code=NOT_MODIFIED), etag)
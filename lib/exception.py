@@ -6,6 +6,7 @@ HTTP_FORBIDDEN = 403
 HTTP_NOT_FOUND = 404
 HTTP_METHOD_NOT_ALLOWED = 405
 HTTP_REQUEST_TIMEOUT = 408
+HTTP_TOO_MANY_REQUESTS = 429
 HTTP_INTERNAL_SERVER_ERROR = 500
 HTTP_BAD_GATEWAY = 502
 HTTP_SERVICE_UNAVAILABLE = 503
@@ -44,6 +45,22 @@ class UserAuthorizationExpiredException(UserFaceException):
         )
 
 
+class UserForbiddenException(UserFaceException):
+    def __init__(self):
+        super().__init__(
+            status_code=HTTP_FORBIDDEN,
+            detail="Permission denied.",
+        )
+
+
+class RateLimitException(UserFaceException):
+    def __init__(self, detail: str):
+        super().__init__(
+            status_code=HTTP_TOO_MANY_REQUESTS,
+            detail=detail,
+        )
+
+
 # Database
 class UserNotFoundException(UserFaceException):
     def __init__(self, detail: str):
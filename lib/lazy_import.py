@@ -0,0 +1,51 @@
+import importlib
+import logging
+import sys
+import time
+import types
+
+from typing import Any
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module imported on first attribute access, so a heavy
+    provider SDK loads on the first request that uses it and not when the
+    app starts. See scripts/profile_startup.py.
+    """
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self.__dict__["_module"] = None
+
+    def _load(self) -> types.ModuleType:
+        module = self.__dict__["_module"]
+        if module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self.__name__)
+            self.__dict__["_module"] = module
+            logger.info(
+                "Imported %s lazily in %.1f ms.",
+                self.__name__,
+                (time.perf_counter() - start) * 1000,
+            )
+        return module
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    The module `name` if already imported, else a `LazyModule` for it.
+    """
+    return sys.modules.get(name) or LazyModule(name)
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import random
+import time
+
+from fastapi import Request
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+from typing import Any, Dict, Iterable, Optional
+
+from lib.config import (
+    LOAD_SHED_CHECK_INTERVAL_S,
+    LOAD_SHED_CRITICAL_PATHS,
+    LOAD_SHED_LAG_MS,
+    LOAD_SHED_MAX_IN_FLIGHT,
+    LOAD_SHED_RETRY_AFTER_S,
+)
+from lib.exception import HTTP_SERVICE_UNAVAILABLE
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class LoadShedder:
+    """
+    Measure the event loop lag, how late a `check_interval_s` sleep wakes
+    up, and count the requests in flight, so that past `lag_ms` or
+    `max_in_flight` the low priority requests are rejected early rather
+    than all of them time out together.
+
+    The lag rises at once and decays slowly, and the part of the requests
+    rejected grows with it: none at `lag_ms`, all at twice as much. Past
+    `max_in_flight` all of them are. The paths starting with one of
+    `critical_paths` are always served.
+    """
+
+    def __init__(
+        self,
+        lag_ms: float,
+        max_in_flight: int,
+        check_interval_s: float,
+        critical_paths: Iterable[str],
+        retry_after_s: int,
+    ) -> None:
+        self._lag_threshold_ms = lag_ms
+        self._max_in_flight = max_in_flight
+        self._check_interval_s = check_interval_s
+        self._critical_paths = tuple(critical_paths)
+        self.retry_after_s = retry_after_s
+        self.lag_ms = 0.0
+        self.in_flight = 0
+        self.shed = 0
+        self._shedding = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self._check_interval_s)
+            elapsed = time.perf_counter() - start
+            self.record_lag(max(0.0, elapsed - self._check_interval_s) * 1000)
+
+    def record_lag(self, lag_ms: float) -> None:
+        if lag_ms >= self.lag_ms:
+            self.lag_ms = lag_ms
+        else:
+            self.lag_ms = 0.8 * self.lag_ms + 0.2 * lag_ms
+        shedding = self.shed_ratio() > 0
+        if shedding != self._shedding:
+            self._shedding = shedding
+            if shedding:
+                logger.warning(
+                    "Shedding load: loop lag %.0f ms, %d requests in flight.",
+                    self.lag_ms,
+                    self.in_flight,
+                )
+            else:
+                logger.info("Stopped shedding load, %s rejected.", self.shed)
+
+    def shed_ratio(self) -> float:
+        """
+        The part of the low priority requests to reject, 0 to 1.
+        """
+        if self.in_flight > self._max_in_flight:
+            return 1.0
+        over = (self.lag_ms - self._lag_threshold_ms) / self._lag_threshold_ms
+        return min(1.0, max(0.0, over))
+
+    def is_critical(self, path: str) -> bool:
+        return path.startswith(self._critical_paths)
+
+    def should_shed(self, path: str) -> bool:
+        if self.is_critical(path):
+            return False
+        ratio = self.shed_ratio()
+        return ratio >= 1.0 or (ratio > 0 and random.random() < ratio)
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "shedding": self.shed_ratio() > 0,
+            "shed_ratio": round(self.shed_ratio(), 2),
+            "loop_lag_ms": round(self.lag_ms, 1),
+            "in_flight": self.in_flight,
+            "shed": self.shed,
+        }
+
+
+class LoadSheddingMiddleware(BaseHTTPMiddleware):
+    """
+    Count the requests in flight and reject the shed ones with a 503 and
+    `Retry-After`, before any other work is done for them. A streamed body
+    is no longer counted once its headers are sent.
+    """
+
+    async def dispatch(self, req: Request, call_next):
+        if load_shedder.should_shed(req.url.path):
+            load_shedder.shed += 1
+            return JSONResponse(
+                {"detail": "Server overloaded, retry later."},
+                status_code=HTTP_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(load_shedder.retry_after_s)},
+            )
+        load_shedder.in_flight += 1
+        try:
+            return await call_next(req)
+        finally:
+            load_shedder.in_flight -= 1
+
+
+load_shedder = LoadShedder(
+    lag_ms=LOAD_SHED_LAG_MS,
+    max_in_flight=LOAD_SHED_MAX_IN_FLIGHT,
+    check_interval_s=LOAD_SHED_CHECK_INTERVAL_S,
+    critical_paths=LOAD_SHED_CRITICAL_PATHS,
+    retry_after_s=LOAD_SHED_RETRY_AFTER_S,
+)
@@ -0,0 +1,188 @@
+import copy
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from lib.config import (
+    LOG_LEVELS,
+    LOG_SAMPLED_LOGGERS,
+    LOG_QUEUE_SIZE,
+    LOG_SAMPLE_BURST,
+    LOG_SAMPLE_WINDOW_S,
+)
+
+
+# Secrets that may end up in a message: JWTs, bearer credentials, our API
+# keys, Stripe keys and cookies.
+REDACTIONS: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]+"), "<jwt>"),
+    (re.compile(r"(?i)(bearer\s+)[\w.~+/=-]+"), r"\1<redacted>"),
+    (re.compile(r"\b(pk|sk|rk|whsec)_[\w]+"), r"\1_<redacted>"),
+    (
+        re.compile(
+            r"(?i)((?:authorization|refresh_token|access_token|token"
+            r"|cookie|set-cookie|secret|password)['\"]?\s*[:=]\s*['\"]?)"
+            r"[^'\",;\s}]+"
+        ),
+        r"\1<redacted>",
+    ),
+]
+
+
+def redact(message: str) -> str:
+    for pattern, replacement in REDACTIONS:
+        message = pattern.sub(replacement, message)
+    return message
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Let at most `burst` DEBUG or INFO records per message template through
+    every `window_s` seconds, and count the others: the first record after
+    the window tells how many were dropped. Warnings and errors are always
+    kept.
+
+    Templates are the unformatted messages, so the %-style calls group
+    well while the f-string ones only group when equal.
+    """
+
+    def __init__(self, burst: int, window_s: float) -> None:
+        super().__init__()
+        self._burst = burst
+        self._window_s = window_s
+        # template -> [window start, count, dropped]
+        self._windows: Dict[Tuple[str, str], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self._burst <= 0:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self._window_s:
+                dropped = int(window[2]) if window else 0
+                self._windows[key] = [now, 1, 0]
+                if len(self._windows) > 10000:
+                    self._expire(now)
+                if dropped:
+                    record.msg = f"{record.msg} [{dropped} similar dropped]"
+                return True
+            window[1] += 1
+            if window[1] <= self._burst:
+                return True
+            window[2] += 1
+            return False
+
+    def _expire(self, now: float) -> None:
+        for key in [
+            key for key, (start, _count, _dropped) in self._windows.items()
+            if now - start >= self._window_s
+        ]:
+            del self._windows[key]
+
+
+class RedactingFormatter(logging.Formatter):
+    """
+    Format with `formatter`, then redact the line.
+    """
+
+    def __init__(self, formatter: Optional[logging.Formatter]) -> None:
+        super().__init__()
+        self._formatter = formatter or logging.Formatter()
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(self._formatter.format(record))
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue the records for the writer thread, which formats, redacts and
+    writes them: the calling thread, often the event loop, only copies the
+    record. The arguments are formatted by the writer, so log values that
+    do not change once the call returns, as the %-style calls here do.
+
+    A full queue drops the record rather than block the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # A copy per queue, each writer formats its own.
+        return copy.copy(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class LogPipeline:
+    """
+    Move the handlers of `loggers`, the uvicorn ones configured before the
+    app is imported, behind bounded queues written by background threads,
+    and set the levels of `levels`. Loggers without handlers, as out of
+    uvicorn, are left alone.
+
+    Each handler gets its own queue and writer thread, and keeps its
+    formatter, wrapped to redact the formatted lines.
+    """
+
+    def __init__(
+        self,
+        levels: Mapping[str, str],
+        sampled: Iterable[str],
+        queue_size: int,
+        sample_burst: int,
+        sample_window_s: float,
+    ) -> None:
+        self._levels = levels
+        self._sampled = set(sampled)
+        self._queue_size = queue_size
+        self._sampling = SamplingFilter(sample_burst, sample_window_s)
+        self._listeners: List[logging.handlers.QueueListener] = []
+
+    def start(self, loggers: Iterable[str]) -> None:
+        for name, level in self._levels.items():
+            logging.getLogger(name).setLevel(level)
+        if self._listeners:
+            return
+        for name in loggers:
+            logger = logging.getLogger(name)
+            for handler in list(logger.handlers):
+                queued = NonBlockingQueueHandler(
+                    queue.Queue(self._queue_size)
+                )
+                queued.setLevel(handler.level)
+                if name in self._sampled:
+                    queued.addFilter(self._sampling)
+                handler.setFormatter(RedactingFormatter(handler.formatter))
+                logger.removeHandler(handler)
+                logger.addHandler(queued)
+                listener = logging.handlers.QueueListener(
+                    queued.queue, handler, respect_handler_level=True
+                )
+                listener.start()
+                self._listeners.append(listener)
+
+    def stop(self) -> None:
+        """
+        Write the queued records and stop the writers.
+        """
+        for listener in self._listeners:
+            listener.stop()
+        self._listeners = []
+
+
+log_pipeline = LogPipeline(
+    levels=LOG_LEVELS,
+    sampled=LOG_SAMPLED_LOGGERS,
+    queue_size=LOG_QUEUE_SIZE,
+    sample_burst=LOG_SAMPLE_BURST,
+    sample_window_s=LOG_SAMPLE_WINDOW_S,
+)
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+
+from collections import Counter
+from typing import Any, List, Mapping, Optional, Tuple
+
+from lib.config import STRIPE_CHECKOUT_EXPIRE_S
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from models.job_checkpoint import JobCheckpoint
+from models.payment import Payment, Status
+
+
+logger = logging.getLogger("uvicorn.error")
+
+CHECKPOINT_NAME = "payment_reconciler"
+
+
+def session_payment_status(session: Mapping[str, Any]) -> Optional[Status]:
+    """
+    Final payment status of a Stripe checkout session, None while open.
+    """
+    if session["status"] == "complete":
+        if session["payment_status"] in ("paid", "no_payment_required"):
+            return Status.SUCCESS
+        # Delayed payment methods, wait for the funds.
+        return None
+    if session["status"] == "expired":
+        return Status.CANCELED
+    return None
+
+
+class PaymentReconciler:
+    """
+    Settle the payments left PENDING, e.g. when the user never came back
+    from the checkout page and no webhook made it.
+
+    Pages through the PENDING payments older than `min_age_s` by id,
+    `batch_size` at a time, asks Stripe for their checkout sessions with at
+    most `concurrency` calls in flight, then settles the batch and saves the
+    last id in one transaction. An interrupted run resumes after the last
+    committed batch; a complete pass resets the checkpoint.
+
+    `client` is `lib.stripe_client.StripeClient` or, in tests,
+    `lib.stripe_stub.StripeStub`.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        batch_size: int,
+        concurrency: int,
+        min_age_s: int,
+    ) -> None:
+        self._client = client
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._min_age_s = min_age_s
+
+    async def run(self, resume: bool = True) -> Mapping[str, int]:
+        """
+        Reconcile all the PENDING payments, return counts by outcome.
+        """
+        report: Counter = Counter()
+        after_id = 0
+        if resume:
+            after_id = int(JobCheckpoint.get(CHECKPOINT_NAME) or 0)
+        create_before = int(time.time()) - self._min_age_s
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        while True:
+            payments = Payment.list_pending(
+                after_id, create_before, self._batch_size
+            )
+            if not payments:
+                break
+            statuses = await asyncio.gather(
+                *(self._resolve(p, semaphore, report) for p in payments)
+            )
+            after_id = payments[-1].id
+            self._apply(
+                [(p.id, s) for p, s in zip(payments, statuses) if s], after_id
+            )
+            for status in statuses:
+                report[status.name if status else "PENDING"] += 1
+
+        self._save_checkpoint(0)
+        logger.info("Reconciled pending payments: %s", dict(report))
+        return report
+
+    async def _resolve(
+        self,
+        payment: Payment,
+        semaphore: asyncio.Semaphore,
+        report: Counter,
+    ) -> Optional[Status]:
+        if not payment.session_id:
+            # The checkout session was never created.
+            if payment.create_at < time.time() - STRIPE_CHECKOUT_EXPIRE_S:
+                return Status.FAILED
+            return None
+        async with semaphore:
+            try:
+                session = await self._client.retrieve_checkout_session(
+                    payment.session_id
+                )
+            except Exception as e:
+                logger.error(
+                    "[payment id: %s] Failed to retrieve "
+                    "checkout session: %s due to: %s",
+                    payment.id, payment.session_id, e,
+                )
+                report["ERROR"] += 1
+                return None
+        return session_payment_status(session)
+
+    def _apply(
+        self,
+        settles: List[Tuple[int, Status]],
+        checkpoint: int,
+    ) -> None:
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            for id, status in settles:
+                if Payment.settle(cursor, id, status):
+                    logger.info(
+                        "[payment id: %s] reconciled as %s",
+                        id, status.name,
+                    )
+            JobCheckpoint.set(cursor, CHECKPOINT_NAME, str(checkpoint))
+            connection.commit()
+
+    def _save_checkpoint(self, checkpoint: int) -> None:
+        with SQLiteConnectionManager().connect() as connection:
+            JobCheckpoint.set(
+                connection.cursor(), CHECKPOINT_NAME, str(checkpoint)
+            )
+            connection.commit()
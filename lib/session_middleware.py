@@ -0,0 +1,75 @@
+import logging
+
+from http.cookies import SimpleCookie
+from fastapi import Request
+from fastapi.security.utils import get_authorization_scheme_param
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from lib.config import ACCESS_TOKEN_REFRESH_WINDOW_S
+from lib.const import COOKIE_TOKEN_KEY, REFRESH_COOKIE_KEY
+from lib.token_util import (
+    Token,
+    now,
+    refresh_access_token,
+    set_cookie_encoded_token,
+    delete_cookie_refresh_token,
+)
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _needs_refresh(auth: str) -> bool:
+    if not auth:
+        return True
+    _scheme, encoded_token = get_authorization_scheme_param(auth)
+    expire_at = Token.expire_at(encoded_token)
+    if expire_at is None:
+        return True
+    return expire_at - now() <= ACCESS_TOKEN_REFRESH_WINDOW_S
+
+
+def _replace_cookie(req: Request, key: str, value: str) -> None:
+    """
+    Rewrite the cookie header of the request scope, so the token bearers
+    downstream see the refreshed access token.
+    """
+    cookies = SimpleCookie()
+    for k, v in req.cookies.items():
+        cookies[k] = v
+    cookies[key] = value
+    cookie_header = "; ".join(m.OutputString() for m in cookies.values())
+    headers = [(k, v) for k, v in req.scope["headers"] if k != b"cookie"]
+    headers.append((b"cookie", cookie_header.encode("latin-1")))
+    req.scope["headers"] = headers
+
+
+class SessionRefreshMiddleware(BaseHTTPMiddleware):
+    """
+    Sliding session: when a request carries a refresh cookie and its access
+    token is missing, expired or about to expire, issue a new access token
+    from the server side refresh record. The request continues with the new
+    token and the response sets it as cookie, so the user never goes through
+    the Google redirect flow again until the refresh record is revoked or
+    expired.
+    """
+
+    async def dispatch(self, req: Request, call_next):
+        refresh_token = req.cookies.get(REFRESH_COOKIE_KEY)
+        if (
+            not refresh_token
+            or not _needs_refresh(req.cookies.get(COOKIE_TOKEN_KEY))
+        ):
+            return await call_next(req)
+
+        access_token = await refresh_access_token(refresh_token)
+        if not access_token:
+            # Let the token bearer reject the request as before, and drop
+            # the dead refresh cookie so it is not looked up again.
+            rsp = await call_next(req)
+            return delete_cookie_refresh_token(rsp)
+
+        token_encoded = await access_token.encode()
+        _replace_cookie(req, COOKIE_TOKEN_KEY, f"Bearer {token_encoded}")
+        rsp = await call_next(req)
+        return set_cookie_encoded_token(rsp, token_encoded)
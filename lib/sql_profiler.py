@@ -0,0 +1,335 @@
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from lib.config import (
+    SQL_PROFILER_ENABLED,
+    SQL_PROFILER_SLOW_MS,
+    SQL_PROFILER_SAMPLES,
+    SQL_PROFILER_MAX_STATEMENTS,
+    SQL_PROFILER_SLOW_LOG_SIZE,
+    SQL_PROFILER_REPORT_FILE,
+)
+
+
+logger = logging.getLogger("uvicorn.error")
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+SPACE_RE = re.compile(r"\s+")
+# The chunked "IN ( ?, ?, ... )" lists, whatever their length.
+LIST_RE = re.compile(r"\?(?:\s*,\s*\?)+")
+ORDERS = ("total", "p99", "count", "max")
+
+MODELS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models"
+)
+
+
+def normalize(sql: str) -> str:
+    """
+    The statement without its literals, the key statements are grouped by.
+    """
+    sql = STRING_RE.sub("?", sql)
+    sql = NUMBER_RE.sub("?", sql)
+    sql = SPACE_RE.sub(" ", sql).strip()
+    return LIST_RE.sub("?, ...", sql)
+
+
+def call_site() -> str:
+    """
+    The innermost models/* frame issuing the statement, else the first
+    frame out of this module.
+    """
+    frame = sys._getframe(2)
+    site = None
+    while frame is not None:
+        file = frame.f_code.co_filename
+        if file.startswith(MODELS_DIR):
+            site = frame
+            break
+        if site is None and file != __file__:
+            site = frame
+        frame = frame.f_back
+    if site is None:
+        return "?"
+    return (
+        f"{os.path.basename(site.f_code.co_filename)}:{site.f_lineno} "
+        f"{site.f_code.co_name}"
+    )
+
+
+class StatementStats:
+    __slots__ = ("count", "total_ms", "max_ms", "rows", "samples", "sites")
+
+    def __init__(self, samples: int) -> None:
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        # The latest durations, for the percentiles.
+        self.samples: Deque[float] = deque(maxlen=samples)
+        self.sites: Counter = Counter()
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+
+
+class SqlProfiler:
+    """
+    Statistics of the statements run on the profiled connections, grouped
+    by normalized SQL: count, total, max and p99 durations, rows and call
+    sites. The statements slower than `slow_ms` are kept, the latest
+    `slow_log_size` of them, with their EXPLAIN QUERY PLAN.
+
+    The duration of a SELECT includes the fetches, so a statement is
+    recorded once its rows are read, or its cursor reused or dropped.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        slow_ms: float,
+        samples: int,
+        max_statements: int,
+        slow_log_size: int,
+        report_file: Optional[str] = None,
+    ) -> None:
+        self.enabled = enabled
+        self._report_file = report_file
+        self._slow_ms = slow_ms
+        self._samples = samples
+        self._max_statements = max_statements
+        self._stats: Dict[str, StatementStats] = {}
+        self._slow: Deque[Dict[str, Any]] = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self._since = time.time()
+
+    def record(
+        self,
+        connection: sqlite3.Connection,
+        sql: str,
+        params: Any,
+        duration_ms: float,
+        rows: int,
+        site: str,
+    ) -> None:
+        key = normalize(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self._max_statements:
+                    key = "<other>"
+                    stats = self._stats.setdefault(
+                        key, StatementStats(self._samples)
+                    )
+                else:
+                    stats = self._stats[key] = StatementStats(self._samples)
+            stats.count += 1
+            stats.total_ms += duration_ms
+            stats.max_ms = max(stats.max_ms, duration_ms)
+            stats.rows += rows
+            stats.samples.append(duration_ms)
+            stats.sites[site] += 1
+        if duration_ms >= self._slow_ms:
+            self._slow.append({
+                "sql": key,
+                "duration_ms": round(duration_ms, 3),
+                "rows": rows,
+                "site": site,
+                "at": int(time.time()),
+                "plan": explain(connection, sql, params),
+            })
+
+    def report(self, top: int = 20, order: str = "total") -> Dict[str, Any]:
+        """
+        The `top` statements by total, p99, count or max time, and the
+        latest slow ones.
+        """
+        if order not in ORDERS:
+            raise ValueError(f"Expect order in {ORDERS}, got: {order}")
+        with self._lock:
+            statements = [
+                {
+                    "sql": sql,
+                    "count": s.count,
+                    "total_ms": round(s.total_ms, 3),
+                    "mean_ms": round(s.total_ms / s.count, 3),
+                    "p99_ms": round(s.percentile(0.99), 3),
+                    "max_ms": round(s.max_ms, 3),
+                    "rows": s.rows,
+                    "sites": dict(s.sites.most_common(3)),
+                }
+                for sql, s in self._stats.items()
+            ]
+            slow = list(self._slow)
+        field = {"total": "total_ms", "p99": "p99_ms", "max": "max_ms"}
+        statements.sort(key=lambda s: s[field.get(order, order)], reverse=True)
+        return {
+            "since": int(self._since),
+            "statements": statements[:top],
+            "slow": slow[::-1],
+        }
+
+    def dump(self, top: int = 100) -> None:
+        """
+        Write the report to `report_file`, for scripts/sql_profile.py.
+        """
+        if not self.enabled or not self._report_file:
+            return
+        with open(self._report_file, "w", encoding="utf-8") as f:
+            json.dump(self.report(top), f)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+            self._since = time.time()
+
+
+def explain(connection: sqlite3.Connection, sql: str, params: Any) -> str:
+    if not sql.lstrip().upper().startswith(
+        ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+    ):
+        return ""
+    try:
+        # A plain cursor, not profiled.
+        cursor = sqlite3.Cursor(connection)
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+        return "\n".join(row[-1] for row in cursor.fetchall())
+    except Exception as e:
+        return f"Failed to explain: {e}"
+
+
+sql_profiler = SqlProfiler(
+    enabled=SQL_PROFILER_ENABLED,
+    slow_ms=SQL_PROFILER_SLOW_MS,
+    samples=SQL_PROFILER_SAMPLES,
+    max_statements=SQL_PROFILER_MAX_STATEMENTS,
+    slow_log_size=SQL_PROFILER_SLOW_LOG_SIZE,
+    report_file=SQL_PROFILER_REPORT_FILE,
+)
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """
+    Cursor recording its statements to `sql_profiler`.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._statement: Optional[List[Any]] = None
+
+    def execute(self, sql: str, params: Any = ()):
+        self._finish()
+        site = call_site()
+        start = time.perf_counter()
+        try:
+            super().execute(sql, params)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            # sql, params, ms, rows, site
+            self._statement = [sql, params, elapsed, 0, site]
+            if self.description is None:
+                # Nothing to fetch.
+                self._statement[3] = max(self.rowcount, 0)
+                self._finish()
+        return self
+
+    def executemany(self, sql: str, seq_of_params: Any):
+        self._finish()
+        site = call_site()
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_params)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self._statement = [sql, None, elapsed, max(self.rowcount, 0), site]
+            self._finish()
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1, row is None)
+        return row
+
+    def fetchmany(self, size: Optional[int] = None):
+        start = time.perf_counter()
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size)
+        self._fetched(start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0, True)
+            raise
+        self._fetched(start, 1, False)
+        return row
+
+    def close(self) -> None:
+        self._finish()
+        super().close()
+
+    def __del__(self) -> None:
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def _fetched(self, start: float, rows: int, done: bool) -> None:
+        if self._statement is None:
+            return
+        self._statement[2] += (time.perf_counter() - start) * 1000
+        self._statement[3] += rows
+        if done:
+            self._finish()
+
+    def _finish(self) -> None:
+        statement, self._statement = self._statement, None
+        if statement is None:
+            return
+        sql, params, elapsed, rows, site = statement
+        try:
+            sql_profiler.record(
+                self.connection, sql, params, elapsed, rows, site
+            )
+        except Exception as e:
+            logger.error("Failed to profile statement: %s: %s", sql, e)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """
+    Connection whose cursors are profiled, see `SqlProfiler`.
+    """
+
+    def cursor(self, factory: Any = ProfiledCursor):
+        return super().cursor(factory)
+
+
+def connection_factory() -> type:
+    if sql_profiler.enabled:
+        return ProfiledConnection
+    return sqlite3.Connection
@@ -1,5 +1,18 @@
 import sqlite3
+
+from typing import Any, Iterator, List
+
 from lib.config import SQLITE_DB_FILE
+from lib.sql_profiler import connection_factory
+
+
+# Stay well below SQLITE_MAX_VARIABLE_NUMBER (999 before sqlite 3.32).
+MAX_SQL_VARIABLES = 500
+
+
+def chunks(items: List[Any], size: int) -> Iterator[List[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 class SQLiteConnectionManager:
@@ -17,7 +30,9 @@ class SQLiteConnectionManager:
 
     def connect(self):
         if self._conn is None:
-            self._conn = sqlite3.connect(self._db_file)
+            self._conn = sqlite3.connect(
+                self._db_file, factory=connection_factory()
+            )
         return self._conn
 
     def close(self):
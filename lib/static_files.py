@@ -0,0 +1,298 @@
+import anyio
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+import threading
+
+from collections import OrderedDict
+from email.utils import formatdate
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Receive, Scope, Send
+from typing import Callable, Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+from lib.compression import BROTLI, GZIP, negotiate
+from lib.config import (
+    STATIC_CACHE_MAX_BYTES,
+    STATIC_CACHE_MAX_FILE_BYTES,
+    STATIC_IMMUTABLE_MAX_AGE_S,
+)
+from lib.ttl_cache import TTLCache
+
+
+# Hashed file names of the bundler output, e.g. main.3f2a9c1b.chunk.js or
+# index-D8k2Lq1a.css: a new content gets a new name.
+FINGERPRINT_RE = re.compile(
+    r"[.-](?=[A-Za-z0-9_]*\d)[A-Za-z0-9_]{8,}(?:\.chunk)?"
+    r"\.(?:m?js|css|map|woff2?|ttf|otf|svg|png|jpe?g|gif|webp|avif|ico)$"
+)
+# Suffixes of the precompressed variants, see scripts/precompress_static.py.
+VARIANTS = {BROTLI: ".br", GZIP: ".gz"}
+
+
+def is_immutable(path: str) -> bool:
+    return FINGERPRINT_RE.search(path) is not None
+
+
+class _Entry(NamedTuple):
+    mtime: float  # of the original file
+    size: int
+    body: bytes
+    headers: Dict[str, str]
+
+
+class _ReadResponse(Response):
+    """
+    A file read in the threadpool when sent, not when the response is
+    made, then handed to `on_read`.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        headers: Dict[str, str],
+        on_read: Callable[[bytes], None],
+    ) -> None:
+        super().__init__(headers=headers)
+        self._file_path = file_path
+        self._on_read = on_read
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.body = await anyio.to_thread.run_sync(self._read)
+        self.headers["content-length"] = str(len(self.body))
+        self._on_read(self.body)
+        await super().__call__(scope, receive, send)
+
+    def _read(self) -> bytes:
+        with open(self._file_path, "rb") as f:
+            return f.read()
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles for the UI bundle:
+
+    - fingerprinted assets are cached by browsers for a year, the rest,
+      like index.html, revalidated with the ETag;
+    - a `.br` or `.gz` file next to the requested one is sent instead when
+      the client accepts it;
+    - files up to `max_file_bytes` are kept in memory, `max_bytes` in all,
+      the least recently used evicted first, by path and coding sent. The
+      fingerprinted ones are then served without touching the disk, the
+      others after a stat. Bigger files are streamed by FileResponse, with
+      sendfile where the server supports it.
+
+    The disk is only read in the threadpool: the variants are looked up
+    with the file, in `lookup_path`, and the files read when sent.
+    """
+
+    def __init__(
+        self,
+        *args,
+        max_bytes: int = STATIC_CACHE_MAX_BYTES,
+        max_file_bytes: int = STATIC_CACHE_MAX_FILE_BYTES,
+        immutable_max_age_s: int = STATIC_IMMUTABLE_MAX_AGE_S,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self._max_bytes = max_bytes
+        self._max_file_bytes = max_file_bytes
+        self._immutable_cache_control = (
+            f"public, max-age={immutable_max_age_s}, immutable"
+        )
+        self._entries: "OrderedDict[Tuple[str, Optional[str]], _Entry]" = (
+            OrderedDict()
+        )
+        self._size = 0
+        # (variant path, original mtime) -> its stat, None if missing.
+        # Filled by `lookup_path` in the threadpool.
+        self._variants: TTLCache[Tuple[Optional[os.stat_result]]] = TTLCache(
+            max_size=4096, ttl_s=60
+        )
+        self._variants_lock = threading.Lock()
+        # Path -> the codings of its variants, for the fingerprinted files
+        # served from memory.
+        self._codings: TTLCache[FrozenSet[str]] = TTLCache(
+            max_size=4096, ttl_s=3600
+        )
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] == "GET" and is_immutable(path):
+            codings = self._codings.get(path)
+            if codings is not None:
+                headers = Headers(scope=scope)
+                encoding = None
+                if codings:
+                    encoding = negotiate(
+                        headers.get("accept-encoding"), codings
+                    )
+                entry = self._get(path, encoding)
+                if entry is not None:
+                    return self._cached_response(entry, headers)
+        return await super().get_response(path, scope)
+
+    def lookup_path(self, path: str) -> Tuple[str, Optional[os.stat_result]]:
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            for encoding in VARIANTS:
+                self._stat_variant(full_path, stat_result, encoding)
+        return full_path, stat_result
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        path = self.get_path(scope)
+        request_headers = Headers(scope=scope)
+        variants = {
+            encoding: variant
+            for encoding in VARIANTS
+            for variant in [self._variant(full_path, stat_result, encoding)]
+            if variant is not None
+        }
+        self._codings.set(path, frozenset(variants))
+        encoding = None
+        if variants:
+            encoding = negotiate(
+                request_headers.get("accept-encoding"), variants
+            )
+        entry = self._get(path, encoding)
+        if (
+            entry is not None
+            and entry.mtime == stat_result.st_mtime
+            and entry.size == stat_result.st_size
+        ):
+            return self._cached_response(entry, request_headers)
+
+        file_path, file_stat = full_path, stat_result
+        if encoding is not None:
+            file_path = full_path + VARIANTS[encoding]
+            file_stat = variants[encoding]
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+
+        if (
+            scope["method"] != "GET"
+            or status_code != 200
+            or file_stat.st_size > self._max_file_bytes
+        ):
+            response = FileResponse(
+                file_path,
+                status_code=status_code,
+                stat_result=file_stat,
+                method=scope["method"],
+                media_type=media_type,
+            )
+            self._set_headers(response.headers, path, encoding)
+            if self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+
+        headers = {
+            "content-type": media_type,
+            "etag": etag(file_stat),
+            "last-modified": formatdate(file_stat.st_mtime, usegmt=True),
+        }
+        if media_type.startswith("text/"):
+            headers["content-type"] += "; charset=utf-8"
+        self._set_headers(headers, path, encoding)
+
+        def on_read(body: bytes) -> None:
+            entry = _Entry(
+                stat_result.st_mtime, stat_result.st_size, body, headers
+            )
+            self._set(path, encoding, entry)
+
+        response = _ReadResponse(
+            file_path,
+            {**headers, "content-length": str(file_stat.st_size)},
+            on_read,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _set_headers(
+        self,
+        headers: Dict[str, str],
+        path: str,
+        encoding: Optional[str],
+    ) -> None:
+        if is_immutable(path):
+            headers["cache-control"] = self._immutable_cache_control
+        else:
+            headers["cache-control"] = "no-cache"
+        if encoding:
+            headers["content-encoding"] = encoding
+        headers["vary"] = "Accept-Encoding"
+
+    def _cached_response(self, entry: _Entry, request_headers: Headers):
+        response = Response(entry.body, headers=entry.headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _variant(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        encoding: str,
+    ) -> Optional[os.stat_result]:
+        """
+        The stat of the variant found by `lookup_path`, None if missing,
+        or not looked up: the disk is not touched from the event loop.
+        """
+        key = (full_path + VARIANTS[encoding], stat_result.st_mtime)
+        with self._variants_lock:
+            cached = self._variants.get(key)
+        return cached[0] if cached else None
+
+    def _stat_variant(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        encoding: str,
+    ) -> None:
+        key = (full_path + VARIANTS[encoding], stat_result.st_mtime)
+        with self._variants_lock:
+            if key in self._variants:
+                return
+        try:
+            variant = os.stat(key[0])
+            # Stale if older than the file it was made from.
+            if variant.st_mtime < stat_result.st_mtime:
+                variant = None
+        except OSError:
+            variant = None
+        with self._variants_lock:
+            self._variants.set(key, (variant,))
+
+    def _get(self, path: str, encoding: Optional[str]) -> Optional[_Entry]:
+        entry = self._entries.get((path, encoding))
+        if entry is not None:
+            self._entries.move_to_end((path, encoding))
+        return entry
+
+    def _set(self, path: str, encoding: Optional[str], entry: _Entry) -> None:
+        old = self._entries.pop((path, encoding), None)
+        if old is not None:
+            self._size -= len(old.body)
+        self._entries[(path, encoding)] = entry
+        self._size += len(entry.body)
+        while self._size > self._max_bytes and self._entries:
+            _key, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted.body)
+
+
+def etag(stat_result: os.stat_result) -> str:
+    """
+    Same as FileResponse, so both ways of serving agree.
+    """
+    base = f"{stat_result.st_mtime}-{stat_result.st_size}"
+    return f'"{hashlib.md5(base.encode(), usedforsecurity=False).hexdigest()}"'
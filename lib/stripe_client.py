@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from lib.config import STRIPE_API_KEY, STRIPE_MAX_WORKERS, STRIPE_TIMEOUT_S
+from lib.lazy_import import lazy_import
+from lib.tracing import span
+
+
+logger = logging.getLogger("uvicorn.error")
+
+stripe = lazy_import("stripe")
+
+
+class StripeClient:
+    """
+    Async facade of the blocking `stripe` SDK.
+
+    Calls run on a small thread pool, so a Stripe round trip never blocks
+    the event loop. Each pool thread keeps its own pooled `requests`
+    session (see `stripe.http_client.RequestsClient`), and every call is
+    bounded by `timeout_s` both at the HTTP level and on the await.
+
+    The SDK is imported and configured on the first call, not at startup.
+    """
+
+    def __init__(self, api_key: str, max_workers: int, timeout_s: float):
+        self._api_key = api_key
+        self._configured = False
+        self._timeout_s = timeout_s
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="stripe",
+        )
+
+    def _sdk(self) -> Any:
+        if not self._configured:
+            stripe.api_key = self._api_key
+            stripe.default_http_client = stripe.http_client.RequestsClient(
+                timeout=self._timeout_s
+            )
+            self._configured = True
+        return stripe
+
+    async def _call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        with span("stripe", call=fn.__qualname__):
+            return await asyncio.wait_for(
+                loop.run_in_executor(
+                    self._executor, functools.partial(fn, *args, **kwargs)
+                ),
+                # Leave the HTTP timeout a chance to fire first.
+                timeout=self._timeout_s + 1,
+            )
+
+    async def create_checkout_session(self, **params) -> Any:
+        return await self._call(
+            self._sdk().checkout.Session.create, **params
+        )
+
+    async def retrieve_checkout_session(self, session_id: str) -> Any:
+        return await self._call(
+            self._sdk().checkout.Session.retrieve, session_id
+        )
+
+    async def expire_checkout_session(self, session_id: str) -> Any:
+        return await self._call(
+            self._sdk().checkout.Session.expire, session_id
+        )
+
+
+stripe_client = StripeClient(
+    api_key=STRIPE_API_KEY,
+    max_workers=STRIPE_MAX_WORKERS,
+    timeout_s=STRIPE_TIMEOUT_S,
+)
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import uuid
+
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+
+def sign(payload: str, secret: str, timestamp: Optional[int] = None) -> str:
+    """
+    Return the 'Stripe-Signature' header Stripe would send for `payload`.
+    https://stripe.com/docs/webhooks#verify-manually
+    """
+    timestamp = timestamp or int(time.time())
+    signature = hmac.new(
+        secret.encode("utf-8"),
+        f"{timestamp}.{payload}".encode("utf-8"),
+        hashlib.sha256,
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def make_event(
+    type: str,
+    data_object: Mapping[str, Any],
+    id: Optional[str] = None,
+) -> Mapping[str, Any]:
+    return {
+        "id": id or f"evt_stub_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": type,
+        "created": int(time.time()),
+        "data": {"object": dict(data_object)},
+    }
+
+
+def signed_event(
+    event: Mapping[str, Any],
+    secret: str,
+) -> Tuple[str, str]:
+    """
+    Return the (payload, signature header) to POST to the webhook.
+    """
+    payload = json.dumps(event)
+    return payload, sign(payload, secret)
+
+
+class StripeStub:
+    """
+    Local stand-in of `lib.stripe_client.StripeClient` serving checkout
+    sessions from memory. It records the calls and the peak concurrency.
+    """
+
+    def __init__(self, latency_s: float = 0) -> None:
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.latency_s = latency_s
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def add_session(
+        self,
+        status: str,
+        payment_status: str = "unpaid",
+        client_reference_id: Optional[str] = None,
+    ) -> str:
+        id = f"cs_stub_{uuid.uuid4().hex}"
+        self.sessions[id] = {
+            "id": id,
+            "object": "checkout.session",
+            "status": status,
+            "payment_status": payment_status,
+            "client_reference_id": client_reference_id,
+            "url": f"https://checkout.stripe.test/{id}",
+            "expires_at": int(time.time()) + 3600,
+        }
+        return id
+
+    async def create_checkout_session(self, **params) -> Dict[str, Any]:
+        id = self.add_session(
+            "open", client_reference_id=params.get("client_reference_id")
+        )
+        return await self._respond(self.sessions[id])
+
+    async def retrieve_checkout_session(
+        self,
+        session_id: str,
+    ) -> Dict[str, Any]:
+        if session_id not in self.sessions:
+            raise KeyError(f"No such checkout.session: {session_id}")
+        return await self._respond(self.sessions[session_id])
+
+    async def expire_checkout_session(
+        self,
+        session_id: str,
+    ) -> Dict[str, Any]:
+        session = self.sessions.get(session_id)
+        if session is None or session["status"] != "open":
+            raise KeyError(f"Can not expire checkout.session: {session_id}")
+        session["status"] = "expired"
+        return await self._respond(session)
+
+    async def _respond(self, session: Dict[str, Any]) -> Dict[str, Any]:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency_s)
+        finally:
+            self.in_flight -= 1
+        return dict(session)
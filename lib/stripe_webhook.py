@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+
+from typing import Any, List, Mapping, Optional, Set
+
+from lib.config import (
+    STRIPE_EVENT_WORKERS,
+    STRIPE_EVENT_BATCH_SIZE,
+    STRIPE_EVENT_QUEUE_SIZE,
+    STRIPE_EVENT_SWEEP_S,
+    STRIPE_EVENT_MAX_ATTEMPTS,
+)
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from models.payment import Payment, Status as PaymentStatus
+from models.stripe_event import StripeEvent, Status as EventStatus
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+# Final payment status by checkout session event type. For
+# 'checkout.session.completed' it depends on the session 'payment_status'.
+PAYMENT_STATUS_BY_EVENT = {
+    "checkout.session.async_payment_succeeded": PaymentStatus.SUCCESS,
+    "checkout.session.async_payment_failed": PaymentStatus.FAILED,
+    "checkout.session.expired": PaymentStatus.CANCELED,
+}
+
+
+def payment_status(
+    event_type: str,
+    session: Mapping[str, Any],
+) -> Optional[PaymentStatus]:
+    if event_type == "checkout.session.completed":
+        if session.get("payment_status") in ("paid", "no_payment_required"):
+            return PaymentStatus.SUCCESS
+        # Delayed payment methods, wait for 'async_payment_*'.
+        return None
+    return PAYMENT_STATUS_BY_EVENT.get(event_type)
+
+
+class StripeEventProcessor:
+    """
+    Process the stored webhook events off the request path.
+
+    The webhook handler only stores the event and `submit`s it. `workers`
+    tasks drain the bounded queue in batches of up to `batch_size` events
+    and apply each batch in one transaction. When the queue is full the
+    event simply waits in the 'stripe_event' table: every `sweep_interval_s`
+    the pending events, including the ones left by a restart or a failed
+    batch, are queued again until `max_attempts`.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        batch_size: int,
+        queue_size: int,
+        sweep_interval_s: float,
+        max_attempts: int,
+    ) -> None:
+        self._workers = workers
+        self._batch_size = batch_size
+        self._queue_size = queue_size
+        self._sweep_interval_s = sweep_interval_s
+        self._max_attempts = max_attempts
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._tasks = [
+            asyncio.create_task(self._work()) for _ in range(self._workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, event: StripeEvent) -> bool:
+        """
+        Queue a stored event, return False if it is left to the sweeper.
+        """
+        if self._queue is None:
+            return False
+        if event.id in self._queued:
+            return True
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("Stripe event queue full, deferred: %s", event.id)
+            return False
+        self._queued.add(event.id)
+        return True
+
+    def process(self, events: List[StripeEvent]) -> None:
+        """
+        Apply the events and record the results in one transaction.
+        """
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            results = [(e.id, self._apply(cursor, e)) for e in events]
+            StripeEvent.mark_many(cursor, results)
+            connection.commit()
+
+    def _apply(self, cursor: Any, event: StripeEvent) -> EventStatus:
+        try:
+            session = json.loads(event.payload)["data"]["object"]
+        except (ValueError, KeyError, TypeError):
+            logger.error("Malformed Stripe event: %s", event.id)
+            return EventStatus.FAILED
+
+        status = payment_status(event.type, session)
+        if status is None:
+            return EventStatus.IGNORED
+
+        payment_id: Optional[int] = None
+        if session.get("client_reference_id"):
+            payment_id = int(session["client_reference_id"])
+        elif session.get("id"):
+            payment_id = Payment.id_by_session(cursor, session["id"])
+        if payment_id is None:
+            logger.error("Stripe event: %s matches no payment.", event.id)
+            return EventStatus.FAILED
+
+        if Payment.settle(cursor, payment_id, status):
+            logger.info(
+                "[payment id: %s] settled as %s by Stripe event: %s",
+                payment_id, status.name, event.id,
+            )
+        return EventStatus.DONE
+
+    async def _work(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                self._process_or_isolate(batch)
+            finally:
+                for event in batch:
+                    self._queued.discard(event.id)
+                    self._queue.task_done()
+            # Let the requests run between two batches.
+            await asyncio.sleep(0)
+
+    def _process_or_isolate(self, batch: List[StripeEvent]) -> None:
+        try:
+            self.process(batch)
+            return
+        except Exception as e:
+            logger.exception(
+                "Failed to process %s Stripe events due to: %s",
+                len(batch), e,
+            )
+        # Retry one by one, so one bad event doesn't fail the others.
+        for event in batch:
+            try:
+                self.process([event])
+            except Exception as e:
+                logger.exception(
+                    "Failed to process Stripe event: %s due to: %s",
+                    event.id, e,
+                )
+                self._record_attempt(event)
+
+    def _record_attempt(self, event: StripeEvent) -> None:
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                StripeEvent.mark_many(
+                    connection.cursor(), [(event.id, EventStatus.PENDING)]
+                )
+                connection.commit()
+        except Exception as e:
+            logger.error("Failed to record Stripe event attempt: %s", e)
+
+    async def _sweep(self) -> None:
+        while True:
+            try:
+                for event in StripeEvent.list_pending(
+                    max_attempts=self._max_attempts,
+                    limit=self._queue_size,
+                ):
+                    if not self.submit(event):
+                        break
+            except Exception as e:
+                logger.error("Failed to sweep pending Stripe events: %s", e)
+            await asyncio.sleep(self._sweep_interval_s)
+
+
+stripe_event_processor = StripeEventProcessor(
+    workers=STRIPE_EVENT_WORKERS,
+    batch_size=STRIPE_EVENT_BATCH_SIZE,
+    queue_size=STRIPE_EVENT_QUEUE_SIZE,
+    sweep_interval_s=STRIPE_EVENT_SWEEP_S,
+    max_attempts=STRIPE_EVENT_MAX_ATTEMPTS,
+)
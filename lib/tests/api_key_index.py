@@ -0,0 +1,139 @@
+import asyncio
+import unittest
+
+from fastapi.testclient import TestClient
+from unittest import mock
+
+from app import app
+from lib.api_key_index import ApiKeyIndex, TokenBucket, api_key_index
+from lib.exception import (
+    RateLimitException,
+    UserAuthorizationException,
+    UserForbiddenException,
+)
+from lib.tests.db import use_memory_db
+from lib.token_util import AccessToken
+from models.api_key import ApiKey, Scope
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_refills(self) -> None:
+        with mock.patch("time.monotonic", return_value=100.0) as clock:
+            bucket = TokenBucket(rate_per_minute=3)
+            self.assertTrue(all(bucket.take() for _ in range(3)))
+            self.assertFalse(bucket.take())
+            clock.return_value = 120.0
+            self.assertTrue(bucket.take())
+            self.assertFalse(bucket.take())
+            # Never more than the burst.
+            clock.return_value = 1000.0
+            self.assertEqual(sum(bucket.take() for _ in range(10)), 3)
+
+
+class ApiKeyIndexTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 10)"
+        )
+        self.db.commit()
+
+    def test_authenticate(self) -> None:
+        index = ApiKeyIndex(sync_interval_s=3600)
+        _api_key, key = ApiKey.new(1, "ci", {Scope.WORKFLOW}, 2)
+        # Created by another process: picked up on the first check.
+        with mock.patch("time.monotonic", return_value=1.0):
+            self.assertEqual(index.authenticate(key, Scope.WORKFLOW), 1)
+
+            with self.assertRaises(UserForbiddenException):
+                index.authenticate(key, Scope.OPENAI)
+            index.authenticate(key, Scope.WORKFLOW)
+            with self.assertRaises(RateLimitException):
+                index.authenticate(key, Scope.WORKFLOW)
+
+    def test_unknown_key_not_logged(self) -> None:
+        index = ApiKeyIndex(sync_interval_s=3600)
+        key = "pk_secretsecretsecret"
+        with self.assertLogs("uvicorn.error") as logs:
+            with self.assertRaises(UserAuthorizationException):
+                index.authenticate(key, Scope.WORKFLOW)
+        self.assertNotIn(key[3:8], "".join(logs.output))
+
+    def test_revoked(self) -> None:
+        index = ApiKeyIndex(sync_interval_s=3600)
+        api_key, key = ApiKey.new(1, None, {Scope.WORKFLOW}, 10)
+        index.authenticate(key, Scope.WORKFLOW)
+        index.remove(ApiKey.revoke(api_key.id, 1))
+        with self.assertRaises(UserAuthorizationException):
+            index.authenticate(key, Scope.WORKFLOW)
+
+
+class ApiKeyRouterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 10)"
+        )
+        self.db.commit()
+        self.client = TestClient(app)
+        token = asyncio.run(AccessToken(1).encode())
+        self.client.cookies.set("Authorization", f'"Bearer {token}"')
+
+    def test_create_list_revoke(self) -> None:
+        rsp = self.client.post(
+            "/user/api-key/create",
+            json={"scopes": ["workflow"], "name": "ci", "rate_limit": 10},
+        )
+        self.assertEqual(rsp.status_code, 200)
+        created = rsp.json()
+        key = created["key"]
+        self.assertTrue(key.startswith(created["prefix"]))
+
+        listed = self.client.get("/user/api-key/list").json()
+        self.assertEqual([k["id"] for k in listed], [created["id"]])
+        self.assertNotIn("key", listed[0])
+        self.assertNotIn("key_hash", listed[0])
+
+        client = TestClient(app)
+        client.headers["Authorization"] = f"Bearer {key}"
+        self.assertEqual(client.get("/workflow/list?type=1").status_code, 200)
+
+        rsp = self.client.post(
+            "/user/api-key/revoke", params={"id": created["id"]}
+        )
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(client.get("/workflow/list?type=1").status_code, 401)
+        rsp = self.client.post(
+            "/user/api-key/revoke", params={"id": created["id"]}
+        )
+        self.assertEqual(rsp.status_code, 404)
+
+    def test_create_invalid(self) -> None:
+        for body in (
+            {"scopes": ["nope"]},
+            {"scopes": []},
+            {"scopes": ["workflow"], "rate_limit": 0},
+        ):
+            rsp = self.client.post("/user/api-key/create", json=body)
+            self.assertEqual(rsp.status_code, 400)
+
+    def test_worker_scope_admin_only(self) -> None:
+        body = {"scopes": ["worker"]}
+        rsp = self.client.post("/user/api-key/create", json=body)
+        self.assertEqual(rsp.status_code, 403)
+        with mock.patch("routers.user.ADMIN_EMAILS", ["a@b.c"]):
+            rsp = self.client.post("/user/api-key/create", json=body)
+        self.assertEqual(rsp.status_code, 200)
+
+    def tearDown(self) -> None:
+        api_key_index._keys.clear()
+
+
+# python3 -m lib.tests.api_key_index
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import time
+import traceback
+import unittest
+
+from lib.blocking_detector import (
+    ROOT_DIR,
+    BlockingCallError,
+    BlockingDetector,
+    describe,
+)
+
+
+def block(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+class BlockingDetectorTest(unittest.TestCase):
+
+    def run_loop(self, detector: BlockingDetector, blocked_s: float) -> None:
+        async def main() -> None:
+            detector.start()
+            await asyncio.sleep(0.05)
+            block(blocked_s)
+            await asyncio.sleep(0.05)
+            detector.stop()
+
+        asyncio.run(main())
+
+    def test_detects(self) -> None:
+        detector = BlockingDetector(enabled=True, threshold_ms=50, fail=False)
+        self.run_loop(detector, 0.2)
+        self.run_loop(detector, 0.2)
+        sites = detector.report()["sites"]
+        self.assertEqual(len(sites), 1)
+        self.assertEqual(sites[0]["count"], 2)
+        self.assertGreaterEqual(sites[0]["max_ms"], 150)
+        self.assertIn("lib/tests/blocking_detector.py", sites[0]["site"])
+        self.assertIn(" block", sites[0]["site"])
+        self.assertIn("time.sleep", sites[0]["stack"])
+
+        detector.reset()
+        self.assertEqual(detector.report()["sites"], [])
+
+    def test_short_calls_ignored(self) -> None:
+        detector = BlockingDetector(enabled=True, threshold_ms=100, fail=True)
+        self.run_loop(detector, 0.01)
+        self.assertEqual(detector.report()["sites"], [])
+
+    def test_fail(self) -> None:
+        detector = BlockingDetector(enabled=True, threshold_ms=50, fail=True)
+        with self.assertRaises(BlockingCallError):
+            self.run_loop(detector, 0.2)
+
+    def test_disabled(self) -> None:
+        detector = BlockingDetector(enabled=False, threshold_ms=50, fail=True)
+        self.run_loop(detector, 0.2)
+        self.assertEqual(detector.report()["sites"], [])
+
+    def test_describe(self) -> None:
+        frames = [
+            traceback.FrameSummary("/usr/lib/uvicorn/server.py", 1, "serve"),
+            traceback.FrameSummary(
+                os.path.join(ROOT_DIR, "routers", "stripe.py"), 40, "create"
+            ),
+            traceback.FrameSummary(
+                os.path.join(ROOT_DIR, "lib", "stripe_client.py"), 9, "_sdk"
+            ),
+            traceback.FrameSummary("/usr/lib/stripe/api.py", 3, "request"),
+        ]
+        self.assertEqual(describe(frames), {
+            "site": "lib/stripe_client.py:9 _sdk",
+            "route": "routers/stripe.py create",
+        })
+
+
+# python3 -m lib.tests.blocking_detector
+if __name__ == '__main__':
+    unittest.main()
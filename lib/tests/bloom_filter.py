@@ -0,0 +1,32 @@
+import unittest
+
+from lib.bloom_filter import BloomFilter
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def test_contains_every_added_item(self) -> None:
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        items = [f"jti-{i}" for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        self.assertEqual(len(bloom), 1000)
+
+    def test_false_positive_rate_near_error_rate(self) -> None:
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        false_positives = sum(
+            f"other-{i}" in bloom for i in range(10000)
+        )
+        self.assertLess(false_positives, 300)
+
+    def test_empty_filter_contains_nothing(self) -> None:
+        bloom = BloomFilter(capacity=10, error_rate=0.01)
+        self.assertNotIn("jti", bloom)
+
+
+# python3 -m lib.tests.bloom_filter
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import gzip
+import unittest
+
+from lib.compression import (
+    BROTLI,
+    GZIP,
+    CompressedCache,
+    compress,
+    negotiate,
+    supported_encodings,
+)
+
+
+class CompressionTest(unittest.TestCase):
+
+    def test_negotiate(self) -> None:
+        best = supported_encodings()[0]
+        self.assertIsNone(negotiate(None))
+        self.assertIsNone(negotiate("identity"))
+        self.assertIsNone(negotiate("gzip;q=0, br;q=0"))
+        self.assertEqual(negotiate("gzip"), GZIP)
+        self.assertEqual(negotiate("deflate, gzip;q=0.5"), GZIP)
+        self.assertEqual(negotiate("gzip, br"), best)
+        self.assertEqual(negotiate("*"), best)
+        if best == BROTLI:
+            self.assertEqual(negotiate("gzip, br;q=0.5"), GZIP)
+        # Precompressed files: brotli even without the module.
+        self.assertEqual(negotiate("gzip, br", [BROTLI, GZIP]), BROTLI)
+        self.assertEqual(negotiate("br", [GZIP]), None)
+
+    def test_compress(self) -> None:
+        data = "1\n00:00:01,000 --> 00:00:02,500\n元青花\n\n".encode() * 100
+        self.assertEqual(gzip.decompress(compress(data, GZIP)), data)
+        with self.assertRaises(ValueError):
+            compress(data, "zstd")
+
+    def test_cache_compresses_once(self) -> None:
+        cache = CompressedCache(max_size=4, ttl_s=60, max_item_bytes=1000)
+        parts = ["Hello world\n"] * 100
+        streamed = b"".join(cache.stream("a", GZIP, iter(parts)))
+        self.assertEqual(gzip.decompress(streamed), "".join(parts).encode())
+        self.assertEqual(cache.get("a", GZIP), streamed)
+        self.assertIsNone(cache.get("a", BROTLI))
+
+        # Too big once compressed, streamed but not kept.
+        big = [str(i) for i in range(10000)]
+        streamed = b"".join(cache.stream("b", GZIP, iter(big)))
+        self.assertEqual(gzip.decompress(streamed), "".join(big).encode())
+        self.assertIsNone(cache.get("b", GZIP))
+
+        cache.compress("c", GZIP, b"abc")
+        self.assertEqual(gzip.decompress(cache.get("c", GZIP)), b"abc")
+
+
+# python3 -m lib.tests.compression
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import unittest
+
+from cryptography.fernet import Fernet
+from google.oauth2.credentials import Credentials
+
+from lib.credential_store import CredentialStore
+from lib.tests.db import use_memory_db
+
+
+INFO = {
+    "refresh_token": "1//refresh",
+    "client_id": "client.apps.googleusercontent.com",
+    "client_secret": "secret",
+}
+
+
+class CredentialStoreTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 0)"
+        )
+        self.db.commit()
+        self.old_key = Fernet.generate_key()
+        self.new_key = Fernet.generate_key()
+
+    def store(self, key: bytes, old_keys=()) -> CredentialStore:
+        return CredentialStore(
+            primary_key=key,
+            old_keys=list(old_keys),
+            cache_size=4,
+            cache_ttl_s=60,
+            rotation_batch_size=2,
+        )
+
+    def stored(self, user_id: int = 1) -> bytes:
+        return self.db.execute(
+            "SELECT credentials FROM users WHERE id = ?", (user_id,)
+        ).fetchone()[0]
+
+    def test_skips_unchanged_writes(self) -> None:
+        store = self.store(self.new_key)
+        credentials = Credentials.from_authorized_user_info(INFO)
+        self.assertTrue(store.set(1, credentials))
+        written = self.stored()
+        self.assertFalse(store.set(1, credentials))
+        self.assertEqual(self.stored(), written)
+
+        # Also against the DB, once the cache is gone.
+        store.invalidate(1)
+        self.assertFalse(store.set(1, credentials))
+
+        changed = Credentials.from_authorized_user_info(
+            {**INFO, "refresh_token": "1//other"}
+        )
+        self.assertTrue(store.set(1, changed))
+        self.assertNotEqual(self.stored(), written)
+
+    def test_cache_hit(self) -> None:
+        store = self.store(self.new_key)
+        store.set(1, Credentials.from_authorized_user_info(INFO))
+        self.db.execute("UPDATE users SET credentials = NULL WHERE id = 1")
+        self.db.commit()
+        self.assertEqual(store.get(1).refresh_token, INFO["refresh_token"])
+
+        store.invalidate(1)
+        self.assertIsNone(store.get(1))
+
+    def test_rotation(self) -> None:
+        for user_id in (2, 3, 4):
+            self.db.execute(
+                "INSERT INTO users (id, name, create_at, credit) "
+                "VALUES (?, 'a@b.c', 0, 0)",
+                (user_id,)
+            )
+        encrypted = Fernet(self.old_key).encrypt(json.dumps(INFO).encode())
+        self.db.execute("UPDATE users SET credentials = ?", (encrypted,))
+        self.db.commit()
+
+        store = self.store(self.new_key, [self.old_key])
+
+        async def read_all() -> None:
+            for user_id in (1, 2, 3, 4):
+                credentials = store.get(user_id)
+                self.assertEqual(
+                    credentials.refresh_token, INFO["refresh_token"]
+                )
+            # Rotated in the background, two rows per batch.
+            self.assertEqual(self.stored(4), encrypted)
+            for _ in range(3):
+                await asyncio.sleep(0)
+
+        asyncio.run(read_all())
+        for user_id in (1, 2, 3, 4):
+            rotated = self.stored(user_id)
+            self.assertNotEqual(rotated, encrypted)
+            self.assertEqual(
+                json.loads(Fernet(self.new_key).decrypt(rotated)), INFO
+            )
+
+        # Read with the new key only.
+        self.assertIsNotNone(self.store(self.new_key).get(1))
+
+    def test_rotate_pending_without_loop(self) -> None:
+        encrypted = Fernet(self.old_key).encrypt(json.dumps(INFO).encode())
+        self.db.execute("UPDATE users SET credentials = ?", (encrypted,))
+        self.db.commit()
+        store = self.store(self.new_key, [self.old_key])
+        self.assertIsNotNone(store.get(1))
+        self.assertEqual(self.stored(), encrypted)
+        self.assertEqual(store.rotate_pending(), 1)
+        Fernet(self.new_key).decrypt(self.stored())
+
+
+# python3 -m lib.tests.credential_store
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import glob
+import os
+import sqlite3
+
+from lib.sql_profiler import sql_profiler
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from lib.tracing import trace_exporter
+
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "..", "scripts", "migrations"
+)
+
+# The tables created by hand before scripts/migrations existed.
+BASE_SCHEMA = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        create_at INTEGER,
+        credentials BLOB,
+        credit INTEGER
+    );
+    CREATE TABLE payment (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        create_at INTEGER,
+        quantity INTEGER,
+        status INTEGER
+    );
+    CREATE TABLE workflow (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        create_at INTEGER,
+        args TEXT,
+        type INTEGER,
+        status INTEGER
+    );
+    CREATE TABLE video (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        workflow_id INTEGER,
+        user_id INTEGER,
+        uuid TEXT,
+        snippt TEXT,
+        transcript TEXT
+    );
+"""
+
+
+def use_memory_db() -> sqlite3.Connection:
+    """
+    Point SQLiteConnectionManager to a new in-memory DB with all migrations.
+    The app's shutdown and slow requests then write no SQL profile nor
+    traces into the working directory.
+    """
+    sql_profiler._report_file = None
+    trace_exporter._file = None
+    connection = sqlite3.connect(":memory:", check_same_thread=False)
+    connection.executescript(BASE_SCHEMA)
+    for migration in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql"))):
+        with open(migration) as f:
+            connection.executescript(f.read())
+    SQLiteConnectionManager().close()
+    SQLiteConnectionManager()._conn = connection
+    return connection
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from lib.db_compactor import DbCompactor
+from lib.tests.db import use_memory_db
+
+
+class DbCompactorTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        self.dir = tempfile.TemporaryDirectory()
+        self.compactor = DbCompactor(
+            archive_file=os.path.join(self.dir.name, "archive.db"),
+            deleted_after_s=3600,
+            done_after_s=3600,
+            interval_s=3600,
+            batch_size=2,
+            pause_s=0,
+            vacuum_pages=10,
+        )
+
+    def tearDown(self) -> None:
+        self.db.close()
+        self.dir.cleanup()
+
+    def add_workflow(
+        self, status: int, create_at: int, delete_at: int = 0
+    ) -> int:
+        cursor = self.db.execute(
+            "INSERT INTO workflow "
+            "(user_id, create_at, args, type, status, delete_at) "
+            "VALUES (1, ?, '{}', 1, ?, ?)",
+            (create_at, status, delete_at)
+        )
+        self.db.execute(
+            "INSERT INTO video (workflow_id, user_id, transcript) "
+            "VALUES (?, 1, 'x')",
+            (cursor.lastrowid,)
+        )
+        self.db.commit()
+        return cursor.lastrowid
+
+    def ids(self, table: str, schema: str = "main") -> list:
+        return [
+            row[0] for row in self.db.execute(
+                f"SELECT id FROM {schema}.{table} ORDER BY id"
+            )
+        ]
+
+    def test_run_moves_deleted_and_old_done(self) -> None:
+        deleted = [self.add_workflow(20, 10**10) for _ in range(3)]
+        old_done = self.add_workflow(7, 0)
+        recent_done = self.add_workflow(7, 10**10)
+        todo = self.add_workflow(1, 0)
+        # Deleted now: kept for the change feed.
+        recent_deleted = self.add_workflow(1, 0)
+        self.db.execute(
+            "UPDATE workflow SET status = 20 WHERE id = ?", (recent_deleted,)
+        )
+        self.db.commit()
+
+        report = asyncio.run(self.compactor.run())
+
+        self.assertEqual(report["workflows"], 4)
+        self.assertEqual(
+            self.ids("workflow"), [recent_done, todo, recent_deleted]
+        )
+        self.assertEqual(
+            self.ids("workflow", "archive"), sorted(deleted + [old_done])
+        )
+        self.assertEqual(len(self.ids("video")), 3)
+        self.assertEqual(len(self.ids("video", "archive")), 4)
+
+    def test_archive_again_replaces(self) -> None:
+        id = self.add_workflow(20, 0)
+        asyncio.run(self.compactor.run())
+        # A copy interrupted before the delete of the main rows.
+        self.db.execute(
+            "INSERT INTO main.workflow SELECT * FROM archive.workflow"
+        )
+        self.db.commit()
+        self.compactor.archive([id])
+        self.assertEqual(self.ids("workflow", "archive"), [id])
+        self.assertEqual(self.ids("workflow"), [])
+
+
+# python3 -m lib.tests.db_compactor
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from starlette.requests import Request
+
+from lib.etag import not_modified
+
+
+def request(if_none_match: str) -> Request:
+    return Request({
+        "type": "http",
+        "headers": [(b"if-none-match", if_none_match.encode())],
+    })
+
+
+class EtagTest(unittest.TestCase):
+
+    def test_not_modified(self) -> None:
+        etag = 'W/"1.5"'
+        self.assertTrue(not_modified(request('W/"1.5"'), etag))
+        self.assertTrue(not_modified(request('"1.4", "1.5"'), etag))
+        self.assertTrue(not_modified(request('*'), etag))
+        self.assertFalse(not_modified(request('W/"1.4"'), etag))
+        self.assertFalse(not_modified(request('W/"11.5"'), etag))
+
+
+# python3 -m lib.tests.etag
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import sys
+import unittest
+
+from lib.lazy_import import LazyModule, lazy_import
+
+
+class LazyImportTest(unittest.TestCase):
+
+    def test_imported_on_first_use(self) -> None:
+        sys.modules.pop("colorsys", None)
+        colorsys = lazy_import("colorsys")
+        self.assertIsInstance(colorsys, LazyModule)
+        self.assertNotIn("colorsys", sys.modules)
+
+        self.assertEqual(colorsys.rgb_to_hsv(1, 0, 0), (0, 1, 1))
+        self.assertIn("colorsys", sys.modules)
+        colorsys.ONE_THIRD = 0.5
+        self.assertEqual(sys.modules["colorsys"].ONE_THIRD, 0.5)
+        del sys.modules["colorsys"]
+
+    def test_already_imported(self) -> None:
+        self.assertIs(lazy_import("unittest"), unittest)
+
+
+# python3 -m lib.tests.lazy_import
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import time
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from lib.load_shedder import (
+    LoadShedder,
+    LoadSheddingMiddleware,
+    load_shedder,
+)
+from routers import health
+
+
+class LoadShedderTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.shedder = LoadShedder(
+            lag_ms=100,
+            max_in_flight=10,
+            check_interval_s=0.01,
+            critical_paths=["/user/status", "/payment/stripe/"],
+            retry_after_s=5,
+        )
+
+    def test_shed_ratio(self) -> None:
+        self.assertEqual(self.shedder.shed_ratio(), 0)
+        self.shedder.record_lag(150)
+        self.assertAlmostEqual(self.shedder.shed_ratio(), 0.5)
+        self.shedder.record_lag(500)
+        self.assertEqual(self.shedder.shed_ratio(), 1.0)
+        self.assertTrue(self.shedder.should_shed("/workflow/list"))
+        self.assertFalse(self.shedder.should_shed("/user/status"))
+        self.assertFalse(self.shedder.should_shed("/payment/stripe/webhook"))
+
+        # Decays slowly.
+        self.shedder.record_lag(0)
+        self.assertEqual(self.shedder.lag_ms, 400)
+        for _ in range(20):
+            self.shedder.record_lag(0)
+        self.assertEqual(self.shedder.shed_ratio(), 0)
+        self.assertFalse(self.shedder.state()["shedding"])
+
+    def test_in_flight(self) -> None:
+        self.shedder.in_flight = 11
+        self.assertEqual(self.shedder.shed_ratio(), 1.0)
+        self.assertTrue(self.shedder.state()["shedding"])
+
+    def test_measures_lag(self) -> None:
+        async def block() -> None:
+            self.shedder.start()
+            await asyncio.sleep(0.02)
+            # Blocks the loop.
+            time.sleep(0.2)
+            await asyncio.sleep(0.02)
+            await self.shedder.stop()
+
+        asyncio.run(block())
+        self.assertGreater(self.shedder.lag_ms, 100)
+
+
+class LoadSheddingMiddlewareTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        app = FastAPI()
+        app.add_middleware(LoadSheddingMiddleware)
+        app.include_router(health.router)
+
+        @app.get("/user/status")
+        async def status():
+            return {}
+
+        @app.get("/workflow/list")
+        async def workflows():
+            return []
+
+        self.client = TestClient(app)
+        self.lag_ms = load_shedder.lag_ms
+
+    def tearDown(self) -> None:
+        load_shedder.lag_ms = self.lag_ms
+
+    def test_sheds(self) -> None:
+        self.assertEqual(self.client.get("/workflow/list").status_code, 200)
+        self.assertEqual(self.client.get("/ready").status_code, 200)
+
+        load_shedder.lag_ms = 1e6
+        rsp = self.client.get("/workflow/list")
+        self.assertEqual(rsp.status_code, 503)
+        self.assertEqual(
+            rsp.headers["retry-after"], str(load_shedder.retry_after_s)
+        )
+        self.assertEqual(self.client.get("/user/status").status_code, 200)
+
+        rsp = self.client.get("/ready")
+        self.assertEqual(rsp.status_code, 503)
+        self.assertTrue(rsp.json()["shedding"])
+        rsp = self.client.get("/health")
+        self.assertEqual(rsp.status_code, 200)
+        self.assertTrue(rsp.json()["shedding"])
+
+
+# python3 -m lib.tests.load_shedder
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import io
+import logging
+import threading
+import unittest
+
+from lib.log_pipeline import LogPipeline, SamplingFilter, redact
+
+
+class ArgsFormatter(logging.Formatter):
+    """
+    Needs the record arguments, like uvicorn's access formatter.
+    """
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        method, path = record.args
+        return f"{method} {path}"
+
+
+class LogPipelineTest(unittest.TestCase):
+
+    def test_redact(self) -> None:
+        jwt = "eyJhbGciOi.eyJzdWIiOiIx.c2lnbmF0dXJl"
+        for message in (
+            f"cookies: {{'Authorization': 'Bearer {jwt}'}}",
+            f"token={jwt}; x=1",
+            "Authorization: Bearer pk_abc123 from 1.2.3.4",
+            f"refresh_token: {jwt[-9:]}",
+        ):
+            self.assertNotIn("c2lnbmF0dXJl", redact(message))
+            self.assertNotIn("abc123", redact(message))
+        self.assertEqual(redact(f"token={jwt}; x=1"), "token=<redacted>; x=1")
+        self.assertEqual(redact("key sk_live_abc"), "key sk_<redacted>")
+        self.assertEqual(redact("user: 1 created."), "user: 1 created.")
+
+    def test_sampling(self) -> None:
+        sampling = SamplingFilter(burst=2, window_s=60)
+
+        def record(level: int, msg: str = "user: %s") -> logging.LogRecord:
+            return logging.LogRecord("x", level, "", 0, msg, (1,), None)
+
+        kept = [sampling.filter(record(logging.INFO)) for _ in range(5)]
+        self.assertEqual(kept, [True, True, False, False, False])
+        self.assertTrue(sampling.filter(record(logging.INFO, "other")))
+        self.assertTrue(sampling.filter(record(logging.WARNING)))
+
+        sampling._window_s = 0
+        late = record(logging.INFO)
+        self.assertTrue(sampling.filter(late))
+        self.assertEqual(late.getMessage(), "user: 1 [3 similar dropped]")
+
+    def test_pipeline(self) -> None:
+        out = io.StringIO()
+        handler = logging.StreamHandler(out)
+        handler.setFormatter(ArgsFormatter())
+        logger = logging.getLogger("test.log_pipeline")
+        logger.propagate = False
+        logger.addHandler(handler)
+        pipeline = LogPipeline(
+            levels={"test.log_pipeline": "INFO"},
+            sampled=[],
+            queue_size=100,
+            sample_burst=1,
+            sample_window_s=60,
+        )
+        pipeline.start(["test.log_pipeline"])
+        try:
+            self.assertNotIn(handler, logger.handlers)
+            logger.debug("%s %s", "GET", "/hidden")
+            for _ in range(3):
+                logger.info("%s %s", "GET", "/?token=secret")
+        finally:
+            pipeline.stop()
+            logger.handlers.clear()
+        self.assertEqual(out.getvalue(), "GET /?token=<redacted>\n" * 3)
+
+
+    def test_format_on_writer(self) -> None:
+        threads = []
+
+        class Arg:
+            def __str__(self) -> str:
+                threads.append(threading.get_ident())
+                return "Bearer secret"
+
+        out = io.StringIO()
+        logger = logging.getLogger("test.log_pipeline.writer")
+        logger.propagate = False
+        logger.addHandler(logging.StreamHandler(out))
+        pipeline = LogPipeline(
+            levels={"test.log_pipeline.writer": "INFO"},
+            sampled=[],
+            queue_size=100,
+            sample_burst=1,
+            sample_window_s=60,
+        )
+        pipeline.start(["test.log_pipeline.writer"])
+        try:
+            logger.info("auth: %s", Arg())
+        finally:
+            pipeline.stop()
+            logger.handlers.clear()
+        self.assertEqual(out.getvalue(), "auth: Bearer <redacted>\n")
+        self.assertNotIn(threading.get_ident(), threads)
+
+# python3 -m lib.tests.log_pipeline
+if __name__ == '__main__':
+    unittest.main()
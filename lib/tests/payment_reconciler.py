@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+
+from lib.payment_reconciler import PaymentReconciler, CHECKPOINT_NAME
+from lib.stripe_stub import StripeStub
+from lib.tests.db import use_memory_db
+from models.job_checkpoint import JobCheckpoint
+from models.payment import payment_cache
+
+
+class PaymentReconcilerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        payment_cache.clear()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 0)"
+        )
+        self.stripe = StripeStub(latency_s=0.01)
+
+    def add_payment(self, quantity: int, session_id=None) -> int:
+        cursor = self.db.execute(
+            "INSERT INTO payment "
+            "(user_id, create_at, quantity, status, session_id) "
+            "VALUES (1, 0, ?, 1, ?)",
+            (quantity, session_id)
+        )
+        self.db.commit()
+        return cursor.lastrowid
+
+    def status(self, id: int) -> int:
+        return self.db.execute(
+            "SELECT status FROM payment WHERE id = ?", (id,)
+        ).fetchone()[0]
+
+    def reconciler(self) -> PaymentReconciler:
+        return PaymentReconciler(
+            client=self.stripe, batch_size=2, concurrency=2, min_age_s=60
+        )
+
+    def test_run_settle_pending_payments(self) -> None:
+        paid = self.add_payment(
+            10, self.stripe.add_session("complete", "paid")
+        )
+        expired = self.add_payment(20, self.stripe.add_session("expired"))
+        still_open = self.add_payment(30, self.stripe.add_session("open"))
+        no_session = self.add_payment(40)
+
+        report = asyncio.run(self.reconciler().run())
+
+        self.assertEqual(self.status(paid), 2)
+        self.assertEqual(self.status(expired), 3)
+        self.assertEqual(self.status(still_open), 1)
+        self.assertEqual(self.status(no_session), 4)
+        self.assertEqual(report["SUCCESS"], 1)
+        self.assertEqual(report["PENDING"], 1)
+        credit = self.db.execute("SELECT credit FROM users").fetchone()[0]
+        self.assertEqual(credit, 10)
+        self.assertLessEqual(self.stripe.max_in_flight, 2)
+        self.assertEqual(JobCheckpoint.get(CHECKPOINT_NAME), "0")
+
+    def test_run_resume_after_checkpoint(self) -> None:
+        skipped = self.add_payment(10, self.stripe.add_session("expired"))
+        resumed = self.add_payment(20, self.stripe.add_session("expired"))
+        JobCheckpoint.set(self.db.cursor(), CHECKPOINT_NAME, str(skipped))
+        self.db.commit()
+
+        asyncio.run(self.reconciler().run())
+
+        self.assertEqual(self.status(skipped), 1)
+        self.assertEqual(self.status(resumed), 3)
+        self.assertEqual(self.stripe.calls, 1)
+
+
+# python3 -m lib.tests.payment_reconciler
+if __name__ == '__main__':
+    unittest.main()
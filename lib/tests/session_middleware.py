@@ -0,0 +1,139 @@
+import asyncio
+import unittest
+
+from fastapi.testclient import TestClient
+from http.cookies import SimpleCookie
+from typing import Optional
+from unittest import mock
+
+from app import app
+from lib.config import REFRESH_SESSION_IDLE_S, REFRESH_SESSION_MAX_AGE_S
+from lib.const import COOKIE_TOKEN_KEY, REFRESH_COOKIE_KEY
+from lib.tests.db import use_memory_db
+from lib.token_util import AccessToken, Token
+from models.session import RefreshSession, now
+
+
+class SessionRefreshTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 10)"
+        )
+        self.db.commit()
+        self.session, self.token = RefreshSession.new(1)
+        self.client = TestClient(app)
+
+    def at(self, t: int):
+        return mock.patch("models.session.now", return_value=t)
+
+    def access_token(self, rsp) -> Optional[str]:
+        """
+        The access token set by `rsp`, the cookie domain keeps the client
+        from storing it.
+        """
+        token = None
+        for cookie in rsp.headers.get_list("set-cookie"):
+            cookies = SimpleCookie(cookie)
+            if COOKIE_TOKEN_KEY in cookies:
+                token = cookies[COOKIE_TOKEN_KEY].value.split(" ")[1]
+        return token
+
+    def refresh(self):
+        return self.client.post("/user/refresh", follow_redirects=False)
+
+    def test_sliding_expiry(self) -> None:
+        start = self.session.create_at
+        self.assertEqual(
+            self.session.expire_at, start + REFRESH_SESSION_IDLE_S
+        )
+
+        with self.at(start + REFRESH_SESSION_IDLE_S - 1):
+            self.assertTrue(self.session.is_valid())
+            self.session.touch()
+        self.assertEqual(
+            RefreshSession.get(self.token).expire_at,
+            start + 2 * REFRESH_SESSION_IDLE_S - 1,
+        )
+
+        # Idle for too long.
+        with self.at(start + 3 * REFRESH_SESSION_IDLE_S):
+            self.assertFalse(RefreshSession.get(self.token).is_valid())
+
+    def test_max_age(self) -> None:
+        start = self.session.create_at
+        session = self.session
+        t = start
+        while t < start + REFRESH_SESSION_MAX_AGE_S:
+            t += REFRESH_SESSION_IDLE_S // 2
+            with self.at(t):
+                session = RefreshSession.get(self.token)
+                session.touch()
+        self.assertEqual(
+            session.expire_at, start + REFRESH_SESSION_MAX_AGE_S
+        )
+        with self.at(start + REFRESH_SESSION_MAX_AGE_S):
+            self.assertFalse(RefreshSession.get(self.token).is_valid())
+
+    def test_refresh_endpoint(self) -> None:
+        self.client.cookies.set(REFRESH_COOKIE_KEY, self.token)
+        rsp = self.refresh()
+        self.assertEqual(rsp.status_code, 200)
+        user_id = asyncio.run(AccessToken.decode(self.access_token(rsp)))
+        self.assertEqual(user_id, 1)
+
+    def test_refresh_rejected(self) -> None:
+        # Unknown, then revoked, then expired sessions.
+        self.client.cookies.set(REFRESH_COOKIE_KEY, "unknown")
+        self.assertEqual(self.refresh().status_code, 307)
+
+        self.client.cookies.set(REFRESH_COOKIE_KEY, self.token)
+        self.session.revoke()
+        self.assertEqual(self.refresh().status_code, 307)
+
+        _session, token = RefreshSession.new(1)
+        self.client.cookies.set(REFRESH_COOKIE_KEY, token)
+        with self.at(now() + REFRESH_SESSION_IDLE_S + 1):
+            self.assertEqual(self.refresh().status_code, 307)
+
+    def test_middleware_issues_access_token(self) -> None:
+        # No access token: a new one is issued and used by the request.
+        self.client.cookies.set(REFRESH_COOKIE_KEY, self.token)
+        rsp = self.client.get("/user/status")
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(rsp.json()["name"], "a@b.c")
+        token_encoded = self.access_token(rsp)
+
+        # A fresh access token is kept as is.
+        self.client.cookies.set(
+            COOKIE_TOKEN_KEY, f'"Bearer {token_encoded}"'
+        )
+        rsp = self.client.get("/user/status")
+        self.assertEqual(rsp.status_code, 200)
+        self.assertIsNone(self.access_token(rsp))
+
+        # About to expire: replaced.
+        expiring = Token(user_id=1, expire_after=now() + 60)
+        expiring_encoded = asyncio.run(expiring.encode())
+        self.client.cookies.set(
+            COOKIE_TOKEN_KEY, f'"Bearer {expiring_encoded}"'
+        )
+        rsp = self.client.get("/user/status")
+        self.assertEqual(rsp.status_code, 200)
+        self.assertNotEqual(self.access_token(rsp), expiring_encoded)
+
+    def test_middleware_revoked_session(self) -> None:
+        self.session.revoke()
+        self.client.cookies.set(REFRESH_COOKIE_KEY, self.token)
+        rsp = self.client.get("/user/status")
+        self.assertNotEqual(rsp.status_code, 200)
+        # The dead refresh cookie is dropped.
+        self.assertIn(f"{REFRESH_COOKIE_KEY}=", rsp.headers["set-cookie"])
+        self.assertIn("Max-Age=0", rsp.headers["set-cookie"])
+
+
+# python3 -m lib.tests.session_middleware
+if __name__ == '__main__':
+    unittest.main()
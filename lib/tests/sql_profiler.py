@@ -0,0 +1,95 @@
+import sqlite3
+import unittest
+
+from lib.sql_profiler import (
+    ProfiledConnection,
+    normalize,
+    sql_profiler,
+)
+
+
+class SqlProfilerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        sql_profiler.reset()
+        self.connection = sqlite3.connect(
+            ":memory:", factory=ProfiledConnection
+        )
+        cursor = self.connection.cursor()
+        cursor.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)")
+        cursor.executemany(
+            "INSERT INTO t (v) VALUES (?)", [(str(i),) for i in range(10)]
+        )
+        self.connection.commit()
+
+    def tearDown(self) -> None:
+        self.connection.close()
+        sql_profiler.reset()
+
+    def stats(self, sql: str):
+        report = sql_profiler.report(top=100)
+        [stats] = [s for s in report["statements"] if s["sql"] == sql]
+        return stats
+
+    def test_normalize(self) -> None:
+        self.assertEqual(
+            normalize("SELECT *\n  FROM t WHERE v = 'a''b' AND id IN "
+                      "( ?, ?,? ) LIMIT 10"),
+            "SELECT * FROM t WHERE v = ? AND id IN ( ?, ... ) LIMIT ?",
+        )
+
+    def test_records_rows_and_call_site(self) -> None:
+        for id in (1, 2):
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT v FROM t WHERE id > ?", (id,))
+            cursor.fetchall()
+        cursor.execute("SELECT v FROM t WHERE id = 3")
+        self.assertEqual([v for v, in cursor], ["2"])
+        cursor.execute("UPDATE t SET v = 'x' WHERE id < 4")
+
+        stats = self.stats("SELECT v FROM t WHERE id > ?")
+        self.assertEqual(stats["count"], 2)
+        self.assertEqual(stats["rows"], 9 + 8)
+        [site] = stats["sites"]
+        self.assertIn("test_records_rows_and_call_site", site)
+        self.assertEqual(self.stats("SELECT v FROM t WHERE id = ?")["rows"], 1)
+        self.assertEqual(
+            self.stats("UPDATE t SET v = ? WHERE id < ?")["rows"], 3
+        )
+        self.assertEqual(
+            self.stats("INSERT INTO t (v) VALUES (?)")["rows"], 10
+        )
+
+    def test_slow_statements_are_explained(self) -> None:
+        slow_ms = sql_profiler._slow_ms
+        sql_profiler._slow_ms = 0
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT * FROM t WHERE v = ?", ("1",))
+            cursor.fetchone()
+            # Recorded when the cursor is reused.
+            cursor.execute("SELECT * FROM t WHERE id = ?", (1,))
+            cursor.fetchall()
+        finally:
+            sql_profiler._slow_ms = slow_ms
+        slow = sql_profiler.report()["slow"]
+        self.assertEqual(
+            [s["sql"] for s in slow],
+            ["SELECT * FROM t WHERE id = ?", "SELECT * FROM t WHERE v = ?"],
+        )
+        self.assertIn("SCAN t", slow[1]["plan"])
+        self.assertIn("USING INTEGER PRIMARY KEY", slow[0]["plan"])
+
+    def test_report_order(self) -> None:
+        with self.assertRaises(ValueError):
+            sql_profiler.report(order="rows")
+        statements = sql_profiler.report(order="count")["statements"]
+        self.assertEqual(
+            [s["count"] for s in statements],
+            sorted([s["count"] for s in statements], reverse=True),
+        )
+
+
+# python3 -m lib.tests.sql_profiler
+if __name__ == '__main__':
+    unittest.main()
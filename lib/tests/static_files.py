@@ -0,0 +1,118 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from lib.static_files import CachedStaticFiles, is_immutable
+
+
+INDEX = b"<html>" + b"x" * 100 + b"</html>"
+SCRIPT = b"console.log('hello');\n" * 50
+
+
+class StaticFilesTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.write("index.html", INDEX)
+        self.write("static/js/main.3f2a9c1b.js", SCRIPT)
+        self.write("static/js/main.3f2a9c1b.js.gz", gzip.compress(SCRIPT))
+        self.write("big.txt", b"b" * 2000)
+        self.files = CachedStaticFiles(
+            directory=self.dir, html=True, max_bytes=1500, max_file_bytes=1200
+        )
+        app = FastAPI()
+        app.mount("/", self.files, name="index")
+        self.client = TestClient(app)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def write(self, name: str, data: bytes) -> None:
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def test_is_immutable(self) -> None:
+        self.assertTrue(is_immutable("static/js/main.3f2a9c1b.chunk.js"))
+        self.assertTrue(is_immutable("assets/index-D8k2Lq1a.css"))
+        self.assertFalse(is_immutable("index.html"))
+        self.assertFalse(is_immutable("static/js/bootstrap.min.js"))
+        self.assertFalse(is_immutable("manifest.json"))
+
+    def test_index_revalidated(self) -> None:
+        rsp = self.client.get("/")
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(rsp.content, INDEX)
+        self.assertEqual(rsp.headers["cache-control"], "no-cache")
+        self.assertTrue(rsp.headers["content-type"].startswith("text/html"))
+
+        rsp = self.client.get(
+            "/", headers={"If-None-Match": rsp.headers["etag"]}
+        )
+        self.assertEqual(rsp.status_code, 304)
+
+        # Changed on disk: the cached copy is not served.
+        self.write("index.html", b"<html>new</html>")
+        os.utime(os.path.join(self.dir, "index.html"), (1, 1))
+        self.assertEqual(self.client.get("/").content, b"<html>new</html>")
+
+    def test_precompressed_variant(self) -> None:
+        path = "/static/js/main.3f2a9c1b.js"
+        rsp = self.client.get(path, headers={"Accept-Encoding": "br, gzip"})
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(rsp.headers["content-encoding"], "gzip")
+        self.assertEqual(rsp.headers["vary"], "Accept-Encoding")
+        self.assertIn("immutable", rsp.headers["cache-control"])
+        self.assertIn("javascript", rsp.headers["content-type"])
+        self.assertEqual(rsp.content, SCRIPT)
+
+        rsp = self.client.get(path, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("content-encoding", rsp.headers)
+        self.assertEqual(rsp.content, SCRIPT)
+
+    def test_cached_by_coding_sent(self) -> None:
+        path = "/static/js/main.3f2a9c1b.js"
+        rsp = self.client.get(path, headers={"Accept-Encoding": "br, gzip"})
+        self.assertEqual(rsp.headers["content-encoding"], "gzip")
+        # No .br variant: identity, not the gzip body cached first.
+        rsp = self.client.get(path, headers={"Accept-Encoding": "br"})
+        self.assertEqual(rsp.status_code, 200)
+        self.assertNotIn("content-encoding", rsp.headers)
+        self.assertEqual(rsp.content, SCRIPT)
+        rsp = self.client.get(path, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(rsp.headers["content-encoding"], "gzip")
+        self.assertEqual(rsp.content, SCRIPT)
+
+    def test_memory_cache(self) -> None:
+        path = "/static/js/main.3f2a9c1b.js"
+        headers = {"Accept-Encoding": "identity"}
+        self.client.get(path, headers=headers)
+        # Fingerprinted: served from memory, even without the file.
+        os.remove(os.path.join(self.dir, "static/js/main.3f2a9c1b.js"))
+        rsp = self.client.get(path, headers=headers)
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(rsp.content, SCRIPT)
+
+        # Evicted once over max_bytes.
+        self.write("main.8d7e6f5a.css", b"c" * 600)
+        self.client.get("/main.8d7e6f5a.css")
+        self.assertEqual(self.client.get(path, headers=headers).status_code,
+                         404)
+
+    def test_large_file_not_cached(self) -> None:
+        rsp = self.client.get("/big.txt")
+        self.assertEqual(rsp.content, b"b" * 2000)
+        self.assertEqual(rsp.headers["cache-control"], "no-cache")
+        self.assertIn("etag", rsp.headers)
+        self.assertEqual(self.files._size, 0)
+
+
+# python3 -m lib.tests.static_files
+if __name__ == '__main__':
+    unittest.main()
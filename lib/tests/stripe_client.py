@@ -0,0 +1,65 @@
+import asyncio
+import time
+import unittest
+
+from fastapi.testclient import TestClient
+from unittest import mock
+
+from app import app
+from lib.stripe_client import StripeClient, stripe, stripe_client
+from lib.tests.db import use_memory_db
+from lib.token_util import AccessToken
+from models.payment import Status, payment_cache
+
+
+class StripeClientTest(unittest.TestCase):
+
+    def test_timeout(self) -> None:
+        client = StripeClient(api_key="sk_test", max_workers=1, timeout_s=0)
+
+        async def call() -> None:
+            await client._call(time.sleep, 1.5)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(call())
+
+
+class CheckoutTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        payment_cache.clear()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 0)"
+        )
+        self.db.commit()
+        self.client = TestClient(app)
+        token = asyncio.run(AccessToken(1).encode())
+        self.client.cookies.set("Authorization", f'"Bearer {token}"')
+
+    def create(self, error: Exception) -> str:
+        with mock.patch.object(
+            stripe_client, "create_checkout_session", side_effect=error
+        ):
+            rsp = self.client.get(
+                "/payment/stripe/create",
+                params={"quantity": 10},
+                follow_redirects=False,
+            )
+        self.assertEqual(rsp.status_code, 307)
+        return rsp.headers["location"]
+
+    def test_timeout_fails_payment(self) -> None:
+        location = self.create(asyncio.TimeoutError())
+        self.assertIn("/payment/stripe/fail?id=1", location)
+        self.assertIn(f"status={Status.FAILED.value}", location)
+
+    def test_stripe_error_fails_payment(self) -> None:
+        location = self.create(stripe.error.APIConnectionError("down"))
+        self.assertIn(f"status={Status.FAILED.value}", location)
+
+
+# python3 -m lib.tests.stripe_client
+if __name__ == '__main__':
+    unittest.main()
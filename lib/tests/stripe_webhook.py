@@ -0,0 +1,109 @@
+import stripe
+import unittest
+
+from lib.stripe_stub import make_event, signed_event
+from lib.stripe_webhook import StripeEventProcessor
+from lib.tests.db import use_memory_db
+from models.stripe_event import StripeEvent, Status as EventStatus
+
+
+SECRET = "whsec_test"
+
+
+def stored_event(event) -> StripeEvent:
+    payload, signature = signed_event(event, SECRET)
+    # Verified the same way as the webhook endpoint.
+    stripe.Webhook.construct_event(payload, signature, SECRET)
+    return StripeEvent(
+        id=event["id"],
+        type=event["type"],
+        payload=payload,
+        create_at=event["created"],
+    )
+
+
+class StripeEventProcessorTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 10)"
+        )
+        self.db.execute(
+            "INSERT INTO payment (id, user_id, create_at, quantity, status) "
+            "VALUES (7, 1, 0, 30, 1)"
+        )
+        self.db.commit()
+        self.processor = StripeEventProcessor(
+            workers=1,
+            batch_size=10,
+            queue_size=10,
+            sweep_interval_s=60,
+            max_attempts=3,
+        )
+
+    def credit(self) -> int:
+        return self.db.execute(
+            "SELECT credit FROM users WHERE id = 1"
+        ).fetchone()[0]
+
+    def event_status(self, id: str) -> EventStatus:
+        return EventStatus(self.db.execute(
+            "SELECT status FROM stripe_event WHERE id = ?", (id,)
+        ).fetchone()[0])
+
+    def test_duplicated_event_is_stored_once(self) -> None:
+        event = stored_event(make_event(
+            "checkout.session.completed",
+            {"client_reference_id": "7", "payment_status": "paid"},
+        ))
+        self.assertTrue(event.save_if_new())
+        self.assertFalse(event.save_if_new())
+
+    def test_completed_events_credit_once(self) -> None:
+        events = [
+            stored_event(make_event(
+                "checkout.session.completed",
+                {"client_reference_id": "7", "payment_status": "paid"},
+            ))
+            for _ in range(2)
+        ]
+        for event in events:
+            event.save_if_new()
+        self.processor.process(events)
+
+        self.assertEqual(self.credit(), 40)
+        for event in events:
+            self.assertEqual(self.event_status(event.id), EventStatus.DONE)
+
+    def test_expired_after_success_keeps_success(self) -> None:
+        completed = stored_event(make_event(
+            "checkout.session.completed",
+            {"client_reference_id": "7", "payment_status": "paid"},
+        ))
+        expired = stored_event(make_event(
+            "checkout.session.expired", {"client_reference_id": "7"},
+        ))
+        for event in (completed, expired):
+            event.save_if_new()
+        self.processor.process([completed, expired])
+
+        status = self.db.execute(
+            "SELECT status FROM payment WHERE id = 7"
+        ).fetchone()[0]
+        self.assertEqual(status, 2)
+        self.assertEqual(self.credit(), 40)
+
+    def test_unrelated_event_is_ignored(self) -> None:
+        event = stored_event(make_event("customer.created", {"id": "cus_1"}))
+        event.save_if_new()
+        self.processor.process([event])
+
+        self.assertEqual(self.event_status(event.id), EventStatus.IGNORED)
+        self.assertEqual(self.credit(), 10)
+
+
+# python3 -m lib.tests.stripe_webhook
+if __name__ == '__main__':
+    unittest.main()
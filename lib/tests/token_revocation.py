@@ -0,0 +1,46 @@
+import time
+import unittest
+
+from unittest import mock
+
+from lib.tests.db import use_memory_db
+from lib.token_revocation import RevocationList
+
+
+class RevocationListTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        # Revoked by another process.
+        self.db.execute(
+            "INSERT INTO token_revocation (jti, user_id, expire_at) "
+            "VALUES ('revoked', 1, ?)",
+            (int(time.time()) + 3600,)
+        )
+        self.db.commit()
+
+    def revocation_list(self) -> RevocationList:
+        return RevocationList(
+            capacity=100,
+            error_rate=0.01,
+            sync_interval_s=3600,
+            rebuild_interval_s=24 * 3600,
+        )
+
+    def test_loads_on_first_check(self) -> None:
+        # Right after the host booted, the monotonic clock is near 0.
+        with mock.patch("time.monotonic", return_value=1.0):
+            revocation_list = self.revocation_list()
+            self.assertTrue(revocation_list.is_revoked("revoked"))
+            self.assertFalse(revocation_list.is_revoked("valid"))
+
+    def test_revoke(self) -> None:
+        revocation_list = self.revocation_list()
+        self.assertFalse(revocation_list.is_revoked("other"))
+        revocation_list.revoke("other", 1, int(time.time()) + 3600)
+        self.assertTrue(revocation_list.is_revoked("other"))
+
+
+# python3 -m lib.tests.token_revocation
+if __name__ == '__main__':
+    unittest.main()
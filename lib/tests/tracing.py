@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from lib.tracing import (
+    Trace,
+    TraceExporter,
+    Span,
+    _trace,
+    current_trace_id,
+    span,
+    traced,
+    traced_methods,
+    untraced,
+)
+
+
+@traced_methods
+class Model:
+
+    @classmethod
+    def get(cls) -> int:
+        with span("query"):
+            return 1
+
+    @staticmethod
+    def count() -> int:
+        return 2
+
+    def save(self) -> None:
+        raise ValueError("boom")
+
+    def _private(self) -> int:
+        return 3
+
+    @classmethod
+    @untraced
+    def from_values(cls, values) -> "Model":
+        return cls()
+
+
+class TracingTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.trace = Trace()
+        self.token = _trace.set(self.trace)
+
+    def tearDown(self) -> None:
+        _trace.reset(self.token)
+
+    def names(self):
+        return [(s.name, s.parent_id) for s in self.trace.spans]
+
+    def test_nested_spans(self) -> None:
+        self.assertEqual(current_trace_id(), self.trace.trace_id)
+        with span("root") as root:
+            self.assertEqual(Model.get(), 1)
+            self.assertEqual(Model.count(), 2)
+            self.assertEqual(Model()._private(), 3)
+            Model.from_values(())
+            with self.assertRaises(ValueError):
+                Model().save()
+        get, query = self.trace.spans[1:3]
+        self.assertEqual(self.names(), [
+            ("root", None),
+            ("Model.get", root.span_id),
+            ("query", get.span_id),
+            ("Model.count", root.span_id),
+            ("Model.save", root.span_id),
+        ])
+        self.assertIn("boom", self.trace.spans[-1].attributes["error"])
+        self.assertTrue(all(s.end >= s.start for s in self.trace.spans))
+
+    def test_async(self) -> None:
+        @traced()
+        async def fetch() -> int:
+            await asyncio.sleep(0)
+            return Model.count()
+
+        async def main() -> int:
+            with span("root"):
+                return await fetch()
+
+        self.assertEqual(asyncio.run(main()), 2)
+        self.assertEqual(
+            [s.name for s in self.trace.spans],
+            ["root", "TracingTest.test_async.<locals>.fetch", "Model.count"],
+        )
+
+    def test_untraced(self) -> None:
+        _trace.set(None)
+        with span("root") as s:
+            self.assertIsNone(s)
+        self.assertEqual(Model.count(), 2)
+        self.assertEqual(self.trace.spans, [])
+
+    def test_sampling(self) -> None:
+        exporter = TraceExporter(
+            "t.jsonl", 1024, 1, 0.0, slow_ms=100, queue_size=10
+        )
+        root = Span("GET /", None, {"http.status_code": 200})
+        root.end = root.start + 0.01
+        self.assertFalse(exporter.sampled(root))
+        root.end = root.start + 0.2
+        self.assertTrue(exporter.sampled(root))
+        root.end = root.start
+        root.attributes["http.status_code"] = 502
+        self.assertTrue(exporter.sampled(root))
+        self.assertFalse(
+            TraceExporter(
+                None, 1024, 1, 1.0, slow_ms=0, queue_size=10
+            ).sampled(root)
+        )
+
+    def test_export_queued(self) -> None:
+        with tempfile.TemporaryDirectory() as dir:
+            file = os.path.join(dir, "traces.jsonl")
+            exporter = TraceExporter(
+                file, 1024 * 1024, 1, 1.0, slow_ms=None, queue_size=10
+            )
+            with span("root"):
+                with span("child"):
+                    pass
+            exporter.export(self.trace)
+            # Written by the writer thread, flushed by stop.
+            exporter.stop()
+            with open(file) as f:
+                spans = [json.loads(line) for line in f]
+        self.assertEqual([s["name"] for s in spans], ["root", "child"])
+        self.assertEqual(spans[1]["parentSpanId"], spans[0]["spanId"])
+
+
+# python3 -m lib.tests.tracing
+if __name__ == '__main__':
+    unittest.main()
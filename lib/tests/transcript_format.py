@@ -0,0 +1,105 @@
+import json
+import unittest
+
+from lib.transcript_format import (
+    RenditionCache,
+    Segment,
+    chunked,
+    parse_cues,
+    parse_json,
+    render,
+)
+from models.resource import Format
+
+
+SRT = (
+    "1\n00:00:01,000 --> 00:00:02,500\nHello\nworld\n\n"
+    "2\r\n00:01:02,000 --> 01:00:03,040\r\n元青花\r\n"
+)
+
+
+class TranscriptFormatTest(unittest.TestCase):
+
+    def test_parse_srt_and_vtt(self) -> None:
+        segments = [
+            Segment(1, 2.5, "Hello\nworld"),
+            Segment(62, 3603.04, "元青花"),
+        ]
+        self.assertEqual(list(parse_cues(SRT)), segments)
+        vtt = "".join(render({"srt": SRT}, Format.VTT))
+        self.assertTrue(vtt.startswith("WEBVTT\n\n00:00:01.000 --> "))
+        self.assertEqual(list(parse_cues(vtt)), segments)
+
+    def test_render_round_trip(self) -> None:
+        srt = "".join(render({"vtt": "".join(
+            render({"srt": SRT}, Format.VTT)
+        )}, Format.SRT))
+        self.assertEqual(list(parse_cues(srt)), list(parse_cues(SRT)))
+
+    def test_render_json_and_text(self) -> None:
+        rendered = json.loads("".join(render({"srt": SRT}, Format.JSON)))
+        self.assertEqual(rendered["segments"][1]["text"], "元青花")
+        self.assertEqual(
+            "".join(render({"json": json.dumps(rendered)}, Format.TEXT)),
+            "Hello\nworld\n元青花\n",
+        )
+
+    def test_parse_json(self) -> None:
+        whisper = {
+            "text": " Hello world",
+            "segments": [
+                {"start": 1, "end": 2.5, "text": " Hello"},
+                {"start": 2.5, "end": 3, "text": "world", "words": [{}]},
+            ],
+            "language": "en",
+        }
+        segments = [Segment(1, 2.5, "Hello"), Segment(2.5, 3, "world")]
+        self.assertEqual(list(parse_json(json.dumps(whisper))), segments)
+        self.assertEqual(
+            list(parse_json(json.dumps(whisper, indent=2))), segments
+        )
+        self.assertEqual(
+            list(parse_json(json.dumps({**whisper, "segments": []}))),
+            [Segment(0, 0, "Hello world")],
+        )
+        self.assertEqual(list(parse_json("[]")), [])
+        with self.assertRaises(ValueError):
+            list(parse_json('{"segments": [{"start": 1} {}]}'))
+
+    def test_render_prefers_stored_copy(self) -> None:
+        self.assertEqual(
+            list(render({"srt": SRT, "text": "as stored"}, Format.TEXT)),
+            ["as stored"],
+        )
+        with self.assertRaises(ValueError):
+            render({}, Format.SRT)
+
+    def test_chunked(self) -> None:
+        self.assertEqual(
+            list(chunked(["ab", "c", "defgh"], size=3)),
+            ["abc", "def", "gh"],
+        )
+
+    def test_cache_bounded_by_item_size(self) -> None:
+        cache = RenditionCache(max_size=2, ttl_s=60, max_item_chars=4)
+        self.assertEqual("".join(cache.stream("a", lambda: ["ab"])), "ab")
+        self.assertEqual(
+            "".join(cache.stream("b", lambda: ["abcde"])), "abcde"
+        )
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual("".join(cache.stream("a", lambda: ["x"])), "ab")
+
+    def test_cache_makes_before_streaming(self) -> None:
+        cache = RenditionCache(max_size=2, ttl_s=60, max_item_chars=4)
+
+        def make():
+            raise ValueError("no transcript")
+
+        with self.assertRaises(ValueError):
+            cache.stream("a", make)
+
+
+# python3 -m lib.tests.transcript_format
+if __name__ == '__main__':
+    unittest.main()
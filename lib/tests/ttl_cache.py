@@ -0,0 +1,49 @@
+import unittest
+
+from lib.ttl_cache import TTLCache
+
+
+class FakeClock:
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        self.cache = TTLCache(max_size=2, ttl_s=10, clock=self.clock)
+
+    def test_get_return_value_before_expire(self) -> None:
+        self.cache.set("a", 1)
+        self.clock.now = 9
+        self.assertEqual(self.cache.get("a"), 1)
+
+    def test_get_return_default_after_expire(self) -> None:
+        self.cache.set("a", 1)
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_set_evict_least_recently_used(self) -> None:
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_delete_return_value(self) -> None:
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.delete("a"), 1)
+        self.assertIsNone(self.cache.delete("a"))
+
+
+# python3 -m lib.tests.ttl_cache
+if __name__ == '__main__':
+    unittest.main()
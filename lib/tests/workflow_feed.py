@@ -0,0 +1,60 @@
+import asyncio
+import unittest
+
+from lib.tests.db import use_memory_db
+from lib.workflow_feed import WorkflowFeed
+from models.user_version import UserVersion
+from models.workflow import WorkflowSummary, WorkflowType
+
+
+class WorkflowFeedTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+
+    def add_workflow(self, user_id: int) -> int:
+        cursor = self.db.execute(
+            "INSERT INTO workflow (user_id, create_at, args, type, status) "
+            "VALUES (?, 0, '{}', 1, 1)",
+            (user_id,)
+        )
+        self.db.commit()
+        return cursor.lastrowid
+
+    def test_triggers_bump_version(self) -> None:
+        id = self.add_workflow(1)
+        self.add_workflow(2)
+        self.assertEqual(UserVersion.get(1), 1)
+        self.db.execute("UPDATE workflow SET status = 7 WHERE id = ?", (id,))
+        self.db.execute(
+            "INSERT INTO video (workflow_id, user_id, transcript) "
+            "VALUES (?, 1, '{}')",
+            (id,)
+        )
+        self.db.commit()
+        self.assertEqual(UserVersion.get_many([1, 2, 3]), {1: 3, 2: 1})
+
+        changed = WorkflowSummary.list_changed(1, WorkflowType.VIDEO, 1, 10)
+        self.assertEqual([(m.id, m.version) for m in changed], [(id, 3)])
+
+    def test_wait_wakes_on_change(self) -> None:
+        feed = WorkflowFeed(poll_interval_s=0.01)
+
+        async def run():
+            waiter = asyncio.create_task(feed.wait(1, 0, timeout=5))
+            await asyncio.sleep(0.05)
+            self.add_workflow(1)
+            return await waiter
+
+        self.assertEqual(asyncio.run(run()), 1)
+
+    def test_wait_times_out(self) -> None:
+        feed = WorkflowFeed(poll_interval_s=0.01)
+        self.add_workflow(1)
+        self.assertEqual(asyncio.run(feed.wait(1, 1, timeout=0.05)), 1)
+        self.assertEqual(feed._waiters, {})
+
+
+# python3 -m lib.tests.workflow_feed
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+
+from lib.tests.db import use_memory_db
+from lib.workflow_scheduler import WorkflowScheduler
+
+
+class WorkflowSchedulerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        for user_id, credit in ((1, 100), (2, 100), (3, 0)):
+            self.db.execute(
+                "INSERT INTO users (id, name, create_at, credit) "
+                "VALUES (?, ?, 0, ?)",
+                (user_id, f"{user_id}@b.c", credit)
+            )
+        self.db.commit()
+
+    def add_workflows(
+        self, user_id: int, count: int, priority: int = 0
+    ) -> None:
+        for _ in range(count):
+            self.db.execute(
+                "INSERT INTO workflow "
+                "(user_id, create_at, args, type, status, priority) "
+                "VALUES (?, 0, '{}', 1, 1, ?)",
+                (user_id, priority)
+            )
+        self.db.commit()
+
+    def finish(self, ids) -> None:
+        self.db.executemany(
+            "UPDATE workflow SET status = 7 WHERE id = ?",
+            [(id,) for id in ids]
+        )
+        self.db.commit()
+
+    def scheduler(self, **kwargs) -> WorkflowScheduler:
+        params = dict(
+            default_weight=1,
+            user_weights={},
+            max_running_per_user=100,
+            load_batch=3,
+            sync_interval_s=0,
+            resync_interval_s=3600,
+        )
+        params.update(kwargs)
+        return WorkflowScheduler(**params)
+
+    def test_claim_fair_across_users(self) -> None:
+        self.add_workflows(1, 10)
+        self.add_workflows(2, 2)
+        claimed = self.scheduler().claim(limit=5)
+        self.assertEqual(
+            [w.user_id for w in claimed], [1, 2, 1, 2, 1]
+        )
+        self.assertEqual(
+            [w.status.value for w in claimed], [3] * 5
+        )
+
+    def test_claim_weighted(self) -> None:
+        self.add_workflows(1, 10)
+        self.add_workflows(2, 10)
+        scheduler = self.scheduler(user_weights={2: 3})
+        users = [w.user_id for w in scheduler.claim(limit=8)]
+        self.assertEqual(users.count(2), 6)
+
+    def test_claim_capped_per_user(self) -> None:
+        self.add_workflows(1, 5)
+        scheduler = self.scheduler(max_running_per_user=2)
+        claimed = scheduler.claim(limit=5)
+        self.assertEqual(len(claimed), 2)
+        self.assertEqual(scheduler.claim(limit=5), [])
+        self.finish([claimed[0].id])
+        self.assertEqual(len(scheduler.claim(limit=5)), 1)
+
+    def test_no_credit_at_admission(self) -> None:
+        self.add_workflows(3, 2)
+        self.add_workflows(1, 1)
+        claimed = self.scheduler().claim(limit=5)
+        self.assertEqual([w.user_id for w in claimed], [1])
+        statuses = self.db.execute(
+            "SELECT status FROM workflow WHERE user_id = 3"
+        ).fetchall()
+        self.assertEqual(statuses, [(8,), (8,)])
+
+    def test_claim_skips_deleted(self) -> None:
+        self.add_workflows(1, 2)
+        scheduler = self.scheduler(sync_interval_s=3600)
+        scheduler.claim(limit=0)
+        self.db.execute("UPDATE workflow SET status = 20 WHERE id = 1")
+        self.db.commit()
+        self.assertEqual([w.id for w in scheduler.claim(limit=5)], [2])
+
+    def test_claim_by_priority_within_user(self) -> None:
+        self.add_workflows(1, 2)
+        self.add_workflows(1, 2, priority=5)
+        self.add_workflows(2, 2, priority=9)
+        claimed = self.scheduler().claim(limit=6)
+        # Priorities don't take turns from the other users.
+        self.assertEqual(
+            [(w.user_id, w.id) for w in claimed],
+            [(1, 3), (2, 5), (1, 4), (2, 6), (1, 1), (1, 2)]
+        )
+
+
+# python3 -m lib.tests.workflow_scheduler
+if __name__ == '__main__':
+    unittest.main()
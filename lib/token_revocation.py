@@ -0,0 +1,109 @@
+import logging
+import time
+
+from lib.bloom_filter import BloomFilter
+from lib.config import (
+    REVOCATION_FILTER_CAPACITY,
+    REVOCATION_FILTER_ERROR_RATE,
+    REVOCATION_SYNC_S,
+    REVOCATION_REBUILD_S,
+)
+from models.revoked_token import RevokedToken
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class RevocationList:
+    """
+    In-memory Bloom filter in front of the 'token_revocation' table.
+
+    A token id that is not in the filter is not revoked, which is the answer
+    for almost every request, without any query. Only filter hits, i.e. the
+    revoked tokens and the rare false positives, are confirmed by the table.
+
+    Every `REVOCATION_SYNC_S` the filter pulls the revocations written by
+    other processes since the last sync. Every `REVOCATION_REBUILD_S` the
+    expired rows are purged and the filter is rebuilt without them, as Bloom
+    filters can't drop items.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        error_rate: float,
+        sync_interval_s: float,
+        rebuild_interval_s: float,
+    ) -> None:
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._sync_interval_s = sync_interval_s
+        self._rebuild_interval_s = rebuild_interval_s
+        self._filter = BloomFilter(capacity, error_rate)
+        self._last_id = 0
+        # Load on the first check, whatever the host uptime.
+        self._last_sync = float("-inf")
+        self._last_rebuild = float("-inf")
+
+    def revoke(self, jti: str, user_id: int, expire_at: int) -> None:
+        RevokedToken(jti=jti, user_id=user_id, expire_at=expire_at).save()
+        self._filter.add(jti)
+        logger.info("Revoked token: %s of user: %s", jti, user_id)
+
+    def is_revoked(self, jti: str) -> bool:
+        self._maybe_sync()
+        if jti not in self._filter:
+            return False
+        return RevokedToken.exists(jti)
+
+    def _maybe_sync(self) -> None:
+        now = time.monotonic()
+        if now - self._last_rebuild >= self._rebuild_interval_s:
+            self._rebuild(now)
+        elif now - self._last_sync >= self._sync_interval_s:
+            self._sync(now)
+
+    def _sync(self, now: float) -> None:
+        self._last_sync = now
+        try:
+            rows = RevokedToken.list_since(self._last_id)
+        except Exception as e:
+            logger.error("Failed to sync token revocations due to: %s", e)
+            return
+        for id, jti in rows:
+            self._filter.add(jti)
+            self._last_id = id
+        if len(self._filter) > self._filter.capacity:
+            # Rebuild bigger on next check to keep the false positive rate.
+            self._last_rebuild = float("-inf")
+
+    def _rebuild(self, now: float) -> None:
+        self._last_rebuild = now
+        self._last_sync = now
+        try:
+            purged = RevokedToken.purge_expired()
+            rows = RevokedToken.list_since(0)
+        except Exception as e:
+            logger.error("Failed to rebuild token revocations due to: %s", e)
+            return
+        self._capacity = max(self._capacity, 2 * len(rows))
+        bloom = BloomFilter(self._capacity, self._error_rate)
+        last_id = 0
+        for id, jti in rows:
+            bloom.add(jti)
+            last_id = id
+        self._filter, self._last_id = bloom, last_id
+        logger.debug(
+            "Rebuilt token revocation filter with %s tokens, purged %s "
+            "expired.",
+            len(rows),
+            purged,
+        )
+
+
+revocation_list = RevocationList(
+    capacity=REVOCATION_FILTER_CAPACITY,
+    error_rate=REVOCATION_FILTER_ERROR_RATE,
+    sync_interval_s=REVOCATION_SYNC_S,
+    rebuild_interval_s=REVOCATION_REBUILD_S,
+)
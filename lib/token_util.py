@@ -1,24 +1,33 @@
 from typing import Optional, TypeVar
 import logging
 import time
+import uuid
 
 from aiocache import Cache
 from fastapi import Request
 from fastapi.security.utils import get_authorization_scheme_param
 import jwt
 
+from models.api_key import KEY_PREFIX, Scope
+from models.session import RefreshSession
 from models.user import User
-from lib.const import COOKIE_TOKEN_KEY
+from lib.api_key_index import api_key_index
+from lib.const import COOKIE_TOKEN_KEY, REFRESH_COOKIE_KEY
+from lib.token_revocation import revocation_list
+from lib.tracing import span, traced
 from lib.config import (
+    ADMIN_EMAILS,
     JWT_ALGORITHM,
     JWT_SECRET,
     AUTH_TOKEN_EXPIRE_S,
     ACCESS_TOKEN_EXPIRE_S,
+    REFRESH_SESSION_IDLE_S,
     DOMAIN,
 )
 from lib.exception import (
     UserAuthorizationException,
     UserAuthorizationExpiredException,
+    UserForbiddenException,
 )
 
 
@@ -38,6 +47,8 @@ class Token():
     def __init__(self, user_id: int, expire_after: int) -> None:
         self.expire_after = expire_after
         self.user_id = user_id
+        # Token id, to revoke this token before it expires.
+        self.jti = uuid.uuid4().hex
 
     @classmethod
     async def decode(cls, encoded_token: str) -> int:
@@ -46,33 +57,57 @@ class Token():
             raw_token = jwt.decode(encoded_token, JWT_SECRET, JWT_ALGORITHM)
         except jwt.InvalidSignatureError as e:
             logger.error(
-                f"Faild to decode token: {encoded_token} "
-                f"due to InvalidSignatureError: {e}"
+                "Faild to decode token: %s due to InvalidSignatureError: %s",
+                encoded_token, e,
             )
             raise UserAuthorizationException from e
         except jwt.ExpiredSignatureError as e:
             logger.error(
-                f"Faild to decode token: {encoded_token} "
-                f"due to ExpiredSignatureError: {e}"
+                "Faild to decode token: %s due to ExpiredSignatureError: %s",
+                encoded_token, e,
             )
             raise UserAuthorizationExpiredException from e
         except Exception as e:
             logger.error(
-                f"Faild to decode token: {encoded_token} "
-                f"due to Unknown Exception: {e}"
+                "Faild to decode token: %s due to Unknown Exception: %s",
+                encoded_token, e,
             )
             raise UserAuthorizationException from e
 
         if not raw_token or "user_id" not in raw_token.keys():
             logger.error(
-                f"Faild to decode token: {encoded_token} due "
-                "decoded result is empty or None. "
-                f"decoded raw token: {raw_token}"
+                "Faild to decode token: %s due decoded result "
+                "is empty or None. decoded raw token: %s",
+                encoded_token, raw_token,
+            )
+            raise UserAuthorizationException()
+
+        jti = raw_token.get("jti")
+        if jti and revocation_list.is_revoked(jti):
+            logger.error(
+                "Authroization denied due to revoked token: %s of user: %s",
+                jti, raw_token['user_id'],
             )
             raise UserAuthorizationException()
 
         return raw_token["user_id"]
 
+    @classmethod
+    def expire_at(cls, encoded_token: str) -> Optional[int]:
+        """
+        Return the expiration time of a validly signed token, expired or not.
+        """
+        try:
+            raw_token = jwt.decode(
+                encoded_token,
+                JWT_SECRET,
+                JWT_ALGORITHM,
+                options={"verify_exp": False},
+            )
+        except Exception:
+            return None
+        return raw_token.get("exp")
+
     async def encode(self) -> str:
         # https://pyjwt.readthedocs.io/en/stable/usage.html#expiration-time-claim-exp
         raw_token = {
@@ -81,6 +116,7 @@ class Token():
             # on or after which the JWT MUST NOT be accepted for processing.
             "exp": self.expire_after,
             "user_id": self.user_id,
+            "jti": self.jti,
         }
         encoded_token = jwt.encode(raw_token, JWT_SECRET, JWT_ALGORITHM)
         return encoded_token
@@ -106,8 +142,8 @@ class AuthToken(Token):
         if user_id_cached != user_id_token:
             logger.error(
                 "Invalid user id from the encoded auth token. "
-                f"user_id_cached={user_id_cached} and "
-                f"user_id_token={user_id_token}"
+                "user_id_cached=%s and user_id_token=%s",
+                user_id_cached, user_id_token,
             )
             raise UserAuthorizationException()
         await cache.delete(encoded_token)
@@ -134,16 +170,19 @@ class TokenBearer():
     to the authenticating user and return <User> if authorilized.
     """
 
+    @traced("auth.cookie")
     async def __call__(self, req: Request) -> Optional[User]:
         auth: str = req.cookies.get(COOKIE_TOKEN_KEY)
         logger.debug(
-            f"AuthTokenBearer.__call__ is invoked with "
-            f"cookie {req.cookies} and auth={auth}"
+            "AuthTokenBearer.__call__ is invoked with cookies: %s",
+            list(req.cookies),
         )
         if not auth:
             logger.error(
-                f"Authroization denied due to missing '{COOKIE_TOKEN_KEY}' "
-                f"in the Request cookie: {req.headers}."
+                "Authroization denied due to missing '%s' "
+                "in the Request cookies: %s.",
+                COOKIE_TOKEN_KEY,
+                list(req.cookies),
             )
             raise UserAuthorizationException()
 
@@ -151,14 +190,15 @@ class TokenBearer():
         if scheme.lower() != "bearer":
             logger.error(
                 "Authroization denied due to invalid "
-                f"authorization_scheme: {scheme}. Expect: 'bearer'"
+                "authorization_scheme: %s. Expect: 'bearer'",
+                scheme,
             )
             raise UserAuthorizationException()
 
         user_id_verified = await self.__decode__(auth_token)
         user = User.get_by_id(user_id_verified)
 
-        logger.debug(f"Get user: {user.name} with token: {auth_token}")
+        logger.debug("Get user: %s with token.", user.name)
         return user
 
     async def __decode__(self, token_encoded: str) -> Token:
@@ -171,12 +211,49 @@ class AuthTokenBearer(TokenBearer):
 
 
 class AccessTokenBearer(TokenBearer):
+    """
+    Check the access token cookie. With a `scope`, an API key allowed for
+    that scope is accepted as well from the Authorization header:
+    `Authorization: Bearer pk_...`.
+    """
+
+    def __init__(self, scope: Optional[Scope] = None) -> None:
+        self.scope = scope
+
+    async def __call__(self, req: Request) -> Optional[User]:
+        if self.scope:
+            scheme, key = get_authorization_scheme_param(
+                req.headers.get("Authorization")
+            )
+            if scheme.lower() == "bearer" and key.startswith(KEY_PREFIX):
+                with span("auth.api_key"):
+                    user_id = api_key_index.authenticate(key, self.scope)
+                    return User.get_by_id(user_id)
+        return await super().__call__(req)
+
     async def __decode__(self, token_encoded: str) -> Token:
         return await AccessToken.decode(token_encoded)
 
 
+class AdminTokenBearer(AccessTokenBearer):
+    """
+    AccessTokenBearer that only lets the `ADMIN_EMAILS` users through.
+    """
+
+    async def __call__(self, req: Request) -> Optional[User]:
+        user = await super().__call__(req)
+        if user.name not in ADMIN_EMAILS:
+            logger.error("User: %s is not an admin.", user.name)
+            raise UserForbiddenException()
+        return user
+
+
 async def set_cookie_token(rsp: T, token: Token) -> T:
     token_encoded = await token.encode()
+    return set_cookie_encoded_token(rsp, token_encoded)
+
+
+def set_cookie_encoded_token(rsp: T, token_encoded: str) -> T:
     rsp.set_cookie(
         key=COOKIE_TOKEN_KEY,
         value=f"Bearer {token_encoded}",
@@ -191,3 +268,58 @@ async def set_cookie_token(rsp: T, token: Token) -> T:
 def delete_cookie_token(rsp: T) -> T:
     rsp.delete_cookie(key=COOKIE_TOKEN_KEY)
     return rsp
+
+
+def set_cookie_refresh_token(rsp: T, refresh_token: str) -> T:
+    rsp.set_cookie(
+        key=REFRESH_COOKIE_KEY,
+        value=refresh_token,
+        httponly=True,
+        secure=True,
+        domain=DOMAIN,
+        max_age=REFRESH_SESSION_IDLE_S,
+    )
+    return rsp
+
+
+def delete_cookie_refresh_token(rsp: T) -> T:
+    rsp.delete_cookie(key=REFRESH_COOKIE_KEY)
+    return rsp
+
+
+async def refresh_access_token(refresh_token: str) -> Optional[AccessToken]:
+    """
+    Issue a new access token from a valid refresh session and slide the
+    session forward. Return None if the session is unknown, revoked or
+    expired, in which case the user has to log in with Google again.
+    """
+    session = RefreshSession.get(refresh_token)
+    if not session or not session.is_valid():
+        logger.info("Refresh session is missing, revoked or expired.")
+        return None
+    session.touch()
+    logger.debug("Refreshed access token for user: %s", session.user_id)
+    return AccessToken(session.user_id)
+
+
+async def revoke_token(token_encoded: str) -> bool:
+    """
+    Revoke a validly signed token until it expires.
+    Return False if the token is invalid or already expired.
+    """
+    try:
+        raw_token = jwt.decode(
+            token_encoded,
+            JWT_SECRET,
+            JWT_ALGORITHM,
+            options={"verify_exp": False},
+        )
+    except Exception as e:
+        logger.error("Can not revoke invalid token due to: %s", e)
+        return False
+    jti = raw_token.get("jti")
+    expire_at = raw_token.get("exp", 0)
+    if not jti or expire_at <= now():
+        return False
+    revocation_list.revoke(jti, raw_token["user_id"], expire_at)
+    return True
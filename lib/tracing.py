@@ -0,0 +1,303 @@
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import secrets
+import time
+
+from contextvars import ContextVar
+from fastapi import Request
+from starlette.middleware.base import BaseHTTPMiddleware
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from lib.config import (
+    TRACE_SAMPLE_RATE,
+    TRACE_SLOW_MS,
+    TRACE_FILE,
+    TRACE_FILE_MAX_BYTES,
+    TRACE_FILE_BACKUPS,
+    TRACE_QUEUE_SIZE,
+)
+from lib.log_pipeline import NonBlockingQueueHandler, RedactingFormatter
+
+
+logger = logging.getLogger("uvicorn.error")
+
+TRACE_ID_HEADER = "X-Trace-Id"
+TRACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+# Spans kept per trace, so a runaway loop can not grow one without bound.
+MAX_SPANS = 1000
+
+T = TypeVar("T")
+
+
+class Span:
+    __slots__ = (
+        "name", "span_id", "parent_id", "start", "end", "attributes",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        parent_id: Optional[str],
+        attributes: Dict[str, Any],
+    ) -> None:
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.time()) - self.start) * 1000
+
+
+class Trace:
+    """
+    The spans of one request, recorded whether sampled or not: a span is
+    a few attributes, and slow requests are kept after the fact.
+    """
+
+    def __init__(self, trace_id: Optional[str] = None) -> None:
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_span: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Time the block as a child of the current span. A no-op out of a
+    traced request, like in the background tasks.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    if len(trace.spans) >= MAX_SPANS:
+        trace.dropped += 1
+        yield None
+        return
+    parent = _span.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    trace.spans.append(current)
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = repr(e)
+        raise
+    finally:
+        current.end = time.time()
+        _span.reset(token)
+
+
+def traced(name: Optional[str] = None) -> Callable[[T], T]:
+    """
+    Decorate a function, sync or async, to run in a span named `name`,
+    its qualified name by default.
+    """
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def untraced(fn: T) -> T:
+    """
+    Leave a method out of `traced_methods`, as the row conversions: called
+    once per row, their spans would cost more than they tell.
+    """
+    fn.__untraced__ = True
+    return fn
+
+
+def traced_methods(cls: T) -> T:
+    """
+    Class decorator tracing the public methods, class and static ones
+    included, of a model: one span per DB access. See `untraced`.
+    """
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith("_"):
+            continue
+        fn = getattr(value, "__func__", value)
+        if getattr(fn, "__untraced__", False):
+            continue
+        name = f"{cls.__name__}.{attr}"
+        if isinstance(value, classmethod):
+            setattr(cls, attr, classmethod(traced(name)(value.__func__)))
+        elif isinstance(value, staticmethod):
+            setattr(cls, attr, staticmethod(traced(name)(value.__func__)))
+        elif inspect.isfunction(value):
+            setattr(cls, attr, traced(name)(value))
+    return cls
+
+
+class TraceExporter:
+    """
+    Write the spans of the sampled traces to `file`, one JSON object per
+    line with the OpenTelemetry span fields, rotated past `max_bytes`.
+    scripts/trace_to_chrome.py turns it into a trace viewer file.
+
+    Like the logs, see lib/log_pipeline.py, the traces go through a queue
+    of `queue_size` to a writer thread, so the event loop never waits on
+    the file; a full queue drops them.
+
+    A trace is sampled at `sample_rate`, or always when it took more than
+    `slow_ms` or failed.
+    """
+
+    def __init__(
+        self,
+        file: Optional[str],
+        max_bytes: int,
+        backups: int,
+        sample_rate: float,
+        slow_ms: Optional[float],
+        queue_size: int,
+    ) -> None:
+        self._file = file
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._sample_rate = sample_rate
+        self._slow_ms = slow_ms
+        self._queue_size = queue_size
+        self._logger: Optional[logging.Logger] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
+    def sampled(self, root: Span) -> bool:
+        if not self._file:
+            return False
+        if root.attributes.get("http.status_code", 0) >= 500:
+            return True
+        if self._slow_ms is not None and root.duration_ms >= self._slow_ms:
+            return True
+        return random.random() < self._sample_rate
+
+    def export(self, trace: Trace) -> None:
+        # One record, one queue slot, per trace.
+        self._output().info("\n".join(
+            json.dumps({
+                "traceId": trace.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id,
+                "name": s.name,
+                "startTimeUnixNano": int(s.start * 1e9),
+                "endTimeUnixNano": int((s.end or s.start) * 1e9),
+                "attributes": s.attributes,
+            }, default=str)
+            for s in trace.spans
+        ))
+        if trace.dropped:
+            logger.warning(
+                "Trace: %s dropped %s spans.",
+                trace.trace_id, trace.dropped,
+            )
+
+    def stop(self) -> None:
+        """
+        Write the queued traces and stop the writer.
+        """
+        if self._listener:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+        if self._logger:
+            for handler in list(self._logger.handlers):
+                self._logger.removeHandler(handler)
+            self._logger = None
+
+    def _output(self) -> logging.Logger:
+        if self._logger is None:
+            handler = logging.handlers.RotatingFileHandler(
+                self._file,
+                maxBytes=self._max_bytes,
+                backupCount=self._backups,
+                encoding="utf-8",
+                delay=True,
+            )
+            handler.setFormatter(
+                RedactingFormatter(logging.Formatter("%(message)s"))
+            )
+            queued = NonBlockingQueueHandler(queue.Queue(self._queue_size))
+            self._listener = logging.handlers.QueueListener(
+                queued.queue, handler
+            )
+            self._listener.start()
+            self._logger = logging.getLogger("tracing")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            self._logger.addHandler(queued)
+        return self._logger
+
+
+trace_exporter = TraceExporter(
+    file=TRACE_FILE,
+    max_bytes=TRACE_FILE_MAX_BYTES,
+    backups=TRACE_FILE_BACKUPS,
+    sample_rate=TRACE_SAMPLE_RATE,
+    slow_ms=TRACE_SLOW_MS,
+    queue_size=TRACE_QUEUE_SIZE,
+)
+
+
+class TracingMiddleware(BaseHTTPMiddleware):
+    """
+    Trace every request: a root span for the whole request, the trace id
+    in the `X-Trace-Id` response header, taken from the request header
+    when valid so a client can correlate its own logs.
+
+    Streamed bodies are sent after the root span ends, so their time is
+    not counted.
+    """
+
+    async def dispatch(self, req: Request, call_next):
+        trace_id = req.headers.get(TRACE_ID_HEADER, "").lower()
+        trace = Trace(trace_id if TRACE_ID_RE.match(trace_id) else None)
+        trace_token = _trace.set(trace)
+        try:
+            with span(
+                f"{req.method} {req.url.path}",
+                **{"http.method": req.method, "http.path": req.url.path},
+            ) as root:
+                rsp = await call_next(req)
+                root.attributes["http.status_code"] = rsp.status_code
+        finally:
+            _trace.reset(trace_token)
+
+        rsp.headers[TRACE_ID_HEADER] = trace.trace_id
+        try:
+            if trace_exporter.sampled(root):
+                trace_exporter.export(trace)
+        except Exception as e:
+            logger.error("Failed to export trace: %s: %s", trace.trace_id, e)
+        return rsp
@@ -0,0 +1,335 @@
+import io
+import json
+import logging
+import re
+
+from typing import (
+    Any,
+    Callable,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+)
+
+from lib.config import (
+    TRANSCRIPT_CACHE_SIZE,
+    TRANSCRIPT_CACHE_TTL_S,
+    TRANSCRIPT_CACHE_MAX_ITEM_CHARS,
+)
+from lib.ttl_cache import TTLCache
+from models.resource import Format
+
+
+logger = logging.getLogger("uvicorn.error")
+
+# Renditions are sent in chunks of about this many characters.
+CHUNK_CHARS = 64 * 1024
+
+MEDIA_TYPES = {
+    Format.SRT: "application/x-subrip; charset=utf-8",
+    # Starlette adds the utf-8 charset to the text/* ones.
+    Format.VTT: "text/vtt",
+    Format.TEXT: "text/plain",
+    Format.JSON: "application/json",
+}
+
+# [hh:]mm:ss[,.]mmm
+TIMESTAMP_RE = re.compile(r"(?:(\d+):)?(\d{1,2}):(\d{1,2})[,.](\d{1,3})")
+WHITESPACE_RE = re.compile(r"\s*")
+JSON_DECODER = json.JSONDecoder()
+
+
+class Segment(NamedTuple):
+    start: float  # seconds
+    end: float
+    text: str
+
+
+def parse_timestamp(value: str) -> float:
+    match = TIMESTAMP_RE.search(value)
+    if not match:
+        raise ValueError(f"Invalid timestamp: {value}")
+    hours, minutes, seconds, millis = match.groups()
+    return (
+        int(hours or 0) * 3600
+        + int(minutes) * 60
+        + int(seconds)
+        + int(millis.ljust(3, "0")) / 1000
+    )
+
+
+def format_timestamp(seconds: float, separator: str) -> str:
+    millis = round(seconds * 1000)
+    hours, millis = divmod(millis, 3600 * 1000)
+    minutes, millis = divmod(millis, 60 * 1000)
+    seconds, millis = divmod(millis, 1000)
+    return f"{hours:02}:{minutes:02}:{seconds:02}{separator}{millis:03}"
+
+
+def parse_cues(text: str) -> Iterator[Segment]:
+    """
+    Segments of an srt or vtt transcript, read block by block. Blocks
+    without timing, like the WEBVTT header or NOTEs, are skipped.
+    """
+    block: List[str] = []
+    for line in io.StringIO(text):
+        line = line.rstrip("\r\n")
+        if line.strip():
+            block.append(line)
+            continue
+        if block:
+            segment = _parse_cue(block)
+            if segment:
+                yield segment
+            block = []
+    if block:
+        segment = _parse_cue(block)
+        if segment:
+            yield segment
+
+
+def _parse_cue(block: List[str]) -> Optional[Segment]:
+    for i, line in enumerate(block):
+        if "-->" not in line:
+            continue
+        start, end = line.split("-->", 1)
+        try:
+            return Segment(
+                parse_timestamp(start),
+                parse_timestamp(end),
+                "\n".join(block[i + 1:]),
+            )
+        except ValueError:
+            logger.warning("Skipped invalid cue timing: %s", line)
+            return None
+    return None
+
+
+class JsonReader:
+    """
+    Decode the values of a json document one at a time, to walk a big one
+    without building all of it.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.pos = 0
+
+    def peek(self) -> str:
+        self.pos = WHITESPACE_RE.match(self.text, self.pos).end()
+        return self.text[self.pos:self.pos + 1]
+
+    def take(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at: {self.pos}")
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        self.peek()
+        value, self.pos = JSON_DECODER.raw_decode(self.text, self.pos)
+        return value
+
+    def items(self, close: str) -> Iterator[None]:
+        """
+        Once per item of the array or object just opened, for the caller
+        to read it, up to `close`.
+        """
+        if self.peek() == close:
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.take("," + close) == close:
+                return
+
+
+def parse_json(text: str) -> Iterator[Segment]:
+    """
+    Segments of a whisper json transcript: "segments" with "start", "end"
+    and "text", or only a "text". Decoded segment by segment, the other
+    members one by one.
+    """
+    reader = JsonReader(text)
+    if reader.peek() != "{":
+        return
+    reader.take("{")
+    whole = None
+    segmented = False
+    for _ in reader.items("}"):
+        key = reader.value()
+        reader.take(":")
+        if key == "segments" and reader.peek() == "[":
+            reader.take("[")
+            for _ in reader.items("]"):
+                segment = reader.value()
+                segmented = True
+                yield Segment(
+                    float(segment.get("start", 0)),
+                    float(segment.get("end", 0)),
+                    str(segment.get("text", "")).strip(),
+                )
+        elif key == "text":
+            whole = reader.value()
+        else:
+            reader.value()
+    if not segmented and whole:
+        yield Segment(0, 0, str(whole).strip())
+
+
+def parse_text(text: str) -> Iterator[Segment]:
+    for line in io.StringIO(text):
+        if line.strip():
+            yield Segment(0, 0, line.strip())
+
+
+# Canonical formats, the timed ones first.
+PARSERS: Mapping[Format, Callable[[str], Iterator[Segment]]] = {
+    Format.JSON: parse_json,
+    Format.SRT: parse_cues,
+    Format.VTT: parse_cues,
+    Format.TEXT: parse_text,
+}
+
+
+def to_srt(segments: Iterable[Segment]) -> Iterator[str]:
+    for i, segment in enumerate(segments, 1):
+        yield (
+            f"{i}\n"
+            f"{format_timestamp(segment.start, ',')} --> "
+            f"{format_timestamp(segment.end, ',')}\n"
+            f"{segment.text}\n\n"
+        )
+
+
+def to_vtt(segments: Iterable[Segment]) -> Iterator[str]:
+    yield "WEBVTT\n\n"
+    for segment in segments:
+        yield (
+            f"{format_timestamp(segment.start, '.')} --> "
+            f"{format_timestamp(segment.end, '.')}\n"
+            f"{segment.text}\n\n"
+        )
+
+
+def to_text(segments: Iterable[Segment]) -> Iterator[str]:
+    for segment in segments:
+        yield f"{segment.text}\n"
+
+
+def to_json(segments: Iterable[Segment]) -> Iterator[str]:
+    yield '{"segments": ['
+    for i, segment in enumerate(segments):
+        yield (", " if i else "") + json.dumps(
+            segment._asdict(), ensure_ascii=False
+        )
+    yield "]}"
+
+
+RENDERERS: Mapping[Format, Callable[[Iterable[Segment]], Iterator[str]]] = {
+    Format.SRT: to_srt,
+    Format.VTT: to_vtt,
+    Format.TEXT: to_text,
+    Format.JSON: to_json,
+}
+
+
+def source_format(available: Iterable[str], fmt: Format) -> Optional[str]:
+    """
+    The stored format to render `fmt` from: itself if available, else the
+    best one to convert.
+    """
+    available = set(available)
+    if fmt.value in available:
+        return fmt.value
+    for source in PARSERS:
+        if source.value in available:
+            return source.value
+    return None
+
+
+def render(transcript: Mapping[str, str], fmt: Format) -> Iterator[str]:
+    """
+    Stream `transcript`, the format -> content map stored for a video, as
+    `fmt`: the stored copy if there is one, else converted segment by
+    segment from the best stored format.
+    """
+    source = source_format([k for k, v in transcript.items() if v], fmt)
+    if source is None:
+        raise ValueError(f"No transcript to convert among: {list(transcript)}")
+    if source == fmt.value:
+        return iter([transcript[source]])
+    return RENDERERS[fmt](PARSERS[Format(source)](transcript[source]))
+
+
+def chunked(parts: Iterable[str], size: int = CHUNK_CHARS) -> Iterator[str]:
+    """
+    Merge small parts, and split big ones, into chunks of about `size`.
+    """
+    buffer: List[str] = []
+    buffered = 0
+    for part in parts:
+        for i in range(0, len(part), size):
+            piece = part[i:i + size]
+            buffer.append(piece)
+            buffered += len(piece)
+            if buffered >= size:
+                yield "".join(buffer)
+                buffer, buffered = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+class RenditionCache:
+    """
+    Bounded LRU cache of the rendered transcripts, filled while they are
+    streamed the first time. Renditions longer than `max_item_chars` are
+    streamed without being kept.
+    """
+
+    def __init__(self, max_size: int, ttl_s: float, max_item_chars: int):
+        self._cache: TTLCache[str] = TTLCache(max_size, ttl_s)
+        self._max_item_chars = max_item_chars
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._cache
+
+    def stream(
+        self,
+        key: Hashable,
+        make: Callable[[], Iterable[str]],
+    ) -> Iterator[str]:
+        """
+        The chunks of the rendition for `key`, cached or from `make`.
+        `make` is called now, so its errors raise here, not mid-stream.
+        """
+        cached = self._cache.get(key)
+        if cached is not None:
+            return chunked([cached])
+        return self._keep(key, make())
+
+    def _keep(self, key: Hashable, parts: Iterable[str]) -> Iterator[str]:
+        kept: Optional[List[str]] = []
+        size = 0
+        for chunk in chunked(parts):
+            if kept is not None:
+                size += len(chunk)
+                if size > self._max_item_chars:
+                    kept = None
+                else:
+                    kept.append(chunk)
+            yield chunk
+        if kept is not None:
+            self._cache.set(key, "".join(kept))
+
+
+rendition_cache = RenditionCache(
+    max_size=TRANSCRIPT_CACHE_SIZE,
+    ttl_s=TRANSCRIPT_CACHE_TTL_S,
+    max_item_chars=TRANSCRIPT_CACHE_MAX_ITEM_CHARS,
+)
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+
+from typing import Dict, Optional
+
+from lib.config import WORKFLOW_FEED_POLL_S
+from models.user_version import UserVersion
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class WorkflowFeed:
+    """
+    Wake up the clients waiting for changes of their workflows.
+
+    Every change bumps the user version in 'user_version', by triggers, so
+    the workers' writes count too. Instead of one query per waiting client,
+    a single poller task reads the versions of all the waiting users every
+    `poll_interval_s` and wakes the ones whose version moved past what they
+    have seen. Changes made by this process `notify` right away.
+
+    The poller only runs while someone waits.
+    """
+
+    def __init__(self, poll_interval_s: float) -> None:
+        self._poll_interval_s = poll_interval_s
+        # user id -> {event: version seen by the waiter}
+        self._waiters: Dict[int, Dict[asyncio.Event, int]] = {}
+        self._poller: Optional[asyncio.Task] = None
+
+    def notify(self, user_id: int) -> None:
+        for event in self._waiters.get(user_id, {}):
+            event.set()
+
+    async def wait(self, user_id: int, since: int, timeout: float) -> int:
+        """
+        Wait up to `timeout` seconds for the user version to move past
+        `since`, return the current version.
+        """
+        version = UserVersion.get(user_id)
+        if version > since or timeout <= 0:
+            return version
+
+        event = asyncio.Event()
+        self._waiters.setdefault(user_id, {})[event] = since
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(user_id, {})
+            waiters.pop(event, None)
+            if not waiters:
+                self._waiters.pop(user_id, None)
+        return UserVersion.get(user_id)
+
+    async def _poll(self) -> None:
+        while self._waiters:
+            await asyncio.sleep(self._poll_interval_s)
+            try:
+                versions = UserVersion.get_many(list(self._waiters))
+            except Exception as e:
+                logger.error("Failed to poll workflow versions: %s", e)
+                continue
+            for user_id, version in versions.items():
+                for event, since in self._waiters.get(user_id, {}).items():
+                    if version > since:
+                        event.set()
+
+
+workflow_feed = WorkflowFeed(WORKFLOW_FEED_POLL_S)
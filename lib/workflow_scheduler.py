@@ -0,0 +1,208 @@
+import heapq
+import logging
+import time
+
+from collections import Counter
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from lib.config import (
+    SCHEDULER_DEFAULT_WEIGHT,
+    SCHEDULER_USER_WEIGHTS,
+    SCHEDULER_MAX_RUNNING_PER_USER,
+    SCHEDULER_LOAD_BATCH,
+    SCHEDULER_SYNC_S,
+    SCHEDULER_RESYNC_S,
+)
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from models.user import User
+from models.workflow import Workflow, Status
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class WorkflowScheduler:
+    """
+    Hand the TODO workflows to the workers, fairly across users.
+
+    Stride scheduling: each user with queued workflows has a pass, the next
+    workflow goes to the user with the lowest pass who runs less than
+    `max_running_per_user` workflows, whose pass then grows by 1 / weight.
+    A user with twice the weight gets twice the turns, and a user queuing
+    500 videos only gets their share. A user whose queue was empty joins at
+    the current virtual time, so idling earns no credit. Within a user's
+    queue, the workflows with the highest priority go first, then the
+    oldest: priorities order a user's own work, the weights share the
+    workers across users.
+
+    The queues are kept in memory: every `sync_interval_s` only the TODO
+    workflows after the last id seen are loaded, together with the running
+    counts. Workers or users may change the rows meanwhile, so a claim is a
+    compare-and-swap from TODO, and every `resync_interval_s` the queues
+    are rebuilt from the table.
+
+    Credit is checked at admission: the workflows of users without credit
+    go to NO_CREDIT when loaded or picked, before any worker sees them.
+    """
+
+    def __init__(
+        self,
+        default_weight: float,
+        user_weights: Mapping[int, float],
+        max_running_per_user: int,
+        load_batch: int,
+        sync_interval_s: float,
+        resync_interval_s: float,
+    ) -> None:
+        self._default_weight = default_weight
+        self._user_weights = user_weights
+        self._max_running_per_user = max_running_per_user
+        self._load_batch = load_batch
+        self._sync_interval_s = sync_interval_s
+        self._resync_interval_s = resync_interval_s
+        # Heaps of (-priority, id).
+        self._queues: Dict[int, List[Tuple[int, int]]] = {}
+        self._passes: Dict[int, float] = {}
+        self._running: Counter = Counter()
+        self._vtime = 0.0
+        self._last_id = 0
+        # Sync on first use, whatever the monotonic clock origin.
+        self._last_sync = float("-inf")
+        self._last_resync = float("-inf")
+
+    def claim(self, limit: int) -> List[Workflow]:
+        """
+        Move up to `limit` workflows from TODO to CLAIMED, in fair order,
+        and return them.
+        """
+        self._maybe_sync()
+        claimed: List[Workflow] = []
+        credits: Dict[int, int] = {}
+        while len(claimed) < limit:
+            user_id = self._next_user()
+            if user_id is None:
+                break
+            if user_id not in credits:
+                credits[user_id] = self._credit(user_id)
+            if credits[user_id] <= 0:
+                self._reject(
+                    user_id, [id for _, id in self._queues.pop(user_id)]
+                )
+                self._passes.pop(user_id, None)
+                continue
+
+            id = self._pop(user_id)
+            with SQLiteConnectionManager().connect() as connection:
+                moved = Workflow.transition(
+                    connection.cursor(), [id], Status.TODO, Status.CLAIMED
+                )
+                connection.commit()
+            if not moved:
+                # Deleted or taken meanwhile.
+                continue
+            workflow = Workflow.get(id)
+            if workflow:
+                self._running[user_id] += 1
+                claimed.append(workflow)
+        return claimed
+
+    def queued(self) -> Dict[int, int]:
+        """
+        Number of queued workflows by user id.
+        """
+        return {user_id: len(q) for user_id, q in self._queues.items()}
+
+    def _weight(self, user_id: int) -> float:
+        return self._user_weights.get(user_id, self._default_weight)
+
+    def _next_user(self) -> Optional[int]:
+        best = None
+        for user_id in self._queues:
+            if self._running[user_id] >= self._max_running_per_user:
+                continue
+            if best is None or (
+                (self._passes[user_id], user_id)
+                < (self._passes[best], best)
+            ):
+                best = user_id
+        return best
+
+    def _pop(self, user_id: int) -> int:
+        queue = self._queues[user_id]
+        _, id = heapq.heappop(queue)
+        self._vtime = self._passes[user_id]
+        self._passes[user_id] += 1 / self._weight(user_id)
+        if not queue:
+            del self._queues[user_id]
+            del self._passes[user_id]
+        return id
+
+    def _push(self, user_id: int, id: int, priority: int) -> None:
+        if user_id not in self._queues:
+            self._queues[user_id] = []
+            # Kept across a resync, reset when the queue ran empty.
+            self._passes.setdefault(user_id, self._vtime)
+        heapq.heappush(self._queues[user_id], (-priority, id))
+
+    def _credit(self, user_id: int) -> int:
+        try:
+            return User.get_by_id(user_id).credit
+        except Exception as e:
+            logger.error("Failed to get credit of user: %s: %s", user_id, e)
+            return 0
+
+    def _reject(self, user_id: int, ids: List[int]) -> None:
+        if not ids:
+            return
+        with SQLiteConnectionManager().connect() as connection:
+            moved = Workflow.transition(
+                connection.cursor(), ids, Status.TODO, Status.NO_CREDIT
+            )
+            connection.commit()
+        logger.info(
+            "%s workflows of user: %s set to NO_CREDIT.",
+            len(moved), user_id,
+        )
+
+    def _maybe_sync(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sync < self._sync_interval_s:
+            return
+        self._last_sync = now
+        try:
+            if now - self._last_resync >= self._resync_interval_s:
+                self._last_resync = now
+                self._queues = {}
+                self._last_id = 0
+            self._load()
+            self._running = Counter(Workflow.count_running())
+        except Exception as e:
+            logger.error("Failed to sync the workflow scheduler: %s", e)
+
+    def _load(self) -> None:
+        while True:
+            rows = Workflow.list_todo(self._last_id, self._load_batch)
+            no_credit: Dict[int, List[int]] = {}
+            for id, user_id, credit, priority in rows:
+                if credit is None or credit <= 0:
+                    no_credit.setdefault(user_id, []).append(id)
+                else:
+                    self._push(user_id, id, priority)
+                self._last_id = id
+            for user_id, ids in no_credit.items():
+                self._reject(user_id, ids)
+            if len(rows) < self._load_batch:
+                break
+        # Passes of the users dropped by a resync.
+        for user_id in set(self._passes) - set(self._queues):
+            del self._passes[user_id]
+
+
+workflow_scheduler = WorkflowScheduler(
+    default_weight=SCHEDULER_DEFAULT_WEIGHT,
+    user_weights=SCHEDULER_USER_WEIGHTS,
+    max_running_per_user=SCHEDULER_MAX_RUNNING_PER_USER,
+    load_batch=SCHEDULER_LOAD_BATCH,
+    sync_interval_s=SCHEDULER_SYNC_S,
+    resync_interval_s=SCHEDULER_RESYNC_S,
+)
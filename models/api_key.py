@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import secrets
+import time
+
+from enum import Enum
+from pydantic import BaseModel
+from typing import Any, List, Mapping, Optional, Set, Tuple
+
+from lib.exception import UserUpdateException
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from lib.tracing import traced_methods, untraced
+
+
+logger = logging.getLogger("uvicorn.error")
+
+KEY_PREFIX = "pk_"
+PREFIX_LEN = 10
+
+
+def now() -> int:
+    return int(time.time())
+
+
+def hash_key(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class Scope(Enum):
+    WORKFLOW = "workflow"
+    OPENAI = "openai"
+    # Workers claiming workflows, only honored for the admin users' keys.
+    WORKER = "worker"
+
+
+@traced_methods
+class ApiKey(BaseModel):
+    """
+    An API key in the sql table 'api_key'.
+    Sql table like:
+    CREATE TABLE api_key (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT,
+        prefix TEXT NOT NULL,
+        key_hash TEXT NOT NULL UNIQUE,
+        scopes TEXT NOT NULL,
+        rate_limit INTEGER NOT NULL,
+        create_at INTEGER NOT NULL,
+        revoked INTEGER NOT NULL DEFAULT 0
+    )
+
+    The key itself is only returned once by `new`, the table keeps its
+    sha256. Keys are random 256 bits, so a fast hash is enough.
+    'rate_limit' is in requests per minute.
+    """
+    id: int
+    user_id: int
+    name: Optional[str]
+    prefix: str
+    key_hash: str
+    scopes: Set[Scope]
+    rate_limit: int
+    create_at: int
+    revoked: bool = False
+
+    @classmethod
+    @untraced
+    def from_values(cls, values: Tuple[Any]) -> "ApiKey":
+        return ApiKey(
+            id=values[0],
+            user_id=values[1],
+            name=values[2],
+            prefix=values[3],
+            key_hash=values[4],
+            scopes={Scope(s) for s in json.loads(values[5])},
+            rate_limit=values[6],
+            create_at=values[7],
+            revoked=bool(values[8]),
+        )
+
+    @classmethod
+    def new(
+        cls,
+        user_id: int,
+        name: Optional[str],
+        scopes: Set[Scope],
+        rate_limit: int,
+    ) -> Tuple["ApiKey", str]:
+        """
+        Create a key and return it with the plain key to hand out.
+        """
+        key = KEY_PREFIX + secrets.token_urlsafe(32)
+        api_key = ApiKey(
+            id=-1,
+            user_id=user_id,
+            name=name,
+            prefix=key[:PREFIX_LEN],
+            key_hash=hash_key(key),
+            scopes=scopes,
+            rate_limit=rate_limit,
+            create_at=now(),
+        )
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    """
+                    INSERT INTO
+                        api_key (
+                            user_id, name, prefix, key_hash,
+                            scopes, rate_limit, create_at
+                        )
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        user_id, name, api_key.prefix, api_key.key_hash,
+                        json.dumps(sorted(s.value for s in scopes)),
+                        rate_limit, api_key.create_at,
+                    )
+                )
+                api_key.id = cursor.lastrowid
+                connection.commit()
+        except Exception as e:
+            logger.error(
+                "Failed to create api key for user: %s due to error: %s",
+                user_id, e,
+            )
+            raise UserUpdateException("Failed to create api key.") from e
+        return api_key, key
+
+    @classmethod
+    def list(cls, user_id: int) -> List["ApiKey"]:
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                    SELECT
+                        id, user_id, name, prefix, key_hash,
+                        scopes, rate_limit, create_at, revoked
+                    FROM api_key
+                    WHERE user_id = ? AND revoked = 0
+                """,
+                (user_id,)
+            )
+            return [cls.from_values(r) for r in cursor.fetchall()]
+
+    @classmethod
+    def list_active(cls) -> List["ApiKey"]:
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                    SELECT
+                        id, user_id, name, prefix, key_hash,
+                        scopes, rate_limit, create_at, revoked
+                    FROM api_key
+                    WHERE revoked = 0
+                """
+            )
+            return [cls.from_values(r) for r in cursor.fetchall()]
+
+    @classmethod
+    def revoke(cls, id: int, user_id: int) -> Optional[str]:
+        """
+        Revoke the key and return its hash, None if the user has no such key.
+        """
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    "SELECT key_hash FROM api_key "
+                    "WHERE id = ? AND user_id = ? AND revoked = 0",
+                    (id, user_id)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                cursor.execute(
+                    "UPDATE api_key SET revoked = 1 WHERE id = ?",
+                    (id,)
+                )
+                connection.commit()
+        except Exception as e:
+            logger.error(
+                "Failed to revoke api key: %s of user: %s due to error: %s",
+                id, user_id, e,
+            )
+            raise UserUpdateException("Failed to revoke api key.") from e
+        return row[0]
+
+    @untraced
+    def simple_json(self) -> Mapping[str, Any]:
+        """
+        Drop the hash and make it safe for the frondend.
+        """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "prefix": self.prefix,
+            "scopes": sorted(s.value for s in self.scopes),
+            "rate_limit": self.rate_limit,
+            "create_at": self.create_at,
+        }
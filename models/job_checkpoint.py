@@ -0,0 +1,49 @@
+import logging
+import time
+
+from typing import Any, Optional
+
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class JobCheckpoint:
+    """
+    Progress of a resumable job in the sql table 'job_checkpoint'.
+    Sql table like:
+    CREATE TABLE job_checkpoint (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        update_at INTEGER NOT NULL
+    )
+    """
+
+    @classmethod
+    def get(cls, name: str) -> Optional[str]:
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT value FROM job_checkpoint WHERE name = ?",
+                (name,)
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def set(cls, cursor: Any, name: str, value: str) -> None:
+        """
+        Save the checkpoint within the caller's transaction, so it moves
+        together with the work it covers.
+        """
+        cursor.execute(
+            """
+            INSERT INTO job_checkpoint (name, value, update_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                value = excluded.value,
+                update_at = excluded.update_at
+            """,
+            (name, value, int(time.time()))
+        )
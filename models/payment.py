@@ -2,13 +2,15 @@ import time
 import logging
 import json
 
-from typing import Optional
+from typing import Any, List, Mapping, Optional, Tuple
 from enum import Enum
 from pydantic import BaseModel
 
 from lib.sqlite_connection_manager import SQLiteConnectionManager
+from lib.tracing import traced_methods, untraced
 from lib.exception import PaymentException
-from lib.config import EMAIL
+from lib.config import EMAIL, PAYMENT_CACHE_SIZE, PAYMENT_CACHE_TTL_S
+from lib.ttl_cache import TTLCache
 
 
 logger = logging.getLogger("uvicorn.error")
@@ -21,12 +23,62 @@ class Status(Enum):
     FAILED = 4
 
 
+def now() -> int:
+    return int(time.time())
+
+
+# payment id -> Payment. Written through by every Payment update of this
+# process; `Payment.settle` only invalidates, as its caller may roll back.
+payment_cache: TTLCache["Payment"] = TTLCache(
+    PAYMENT_CACHE_SIZE, PAYMENT_CACHE_TTL_S
+)
+
+
+@traced_methods
 class Payment(BaseModel):
+    """
+    A payment in the sql table 'payment'.
+    Sql table like:
+    CREATE TABLE payment (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        create_at INTEGER,
+        quantity INTEGER,
+        status INTEGER,
+        session_id TEXT,
+        session_url TEXT,
+        session_expire_at INTEGER
+    )
+
+    'session_*' describe the Stripe checkout session of the payment.
+    Payments are listed per user with the index:
+    CREATE INDEX payment_user_create_at ON payment (user_id, create_at)
+    """
     id: int
     user_id: int
     create_at: int
     quantity: int
     status: Status
+    session_id: Optional[str] = None
+    session_url: Optional[str] = None
+    session_expire_at: Optional[int] = None
+
+    def _cache(self) -> None:
+        payment_cache.set(self.id, self.model_copy())
+
+    @classmethod
+    @untraced
+    def from_values(cls, values: Tuple[Any]) -> "Payment":
+        return Payment(
+            id=values[0],
+            user_id=values[1],
+            create_at=values[2],
+            quantity=values[3],
+            status=Status(values[4]),
+            session_id=values[5],
+            session_url=values[6],
+            session_expire_at=values[7],
+        )
 
     @classmethod
     def create(cls, user_id: int, quantity: int) -> "Payment":
@@ -57,15 +109,22 @@ class Payment(BaseModel):
                 connection.commit()
         except Exception as e:
             logger.error(
-                f"Failed to create Payment record in DB with error: {e}")
+                "Failed to create Payment record in DB with error: %s",
+                e,
+            )
             raise PaymentException(
                 "Failed to create payment. Please try again. "
                 f"If you have further questions, please reach out to {EMAIL}"
             ) from e
+        payment._cache()
         return payment
 
     @classmethod
     def get(cls, id: int) -> Optional["Payment"]:
+        cached = payment_cache.get(id)
+        if cached:
+            return cached.model_copy()
+
         sqlite = SQLiteConnectionManager()
         row = None
         try:
@@ -74,7 +133,8 @@ class Payment(BaseModel):
                 cursor.execute(
                     """
                         SELECT
-                            id, user_id, create_at, quantity, status
+                            id, user_id, create_at, quantity, status,
+                            session_id, session_url, session_expire_at
                         FROM
                             payment
                         WHERE
@@ -85,23 +145,181 @@ class Payment(BaseModel):
                 row = cursor.fetchone()
         except Exception as e:
             logger.error(
-                f"Failed got gets payment {id} "
-                f"from database due to error: {e}"
+                "Failed got gets payment %s from database due to error: %s",
+                id, e,
             )
             raise PaymentException(
                 "Failed to retrive payment status. Please try again. "
                 f"If you have further questions, please reach out to {EMAIL}"
             ) from e
         if row:
-            return Payment(
-                id=row[0],
-                user_id=row[1],
-                create_at=row[2],
-                quantity=row[3],
-                status=Status(row[4]),
+            payment = cls.from_values(row)
+            payment._cache()
+            return payment
+        return None
+
+    @classmethod
+    def list_by_user(
+        cls,
+        user_id: int,
+        limit: int,
+        before: Optional[Tuple[int, int]] = None,
+    ) -> List["Payment"]:
+        """
+        Return the user's payments, newest first. Keyset pagination:
+        `before` is the (create_at, id) of the last payment of the previous
+        page, so every page is one range scan of 'payment_user_create_at'.
+        """
+        sql = """
+            SELECT
+                id, user_id, create_at, quantity, status,
+                session_id, session_url, session_expire_at
+            FROM
+                payment
+            WHERE
+                user_id = ?
+                {}
+            ORDER BY create_at DESC, id DESC
+            LIMIT ?
+        """
+        values: Tuple[Any, ...] = (user_id,)
+        if before:
+            sql = sql.format(
+                "AND (create_at < ? OR (create_at = ? AND id < ?))"
+            )
+            values += (before[0], before[0], before[1])
+        else:
+            sql = sql.format("")
+        values += (limit,)
+
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(sql, values)
+                rows = cursor.fetchall()
+        except Exception as e:
+            logger.error(
+                "Failed to list payments of user: %s due to error: %s",
+                user_id, e,
+            )
+            raise PaymentException(
+                "Failed to retrive payment history. Please try again. "
+                f"If you have further questions, please reach out to {EMAIL}"
+            ) from e
+        return [cls.from_values(r) for r in rows]
+
+    @classmethod
+    def list_pending(
+        cls,
+        after_id: int,
+        create_before: int,
+        limit: int,
+    ) -> List["Payment"]:
+        """
+        Return up to `limit` PENDING payments created before `create_before`
+        with an id greater than `after_id`, by id.
+        """
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                    SELECT
+                        id, user_id, create_at, quantity, status,
+                        session_id, session_url, session_expire_at
+                    FROM
+                        payment
+                    WHERE
+                        status = ?
+                        AND id > ?
+                        AND create_at < ?
+                    ORDER BY id
+                    LIMIT ?
+                """,
+                (Status.PENDING.value, after_id, create_before, limit)
+            )
+            return [cls.from_values(r) for r in cursor.fetchall()]
+
+    @classmethod
+    def find_open(
+        cls,
+        user_id: int,
+        quantity: int,
+        min_ttl_s: int,
+    ) -> Optional["Payment"]:
+        """
+        Return the latest pending payment of the user for `quantity` whose
+        checkout session is still open for at least `min_ttl_s`.
+        """
+        row = None
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    """
+                        SELECT
+                            id, user_id, create_at, quantity, status,
+                            session_id, session_url, session_expire_at
+                        FROM
+                            payment
+                        WHERE
+                            user_id = ?
+                            AND status = ?
+                            AND quantity = ?
+                            AND session_expire_at > ?
+                        ORDER BY create_at DESC
+                        LIMIT 1
+                    """,
+                    (
+                        user_id, Status.PENDING.value,
+                        quantity, now() + min_ttl_s,
+                    )
+                )
+                row = cursor.fetchone()
+        except Exception as e:
+            logger.error(
+                "Failed to find open payment of user: %s due to error: %s",
+                user_id, e,
             )
+            return None
+        if row:
+            return cls.from_values(row)
         return None
 
+    def set_checkout_session(
+        self,
+        session_id: str,
+        session_url: str,
+        session_expire_at: int,
+    ) -> None:
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    """
+                    UPDATE
+                        payment
+                    SET
+                        session_id = ?,
+                        session_url = ?,
+                        session_expire_at = ?
+                    WHERE
+                        id = ?
+                    """,
+                    (session_id, session_url, session_expire_at, self.id)
+                )
+                connection.commit()
+        except Exception as e:
+            logger.error(
+                "Failed to save checkout session "
+                "of payment: %s due to error: %s",
+                self.id, e,
+            )
+            return
+        self.session_id = session_id
+        self.session_url = session_url
+        self.session_expire_at = session_expire_at
+        self._cache()
+
     def set_status(self, status: Status):
         sqlite = SQLiteConnectionManager()
         try:
@@ -121,21 +339,91 @@ class Payment(BaseModel):
                 connection.commit()
         except Exception as e:
             logger.error(
-                f"Failed to mark payment id: {self.id} "
-                f"in DB as status: {status} with error: {e}"
+                "Failed to mark payment id: %s in "
+                "DB as status: %s with error: %s",
+                self.id, status, e,
             )
             raise PaymentException(
                 "Failed to comfirm payment status. Please try again. "
                 f"If you have further questions, please reach out to {EMAIL}"
             ) from e
         self.status = status
+        self._cache()
 
-    def simple_json(self) -> str:
+    @classmethod
+    def settle(cls, cursor: Any, id: int, status: Status) -> bool:
+        """
+        Move PENDING payment `id` to the final `status` within the caller's
+        transaction, and credit the user on SUCCESS. Idempotent: return
+        False and change nothing if the payment was already settled, so a
+        payment is never credited twice nor moved out of a final status.
+        """
+        cursor.execute(
+            "UPDATE payment SET status = ? WHERE id = ? AND status = ?",
+            (status.value, id, Status.PENDING.value)
+        )
+        if cursor.rowcount != 1:
+            return False
+        payment_cache.delete(id)
+        if status == Status.SUCCESS:
+            cursor.execute(
+                """
+                UPDATE
+                    users
+                SET
+                    credit = credit + (
+                        SELECT quantity FROM payment WHERE id = ?
+                    )
+                WHERE
+                    id = (SELECT user_id FROM payment WHERE id = ?)
+                """,
+                (id, id)
+            )
+        return True
+
+    @classmethod
+    def id_by_session(cls, cursor: Any, session_id: str) -> Optional[int]:
+        cursor.execute(
+            "SELECT id FROM payment WHERE session_id = ?",
+            (session_id,)
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def settle_status(self, status: Status) -> bool:
+        """
+        `settle` this payment in its own transaction.
+        """
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                settled = Payment.settle(cursor, self.id, status)
+                connection.commit()
+        except Exception as e:
+            logger.error(
+                "Failed to settle payment id: %s as status: %s with error: %s",
+                self.id, status, e,
+            )
+            raise PaymentException(
+                "Failed to comfirm payment status. Please try again. "
+                f"If you have further questions, please reach out to {EMAIL}"
+            ) from e
+        if settled:
+            self.status = status
+            self._cache()
+        return settled
+
+    @untraced
+    def simple_dict(self) -> Mapping[str, Any]:
         """
         Drop some fields and make it safe for the frondend.
         """
-        return json.dumps({
+        return {
             "create_at": self.create_at,
             "quantity": self.quantity,
             "status": self.status.name,
-        })
+        }
+
+    @untraced
+    def simple_json(self) -> str:
+        return json.dumps(self.simple_dict())
@@ -14,6 +14,7 @@ class Format(Enum):
     JSON = "json"
     TEXT = "text"
     SRT = "srt"
+    VTT = "vtt"
 
 
 class Resource:
@@ -69,7 +70,7 @@ class Resource:
                     (type, cost, paid, raw, create_at, pay_at)
                 )
                 id = cursor.lastrowid
-                logger.debug(f"New resource id: {id}")
+                logger.debug("New resource id: %s", id)
                 connection.commit()
         except Exception as e:
             raise ResourceNotFoundException(f"Failed to write resource into sqlite3 with error:\n {e}") from e
@@ -92,7 +93,11 @@ class Resource:
                 )
                 row = cursor.fetchone()
         except Exception as e:
-            logger.error(f"Failed to get user with id: {id} from sqlite3 with due to error:\n {e}")
+            logger.error(
+                "Failed to get user with id: %s from "
+                "sqlite3 with due to error:\n %s",
+                id, e,
+            )
 
         if row:
             _id, _type, _cost, _paid, _create_at, _pay_at, _raw = row
@@ -0,0 +1,105 @@
+import logging
+import time
+
+from pydantic import BaseModel
+from typing import List, Tuple
+
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from lib.tracing import traced_methods
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def now() -> int:
+    return int(time.time())
+
+
+@traced_methods
+class RevokedToken(BaseModel):
+    """
+    A revoked JWT in the sql table 'token_revocation'.
+    Sql table like:
+    CREATE TABLE token_revocation (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        jti TEXT NOT NULL UNIQUE,
+        user_id INTEGER NOT NULL,
+        expire_at INTEGER NOT NULL
+    )
+
+    This table is the authoritative revocation store,
+    `lib.token_revocation.RevocationList` is the in-memory front of it.
+    """
+    jti: str
+    user_id: int
+    expire_at: int
+
+    def save(self) -> None:
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    """
+                    INSERT OR IGNORE INTO
+                        token_revocation (jti, user_id, expire_at)
+                    VALUES (?, ?, ?)
+                    """,
+                    (self.jti, self.user_id, self.expire_at)
+                )
+                connection.commit()
+        except Exception as e:
+            raise Exception(
+                f"Failed to revoke token: {self.jti} of user: "
+                f"{self.user_id} due to error:\n {e}"
+            ) from e
+
+    @classmethod
+    def exists(cls, jti: str) -> bool:
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    """
+                        SELECT 1
+                        FROM token_revocation
+                        WHERE jti = ? AND expire_at > ?
+                    """,
+                    (jti, now())
+                )
+                return cursor.fetchone() is not None
+        except Exception as e:
+            logger.error(
+                "Failed to check revocation of token: %s due to error: %s",
+                jti, e,
+            )
+            # Fail closed, a revoked token must not pass.
+            return True
+
+    @classmethod
+    def list_since(cls, last_id: int) -> List[Tuple[int, str]]:
+        """
+        Return (id, jti) of the unexpired revocations after `last_id`.
+        """
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                    SELECT id, jti
+                    FROM token_revocation
+                    WHERE id > ? AND expire_at > ?
+                    ORDER BY id
+                """,
+                (last_id, now())
+            )
+            return cursor.fetchall()
+
+    @classmethod
+    def purge_expired(cls) -> int:
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "DELETE FROM token_revocation WHERE expire_at <= ?",
+                (now(),)
+            )
+            connection.commit()
+            return cursor.rowcount
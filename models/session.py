@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import secrets
+import time
+
+from pydantic import BaseModel
+from typing import Optional, Tuple
+
+from lib.config import REFRESH_SESSION_IDLE_S, REFRESH_SESSION_MAX_AGE_S
+from lib.exception import UserAuthorizationException
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from lib.tracing import traced_methods, untraced
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def now() -> int:
+    return int(time.time())
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+@traced_methods
+class RefreshSession(BaseModel):
+    """
+    A server side refresh record in the sql table 'refresh_session'.
+    Sql table like:
+    CREATE TABLE refresh_session (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        create_at INTEGER NOT NULL,
+        expire_at INTEGER NOT NULL,
+        revoked INTEGER NOT NULL DEFAULT 0
+    )
+
+    'id' is the sha256 of the refresh token, the token itself only lives in
+    the user's cookie. The session slides: every refresh pushes 'expire_at'
+    `REFRESH_SESSION_IDLE_S` ahead, capped at `REFRESH_SESSION_MAX_AGE_S`
+    after 'create_at'.
+    """
+    id: str
+    user_id: int
+    create_at: int
+    expire_at: int
+    revoked: bool = False
+
+    @untraced
+    def is_valid(self) -> bool:
+        return not self.revoked and self.expire_at > now()
+
+    def _next_expire_at(self) -> int:
+        return min(
+            now() + REFRESH_SESSION_IDLE_S,
+            self.create_at + REFRESH_SESSION_MAX_AGE_S,
+        )
+
+    @classmethod
+    def new(cls, user_id: int) -> Tuple["RefreshSession", str]:
+        """
+        Create a session and return it with the refresh token to hand out.
+        """
+        token = secrets.token_urlsafe(32)
+        create_at = now()
+        session = RefreshSession(
+            id=hash_token(token),
+            user_id=user_id,
+            create_at=create_at,
+            expire_at=create_at,
+        )
+        session.expire_at = session._next_expire_at()
+
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    """
+                    INSERT INTO
+                        refresh_session (id, user_id, create_at, expire_at)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (
+                        session.id, session.user_id,
+                        session.create_at, session.expire_at,
+                    )
+                )
+                connection.commit()
+        except Exception as e:
+            logger.error(
+                "Failed to create refresh session "
+                "for user: %s due to error: %s",
+                user_id, e,
+            )
+            raise UserAuthorizationException() from e
+        return session, token
+
+    @classmethod
+    def get(cls, token: str) -> Optional["RefreshSession"]:
+        row = None
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    """
+                        SELECT
+                            id, user_id, create_at, expire_at, revoked
+                        FROM
+                            refresh_session
+                        WHERE
+                            id = ?
+                    """,
+                    (hash_token(token),)
+                )
+                row = cursor.fetchone()
+        except Exception as e:
+            logger.error("Failed to get refresh session due to error: %s", e)
+            return None
+        if row:
+            return RefreshSession(
+                id=row[0],
+                user_id=row[1],
+                create_at=row[2],
+                expire_at=row[3],
+                revoked=bool(row[4]),
+            )
+        return None
+
+    def touch(self) -> None:
+        """
+        Slide the session expiration forward.
+        """
+        expire_at = self._next_expire_at()
+        if expire_at == self.expire_at:
+            return
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    "UPDATE refresh_session SET expire_at = ? WHERE id = ?",
+                    (expire_at, self.id)
+                )
+                connection.commit()
+        except Exception as e:
+            logger.error(
+                "Failed to extend refresh session "
+                "of user: %s due to error: %s",
+                self.user_id, e,
+            )
+            return
+        self.expire_at = expire_at
+
+    def revoke(self) -> None:
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    "UPDATE refresh_session SET revoked = 1 WHERE id = ?",
+                    (self.id,)
+                )
+                connection.commit()
+        except Exception as e:
+            logger.error(
+                "Failed to revoke refresh session "
+                "of user: %s due to error: %s",
+                self.user_id, e,
+            )
+            return
+        self.revoked = True
+
+    @classmethod
+    def revoke_all(cls, user_id: int) -> None:
+        try:
+            with SQLiteConnectionManager().connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    """
+                    UPDATE refresh_session
+                    SET revoked = 1
+                    WHERE user_id = ? AND revoked = 0
+                    """,
+                    (user_id,)
+                )
+                connection.commit()
+        except Exception as e:
+            logger.error(
+                "Failed to revoke refresh sessions "
+                "of user: %s due to error: %s",
+                user_id, e,
+            )
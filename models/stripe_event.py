@@ -0,0 +1,128 @@
+import logging
+import time
+
+from enum import Enum
+from pydantic import BaseModel
+from typing import Any, Iterable, List, Tuple
+
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from lib.tracing import traced_methods, untraced
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def now() -> int:
+    return int(time.time())
+
+
+class Status(Enum):
+    PENDING = 1
+    DONE = 2
+    FAILED = 3
+    IGNORED = 4
+
+
+@traced_methods
+class StripeEvent(BaseModel):
+    """
+    A Stripe webhook event in the sql table 'stripe_event'.
+    Sql table like:
+    CREATE TABLE stripe_event (
+        id TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        create_at INTEGER NOT NULL,
+        status INTEGER NOT NULL DEFAULT 1,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        processed_at INTEGER
+    )
+
+    'id' is the Stripe event id, Stripe retries deliveries so the same
+    event is only stored, and processed, once.
+    'payload' is the raw json body as signed by Stripe.
+    """
+    id: str
+    type: str
+    payload: str
+    create_at: int
+    status: Status = Status.PENDING
+    attempts: int = 0
+
+    @classmethod
+    @untraced
+    def from_values(cls, values: Tuple[Any]) -> "StripeEvent":
+        return StripeEvent(
+            id=values[0],
+            type=values[1],
+            payload=values[2],
+            create_at=values[3],
+            status=Status(values[4]),
+            attempts=values[5],
+        )
+
+    def save_if_new(self) -> bool:
+        """
+        Insert the event, return False if it was already received.
+        """
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO
+                    stripe_event (id, type, payload, create_at, status)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    self.id, self.type, self.payload,
+                    self.create_at, self.status.value,
+                )
+            )
+            connection.commit()
+            return cursor.rowcount == 1
+
+    @classmethod
+    def list_pending(
+        cls,
+        max_attempts: int,
+        limit: int,
+    ) -> List["StripeEvent"]:
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                    SELECT
+                        id, type, payload, create_at, status, attempts
+                    FROM stripe_event
+                    WHERE status = ? AND attempts < ?
+                    ORDER BY create_at
+                    LIMIT ?
+                """,
+                (Status.PENDING.value, max_attempts, limit)
+            )
+            return [cls.from_values(r) for r in cursor.fetchall()]
+
+    @classmethod
+    def mark_many(
+        cls,
+        cursor: Any,
+        results: Iterable[Tuple[str, Status]],
+    ) -> None:
+        """
+        Record processing results within the caller's transaction.
+        Events left PENDING are retried until `max_attempts`.
+        """
+        processed_at = now()
+        cursor.executemany(
+            """
+            UPDATE
+                stripe_event
+            SET
+                status = ?,
+                attempts = attempts + 1,
+                processed_at = ?
+            WHERE
+                id = ?
+            """,
+            [(status.value, processed_at, id) for id, status in results]
+        )
@@ -0,0 +1,219 @@
+import asyncio
+import unittest
+
+from fastapi.testclient import TestClient
+from unittest import mock
+
+from app import app
+from lib.stripe_client import stripe_client
+from lib.stripe_stub import StripeStub
+from lib.tests.db import use_memory_db
+from lib.token_util import AccessToken
+from models.payment import Payment, Status, payment_cache
+
+
+class PaymentCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        payment_cache.clear()
+
+    def stored_status(self, id: int) -> int:
+        return self.db.execute(
+            "SELECT status FROM payment WHERE id = ?", (id,)
+        ).fetchone()[0]
+
+    def test_write_through(self) -> None:
+        payment = Payment.create(user_id=1, quantity=10)
+        self.assertEqual(payment_cache.get(payment.id), payment)
+
+        payment.set_checkout_session("cs_1", "https://stripe/cs_1", 100)
+        payment.set_status(Status.CANCELED)
+        self.assertEqual(self.stored_status(payment.id), Status.CANCELED.value)
+        # Served from the cache, same as the DB.
+        self.db.execute("DELETE FROM payment")
+        cached = Payment.get(payment.id)
+        self.assertEqual(cached.status, Status.CANCELED)
+        self.assertEqual(cached.session_id, "cs_1")
+
+    def test_copies(self) -> None:
+        payment = Payment.create(user_id=1, quantity=10)
+        got = Payment.get(payment.id)
+        got.status = Status.FAILED
+        self.assertEqual(Payment.get(payment.id).status, Status.PENDING)
+
+    def test_settle_invalidates(self) -> None:
+        payment = Payment.create(user_id=1, quantity=10)
+        cursor = self.db.cursor()
+        self.assertTrue(Payment.settle(cursor, payment.id, Status.SUCCESS))
+        self.db.commit()
+        self.assertIsNone(payment_cache.get(payment.id))
+        self.assertEqual(Payment.get(payment.id).status, Status.SUCCESS)
+
+    def test_settle_keeps_final_status(self) -> None:
+        payment = Payment.create(user_id=1, quantity=10)
+        cursor = self.db.cursor()
+        self.assertTrue(Payment.settle(cursor, payment.id, Status.CANCELED))
+        self.assertFalse(Payment.settle(cursor, payment.id, Status.SUCCESS))
+        self.assertFalse(Payment.settle(cursor, payment.id, Status.FAILED))
+        self.db.commit()
+        self.assertEqual(self.stored_status(payment.id), Status.CANCELED.value)
+
+    def test_read_through(self) -> None:
+        self.db.execute(
+            "INSERT INTO payment (id, user_id, create_at, quantity, status) "
+            "VALUES (7, 1, 0, 5, ?)",
+            (Status.PENDING.value,)
+        )
+        self.assertIsNone(payment_cache.get(7))
+        self.assertEqual(Payment.get(7).quantity, 5)
+        self.assertIsNotNone(payment_cache.get(7))
+        self.assertIsNone(Payment.get(8))
+
+
+class PaymentRouterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        payment_cache.clear()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 0), (2, 'd@e.f', 0, 0)"
+        )
+        # Two payments per second, so pages split equal create_at.
+        for i, user_id in enumerate([1, 1, 2, 1, 1, 1]):
+            self.db.execute(
+                "INSERT INTO payment "
+                "(user_id, create_at, quantity, status) "
+                "VALUES (?, ?, ?, 1)",
+                (user_id, 100 + i // 2, i)
+            )
+        self.db.commit()
+        self.client = TestClient(app)
+        token = asyncio.run(AccessToken(1).encode())
+        self.client.cookies.set("Authorization", f'"Bearer {token}"')
+
+    def test_history_pages(self) -> None:
+        quantities = []
+        cursor = None
+        pages = 0
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            rsp = self.client.get("/payment/history", params=params)
+            self.assertEqual(rsp.status_code, 200)
+            quantities += [p["quantity"] for p in rsp.json()["payments"]]
+            cursor = rsp.json()["next_cursor"]
+            pages += 1
+            if not cursor:
+                break
+        # Newest first, no payment of the other user, none twice.
+        self.assertEqual(quantities, [5, 4, 3, 1, 0])
+        self.assertEqual(pages, 3)
+
+    def test_history_invalid(self) -> None:
+        for params in ({"cursor": "nope"}, {"limit": 0}, {"limit": 10**6}):
+            rsp = self.client.get("/payment/history", params=params)
+            self.assertIn(rsp.status_code, (400, 422))
+
+    def test_succes_unknown_payment(self) -> None:
+        rsp = self.client.get(
+            "/payment/stripe/succes",
+            params={"id": 404},
+            follow_redirects=False,
+        )
+        self.assertEqual(rsp.status_code, 307)
+        self.assertIn("/payment/stripe/fail?id=404", rsp.headers["location"])
+
+
+class PaymentRedirectTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        payment_cache.clear()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 0), (2, 'd@e.f', 0, 0)"
+        )
+        self.db.commit()
+        self.stripe = StripeStub()
+        for name in (
+            "retrieve_checkout_session", "expire_checkout_session"
+        ):
+            patcher = mock.patch.object(
+                stripe_client, name, getattr(self.stripe, name)
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = TestClient(app)
+        token = asyncio.run(AccessToken(1).encode())
+        self.client.cookies.set("Authorization", f'"Bearer {token}"')
+
+    def add_payment(self, session_id: str, user_id: int = 1) -> int:
+        payment = Payment.create(user_id=user_id, quantity=10)
+        payment.set_checkout_session(session_id, "https://stripe", 0)
+        return payment.id
+
+    def get(self, path: str, **params) -> None:
+        rsp = self.client.get(
+            f"/payment/stripe/{path}", params=params, follow_redirects=False
+        )
+        self.assertEqual(rsp.status_code, 307)
+
+    def state(self, id: int) -> tuple:
+        return self.db.execute(
+            "SELECT p.status, u.credit FROM payment p "
+            "JOIN users u ON u.id = p.user_id WHERE p.id = ?",
+            (id,)
+        ).fetchone()
+
+    def test_succes_paid(self) -> None:
+        id = self.add_payment(self.stripe.add_session("complete", "paid"))
+        self.get("succes", id=id)
+        self.get("succes", id=id)
+        self.assertEqual(self.state(id), (Status.SUCCESS.value, 10))
+
+    def test_succes_not_paid(self) -> None:
+        open_id = self.add_payment(self.stripe.add_session("open"))
+        self.get("succes", id=open_id)
+        self.assertEqual(self.state(open_id), (Status.PENDING.value, 0))
+
+        # Paid after it expired: left to the webhook, no credit.
+        canceled_id = self.add_payment(
+            self.stripe.add_session("complete", "paid")
+        )
+        Payment.get(canceled_id).set_status(Status.CANCELED)
+        self.get("succes", id=canceled_id)
+        self.assertEqual(self.state(canceled_id), (Status.CANCELED.value, 0))
+
+    def test_fail(self) -> None:
+        session_id = self.stripe.add_session("open")
+        id = self.add_payment(session_id)
+        self.get("fail", id=id, status=Status.CANCELED.value)
+        self.assertEqual(self.state(id), (Status.CANCELED.value, 0))
+        self.assertEqual(self.stripe.sessions[session_id]["status"], "expired")
+
+    def test_fail_keeps_paid_and_others_payments(self) -> None:
+        paid_id = self.add_payment(
+            self.stripe.add_session("complete", "paid")
+        )
+        self.get("fail", id=paid_id, status=Status.CANCELED.value)
+        self.assertEqual(self.state(paid_id)[0], Status.PENDING.value)
+
+        other_id = self.add_payment(self.stripe.add_session("open"), 2)
+        self.get("fail", id=other_id, status=Status.CANCELED.value)
+        self.assertEqual(self.state(other_id)[0], Status.PENDING.value)
+
+    def test_fail_invalid(self) -> None:
+        self.get("fail", id=404, status=Status.FAILED.value)
+        rsp = self.client.get(
+            "/payment/stripe/fail",
+            params={"id": 404, "status": Status.SUCCESS.value},
+        )
+        self.assertEqual(rsp.status_code, 400)
+
+
+# python3 -m models.tests.payment
+if __name__ == '__main__':
+    unittest.main()
@@ -3,23 +3,339 @@ import sys
 # fmt: off
 sys.path.append('/Users/jiayangsun/Documents/github/cap/proxy')
 
-from models.workflow import WorkflowMetadata, WorkflowType
-from unittest.mock import ANY
+import asyncio
+import json
 
-TEST_USER_ID = 0
+from fastapi.testclient import TestClient
 
+from app import app
+from lib.sqlite_connection_manager import MAX_SQL_VARIABLES
+from lib.tests.db import use_memory_db
+from lib.token_util import AccessToken
+from models.transcript import Transcript
+from models.user import User
+from models.workflow import (
+    Args,
+    SearchHit,
+    Status,
+    Workflow,
+    WorkflowSummary,
+    WorkflowType,
+)
 
-class WorkflowMetadataTest(unittest.TestCase):
+
+def args(video_uuid: str) -> dict:
+    return {
+        "video_uuid": video_uuid,
+        "auto_upload": False,
+        "language": "en",
+        "transcript_fmts": ["srt"],
+        "promotes": None,
+    }
+
+
+class ArgsTest(unittest.TestCase):
+
+    def test_fingerprint_normalized(self) -> None:
+        args = Args(
+            video_uuid="3g5KGYyneGw",
+            auto_upload=False,
+            language="cn",
+            transcript_fmts={"srt", "vtt"},
+            promotes=None,
+        )
+        same = Args(
+            video_uuid=" 3g5KGYyneGw",
+            auto_upload=True,
+            language="CN",
+            transcript_fmts={"VTT", "srt"},
+            promotes="元青花",
+        )
+        other = args.model_copy(update={"transcript_fmts": {"srt"}})
+        self.assertEqual(args.fingerprint(), same.fingerprint())
+        self.assertNotEqual(args.fingerprint(), other.fingerprint())
+
+
+class SearchHitTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+
+    def add_video(self, transcript: str, status: int = 7) -> int:
+        cursor = self.db.execute(
+            "INSERT INTO workflow (user_id, create_at, args, type, status) "
+            "VALUES (1, 0, '{}', 1, ?)",
+            (status,)
+        )
+        self.db.execute(
+            "INSERT INTO video (workflow_id, user_id, snippt, transcript) "
+            "VALUES (?, 1, '{}', ?)",
+            (cursor.lastrowid, json.dumps({"srt": transcript}))
+        )
+        self.db.commit()
+        return cursor.lastrowid
+
+    def test_search_ranked_and_highlighted(self) -> None:
+        once = self.add_video("a <cup> of tea")
+        twice = self.add_video("tea, more tea")
+        self.add_video("tea", status=20)
+        hits = SearchHit.search(1, "tea", limit=10, offset=0)
+        self.assertEqual([h.workflow_id for h in hits], [twice, once])
+        self.assertEqual(hits[1].snippet, "a &lt;cup&gt; of <mark>tea</mark>")
+
+    def test_search_follows_transcript_updates(self) -> None:
+        id = self.add_video("元青花")
+        self.db.execute(
+            "UPDATE video SET transcript = ? WHERE workflow_id = ?",
+            (json.dumps({"srt": "青花瓷"}), id)
+        )
+        self.db.commit()
+        self.assertEqual(SearchHit.search(1, "元青花", 10, 0), [])
+        self.assertEqual(len(SearchHit.search(1, "青花瓷", 10, 0)), 1)
+
+        self.db.execute("DELETE FROM video WHERE workflow_id = ?", (id,))
+        self.db.commit()
+        self.assertEqual(SearchHit.search(1, "青花瓷", 10, 0), [])
+        self.db.execute(
+            "INSERT INTO video_fts (video_fts) VALUES ('integrity-check')"
+        )
+
+    def test_search_snippet_excerpt(self) -> None:
+        self.add_video("x" * 100 + " Tea time " + "y" * 100)
+        [hit] = SearchHit.search(1, "tea", 10, 0)
+        self.assertEqual(
+            hit.snippet,
+            "..." + "x" * 63 + " <mark>Tea</mark> time " + "y" * 58 + "...",
+        )
+
+    def test_search_snippt(self) -> None:
+        cursor = self.db.execute(
+            "INSERT INTO workflow (user_id, create_at, args, type, status) "
+            "VALUES (1, 0, '{}', 1, 7)"
+        )
+        self.db.execute(
+            "INSERT INTO video (workflow_id, user_id, snippt) "
+            "VALUES (?, 1, ?)",
+            (cursor.lastrowid, json.dumps({"title": "元青花 & tea"}))
+        )
+        self.db.commit()
+        [hit] = SearchHit.search(1, "元青花", 10, 0)
+        self.assertEqual(hit.snippet, "<mark>元青花</mark> &amp; tea")
+
+
+class WorkflowSummaryTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
 
     def test_list_return_no_empty(self) -> None:
-        metadatas = WorkflowMetadata.list(TEST_USER_ID, WorkflowType.VIDEO)
-        self.assertEquals(len(metadatas), 1)
-
-        # WorkflowMetadata(id=45, create_at=1701579219, status=7, uuid='3g5KGYyneGw', snippt={}, transcript=ANY)
-        metadata = metadatas[0]
-        self.assertEqual(metadata.id, 45)
-        self.assertEqual(metadata.uuid, "3g5KGYyneGw")
-        self.assertEqual(metadata.snippt, {})
+        self.db.execute(
+            "INSERT INTO workflow "
+            "(id, user_id, create_at, args, type, status) "
+            "VALUES (45, 1, 1701579219, ?, 1, 7)",
+            (json.dumps(args("3g5KGYyneGw")),)
+        )
+        self.db.execute(
+            "INSERT INTO workflow (user_id, create_at, args, type, status) "
+            "VALUES (1, 0, '{}', 1, 20)"
+        )
+        self.db.commit()
+        summaries = WorkflowSummary.list(1, WorkflowType.VIDEO)
+        self.assertEqual(len(summaries), 1)
+
+        summary = summaries[0]
+        self.assertEqual(summary.id, 45)
+        self.assertEqual(summary.uuid, "3g5KGYyneGw")
+        self.assertEqual(summary.formats, {})
+
+    def test_list_formats_without_transcripts(self) -> None:
+        self.db.execute(
+            "INSERT INTO workflow (user_id, create_at, args, type, status) "
+            "VALUES (1, 0, '{\"video_uuid\": \"abc\"}', 1, 7)"
+        )
+        self.db.execute(
+            "INSERT INTO video (workflow_id, user_id, transcript) "
+            "VALUES (1, 1, ?)",
+            (json.dumps({"srt": "1\n...", "text": "元"}),)
+        )
+        self.db.commit()
+        [summary] = WorkflowSummary.list(1, WorkflowType.VIDEO)
+        self.assertEqual(summary.uuid, "abc")
+        self.assertEqual(summary.formats, {"srt": 5, "text": 3})
+        self.assertEqual(Transcript.get(1, "text"), "元")
+
+        self.db.execute(
+            "UPDATE video SET transcript = ? WHERE workflow_id = 1",
+            (json.dumps({"vtt": "WEBVTT"}),)
+        )
+        self.db.commit()
+        [summary] = WorkflowSummary.list(1, WorkflowType.VIDEO)
+        self.assertEqual(summary.formats, {"vtt": 6})
+
+
+class WorkflowManyTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        self.user = User(1, "a@b.c", 0)
+
+    def args(self, i: int) -> Args:
+        return Args.model_validate(args(f"uuid{i}"))
+
+    def test_new_many_get_many(self) -> None:
+        # More rows than one INSERT holds.
+        count = MAX_SQL_VARIABLES // 7 + 3
+        workflows = Workflow.new_many(
+            self.user, [self.args(i) for i in range(count)],
+            WorkflowType.VIDEO
+        )
+        self.assertEqual(
+            [w.id for w in workflows], list(range(1, count + 1))
+        )
+        ids = [w.id for w in workflows] + [count + 1]
+        found = Workflow.get_many(ids, self.user.id)
+        self.assertEqual(sorted(found), ids[:-1])
+        for workflow in workflows:
+            self.assertEqual(found[workflow.id].args, workflow.args)
+            self.assertEqual(found[workflow.id].status, Status.TODO)
+
+        Workflow.delete([1], self.user.id)
+        self.assertNotIn(1, Workflow.get_many([1, 2], self.user.id))
+        self.assertEqual(Workflow.get_many([2], 2), {})
+
+
+class WorkflowBulkRouterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 10)"
+        )
+        self.db.commit()
+        self.client = TestClient(app)
+        token = asyncio.run(AccessToken(1).encode())
+        self.client.cookies.set("Authorization", f'"Bearer {token}"')
+
+    def bulk_add(self, args_list, type: int = 1):
+        return self.client.post(
+            "/workflow/bulk/add", params={"type": type}, json=args_list
+        )
+
+    def test_bulk_add(self) -> None:
+        rsp = self.bulk_add([
+            args("a"), {"video_uuid": "a"}, args("a"), args("b")
+        ])
+        self.assertEqual(rsp.status_code, 201)
+        results = rsp.json()["results"]
+        self.assertEqual(results[0], {
+            "index": 0, "workflow_id": 1, "created": True
+        })
+        self.assertIn("error", results[1])
+        self.assertEqual(results[2], {
+            "index": 2, "workflow_id": 1, "created": False
+        })
+        self.assertEqual(results[3], {
+            "index": 3, "workflow_id": 2, "created": True
+        })
+
+    def test_bulk_add_invalid_type(self) -> None:
+        rsp = self.bulk_add([args("a")], type=99)
+        self.assertEqual(rsp.status_code, 400)
+
+    def test_add_invalid_type(self) -> None:
+        rsp = self.client.post(
+            "/workflow/add",
+            params={"args": json.dumps(args("a")), "type": 99},
+        )
+        self.assertEqual(rsp.status_code, 400)
+
+    def test_bulk_add_priority(self) -> None:
+        rsp = self.client.post(
+            "/workflow/bulk/add",
+            params={"type": 1, "priority": 3},
+            json=[args("a")],
+        )
+        self.assertEqual(rsp.status_code, 201)
+        priorities = self.db.execute(
+            "SELECT priority FROM workflow"
+        ).fetchall()
+        self.assertEqual(priorities, [(3,)])
+
+        rsp = self.client.post(
+            "/workflow/bulk/add",
+            params={"type": 1, "priority": -1},
+            json=[args("b")],
+        )
+        self.assertEqual(rsp.status_code, 400)
+
+    def test_bulk_delete_retry(self) -> None:
+        self.bulk_add([args("a"), args("b")])
+        self.db.execute("UPDATE workflow SET status = ? WHERE id = 2",
+                        (Status.FAILED.value,))
+        self.db.commit()
+
+        rsp = self.client.post("/workflow/bulk/retry", json=[1, 2, 3])
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(rsp.json()["results"], [
+            {"workflow_id": 1, "retry_id": 1, "created": False},
+            {"workflow_id": 2, "retry_id": 3, "created": True},
+            {"workflow_id": 3, "error": "Not found."},
+        ])
+
+        rsp = self.client.post("/workflow/bulk/delete", json=[1, 4])
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual(rsp.json()["results"], [
+            {"workflow_id": 1, "deleted": True},
+            {"workflow_id": 4, "deleted": False},
+        ])
+        self.assertEqual(Workflow.get_many([1, 3], 1).keys(), {3})
+
+
+    def test_retry_own_workflows_only(self) -> None:
+        self.bulk_add([args("a")])
+        Workflow.new_many(
+            User(2, "d@e.f", 0), [Args.model_validate(args("b"))],
+            WorkflowType.VIDEO
+        )
+
+        rsp = self.client.post("/workflow/retry", params={"workflow_id": 1})
+        self.assertEqual(rsp.json(), {"workflow_id": 1, "created": False})
+        rsp = self.client.post("/workflow/retry", params={"workflow_id": 2})
+        self.assertEqual(rsp.status_code, 400)
+        self.assertIn("id 2.", rsp.json()["detail"])
+        self.assertEqual(
+            self.db.execute("SELECT COUNT(*) FROM workflow").fetchone(), (2,)
+        )
+
+
+class WorkflowChangesRouterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.db = use_memory_db()
+        self.db.execute(
+            "INSERT INTO users (id, name, create_at, credit) "
+            "VALUES (1, 'a@b.c', 0, 10)"
+        )
+        self.db.commit()
+        self.client = TestClient(app)
+        token = asyncio.run(AccessToken(1).encode())
+        self.client.cookies.set("Authorization", f'"Bearer {token}"')
+
+    def test_invalid_type(self) -> None:
+        for path in ("/workflow/changes", "/workflow/changes/stream"):
+            rsp = self.client.get(path, params={"type": 99, "timeout": 0})
+            self.assertEqual(rsp.status_code, 400)
+
+    def test_changes(self) -> None:
+        self.client.post(
+            "/workflow/bulk/add", params={"type": 1}, json=[args("a")]
+        )
+        rsp = self.client.get(
+            "/workflow/changes", params={"type": 1, "timeout": 0}
+        )
+        self.assertEqual(rsp.status_code, 200)
+        self.assertEqual([w["id"] for w in rsp.json()["workflows"]], [1])
 
 
 # python3 models/tests/workflow.py
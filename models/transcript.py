@@ -0,0 +1,154 @@
+import logging
+
+from typing import Dict, List, Optional
+
+from lib.sqlite_connection_manager import (
+    MAX_SQL_VARIABLES,
+    SQLiteConnectionManager,
+    chunks,
+)
+from lib.tracing import traced_methods
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+@traced_methods
+class Transcript:
+    """
+    One format of a video transcript in the sql table 'transcript', filled
+    by triggers from 'video.transcript', see
+    scripts/migrations/014_transcript.sql.
+    Sql table like:
+    CREATE TABLE transcript (
+        workflow_id INTEGER NOT NULL,
+        -- `models.resource.Format` value
+        fmt TEXT NOT NULL,
+        -- utf-8 bytes
+        size INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        PRIMARY KEY (workflow_id, fmt)
+    )
+
+    'size' comes before 'content', so reading the sizes never loads the
+    content pages.
+
+    The rows are a second copy of 'video.transcript', on purpose: the
+    workers, which live outside this repository, write that column, so it
+    stays the canonical copy and these rows a projection of it kept in
+    sync by the triggers.
+    """
+
+    @classmethod
+    def sizes(cls, workflow_ids: List[int]) -> Dict[int, Dict[str, int]]:
+        """
+        Return the available formats and their sizes by workflow id.
+        """
+        sizes: Dict[int, Dict[str, int]] = {}
+        sqlite = SQLiteConnectionManager()
+        try:
+            with sqlite.connect() as connection:
+                cursor = connection.cursor()
+                for chunk in chunks(workflow_ids, MAX_SQL_VARIABLES):
+                    cursor.execute(
+                        """
+                            SELECT
+                                workflow_id, fmt, size
+                            FROM
+                                transcript
+                            WHERE
+                                workflow_id IN ( {} )
+                        """.format(', '.join(['?'] * len(chunk))),
+                        chunk
+                    )
+                    for workflow_id, fmt, size in cursor.fetchall():
+                        sizes.setdefault(workflow_id, {})[fmt] = size
+        except Exception as e:
+            raise Exception(
+                f"Failed to get transcript sizes of {len(workflow_ids)} "
+                f"workflows due to error:\n {e}"
+            ) from e
+        return sizes
+
+    @classmethod
+    def get(cls, workflow_id: int, fmt: str) -> Optional[str]:
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                    SELECT
+                        content
+                    FROM
+                        transcript
+                    WHERE
+                        workflow_id = ?
+                        AND fmt = ?
+                """,
+                (workflow_id, fmt)
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @classmethod
+    def excerpts(
+        cls,
+        workflow_ids: List[int],
+        query: str,
+        context_chars: int,
+    ) -> Dict[int, str]:
+        """
+        Return by workflow id the first match of `query`, ASCII case
+        insensitive, in a transcript, with `context_chars` characters on
+        each side, "..." marking the cuts. The text one is searched first,
+        the json one last. Only the excerpts leave sqlite.
+        """
+        excerpts: Dict[int, str] = {}
+        sqlite = SQLiteConnectionManager()
+        with sqlite.connect() as connection:
+            cursor = connection.cursor()
+            for chunk in chunks(workflow_ids, MAX_SQL_VARIABLES):
+                cursor.execute(
+                    """
+                        SELECT
+                            workflow_id,
+                            max(pos - :context, 1) AS start,
+                            length(content),
+                            substr(
+                                content,
+                                max(pos - :context, 1),
+                                pos - max(pos - :context, 1)
+                                    + length(:query) + :context
+                            )
+                        FROM (
+                            SELECT
+                                workflow_id,
+                                fmt,
+                                content,
+                                instr(lower(content), lower(:query)) AS pos
+                            FROM
+                                transcript
+                            WHERE
+                                workflow_id IN ( {} )
+                        )
+                        WHERE
+                            pos > 0
+                        ORDER BY
+                            workflow_id, fmt != 'text', fmt = 'json', fmt
+                    """.format(', '.join(
+                        f':id{j}' for j in range(len(chunk))
+                    )),
+                    {
+                        "context": context_chars,
+                        "query": query,
+                        **{f"id{j}": id for j, id in enumerate(chunk)},
+                    }
+                )
+                for workflow_id, start, length, text in cursor.fetchall():
+                    if workflow_id in excerpts:
+                        continue
+                    excerpts[workflow_id] = (
+                        ("..." if start > 1 else "")
+                        + text
+                        + ("..." if start + len(text) <= length else "")
+                    )
+        return excerpts
@@ -1,23 +1,24 @@
 import logging
 import time
-from typing import Optional, Tuple
-from google.oauth2.credentials import Credentials
-from cryptography.fernet import Fernet
+from typing import TYPE_CHECKING, Optional, Tuple
 
+from lib.credential_store import credential_store
 from lib.exception import UserNotFoundException
 from lib.sqlite_connection_manager import SQLiteConnectionManager
-from lib.config import FERNET_KEY
+from lib.tracing import traced_methods
 
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
-logger = logging.getLogger("uvicorn.error")
 
-UTF_8 = "utf-8"
+logger = logging.getLogger("uvicorn.error")
 
 # TODO use from pydantic import BaseModel
 # https://nilsdebruin.medium.com/fastapi-google-as-an-external-authentication-provider-3a527672cf33
 # https://github.com/kolitiri/fastapi-oidc-react
 
 
+@traced_methods
 class User:
 
     def __init__(self,
@@ -30,7 +31,7 @@ class User:
         self.name = name
         self.create_at = create_at
         self.credit: int = credit
-        self.credentials: Optional[Credentials] = None
+        self.credentials: Optional["Credentials"] = None
 
     def __repr__(self) -> str:
         return (
@@ -62,7 +63,7 @@ class User:
                     (name, create_at, credentials, credit)
                 )
                 user_id = cursor.lastrowid
-                logger.debug(f"New user id: {user_id}")
+                logger.debug("New user id: %s", user_id)
                 connection.commit()
         except Exception as e:
             raise UserNotFoundException(
@@ -98,15 +99,16 @@ class User:
                 row = cursor.fetchone()
         except Exception as e:
             logger.error(
-                f"Failed to get user with id: {id} "
-                f"from sqlite3 with due to error:\n {e}"
+                "Failed to get user with id: %s from "
+                "sqlite3 with due to error:\n %s",
+                id, e,
             )
 
         if row:
             id_, create_at_, name_, credit_ = row
             return User(id_, name_, create_at_, credit_)
 
-        logger.error(f"Failed to find a user with id: {id}")
+        logger.error("Failed to find a user with id: %s", id)
         raise UserNotFoundException("We can't found this user from database.")
 
     @classmethod
@@ -130,62 +132,28 @@ class User:
                     (name,)
                 )
                 row = cursor.fetchone()
-                logger.debug(f"row={row}")
+                logger.debug("row=%s", row)
         except Exception as e:
             logger.error(
-                f"Failed to get user with name(email) {name} from sqlite3 with due to error:\n {e}")
+                "Failed to get user with name(email) %s "
+                "from sqlite3 with due to error:\n %s",
+                name, e,
+            )
             return None
 
         if row:
             id_, create_at_, name_, credit_ = row
             return User(id_, name_, create_at_, credit_)
 
-        logger.info(f"Can not found user with name(email): {name} from db")
+        logger.info("Can not found user with name(email): %s from db", name)
         return None
 
-    def get_credentials(self) -> Optional[Credentials]:
-        credentials_encrypted = None
-        try:
-            with SQLiteConnectionManager().connect() as connection:
-                cursor = connection.cursor()
-                cursor.execute(
-                    "SELECT credentials FROM users WHERE id = ?",
-                    (self.id,)
-                )
-                credentials_encrypted = cursor.fetchone()[0]
-        except Exception as e:
-            logger.error(
-                f"Failed read credentials for name(email) {self.name} "
-                f"from sqlite3 due to error:\n {e}"
-            )
-        if credentials_encrypted:
-            fernet = Fernet(FERNET_KEY)
-            credentials_raw = fernet.decrypt(
-                credentials_encrypted
-            ).decode(UTF_8)
-            return Credentials.from_authorized_user_info(info=credentials_raw)
-        logger.error("Failed to get encrypted credentials from database!")
-        return None
+    def get_credentials(self) -> Optional["Credentials"]:
+        return credential_store.get(self.id)
 
-    def set_credentials(self, credentials: Credentials) -> None:
-        fernet = Fernet(FERNET_KEY)
+    def set_credentials(self, credentials: "Credentials") -> None:
         self.credentials = credentials
-        credentials_encrypted = fernet.encrypt(
-            credentials.to_json().encode(UTF_8)
-        )
-        try:
-            with SQLiteConnectionManager().connect() as connection:
-                cursor = connection.cursor()
-                cursor.execute(
-                    "UPDATE users SET credentials = ? WHERE id = ?",
-                    (credentials_encrypted, self.id,)
-                )
-                connection.commit()
-        except Exception as e:
-            logger.error(
-                f"Failed write credentials for name(email) {self.name} "
-                f"to sqlite3 due to error:\n {e}"
-            )
+        credential_store.set(self.id, credentials)
 
     def set_credit(self, credit: int) -> None:
         try:
@@ -198,8 +166,8 @@ class User:
                 connection.commit()
         except Exception as e:
             logger.error(
-                f"Failed to set credit for user: {self} "
-                f"as {credit} due to error: {e}"
+                "Failed to set credit for user: %s as %s due to error: %s",
+                self, credit, e,
             )
 
 
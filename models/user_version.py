@@ -0,0 +1,62 @@
+import logging
+
+from typing import Dict, List
+
+from lib.sqlite_connection_manager import (
+    MAX_SQL_VARIABLES,
+    SQLiteConnectionManager,
+    chunks,
+)
+from lib.tracing import traced_methods
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+@traced_methods
+class UserVersion:
+    """
+    Per user change counter in the sql table 'user_version', bumped by
+    triggers on every workflow status or video change of the user, see
+    scripts/migrations/008_workflow_version.sql.
+    Sql table like:
+    CREATE TABLE user_version (
+        user_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """
+
+    @classmethod
+    def get(cls, user_id: int) -> int:
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT version FROM user_version WHERE user_id = ?",
+                (user_id,)
+            )
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    @classmethod
+    def get_many(cls, user_ids: List[int]) -> Dict[int, int]:
+        """
+        Return the versions by user id, users without any change are left
+        out.
+        """
+        versions = {}
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            for chunk in chunks(user_ids, MAX_SQL_VARIABLES):
+                cursor.execute(
+                    """
+                        SELECT
+                            user_id, version
+                        FROM
+                            user_version
+                        WHERE
+                            user_id IN ( {} )
+                    """.format(', '.join(['?'] * len(chunk))),
+                    chunk
+                )
+                versions.update(cursor.fetchall())
+        return versions
@@ -1,12 +1,21 @@
+import hashlib
+import html
 import json
 import logging
+import re
 import time
 
 from enum import Enum
-from lib.sqlite_connection_manager import SQLiteConnectionManager
+from lib.sqlite_connection_manager import (
+    MAX_SQL_VARIABLES,
+    SQLiteConnectionManager,
+    chunks,
+)
+from lib.tracing import traced_methods, untraced
+from models.transcript import Transcript
 from models.user import User
 from pydantic import BaseModel, ValidationError
-from typing import Optional, List, Any, Tuple, Set, Mapping
+from typing import Optional, List, Any, Tuple, Set, Mapping, Dict, Iterator
 
 
 SELECT_MAX = 1000
@@ -34,6 +43,19 @@ class Status(Enum):
     DELETED = 20
 
 
+# Workflows held by a worker.
+RUNNING_STATUSES = (Status.LOCKED, Status.CLAIMED, Status.WORKING)
+# A new workflow with the same args as one of these is a duplicate. ERROR,
+# FAILED and NO_CREDIT ones are what /retry is for.
+LIVE_STATUSES = (
+    Status.TODO,
+    Status.LOCKED,
+    Status.CLAIMED,
+    Status.WORKING,
+    Status.DONE,
+)
+
+
 class Args(BaseModel):
     """
     One Example:
@@ -54,6 +76,19 @@ class Args(BaseModel):
     def to_json(self) -> Mapping[str, Any]:
         return self.json()
 
+    def fingerprint(self) -> str:
+        """
+        Hash of the args deciding the work done: the video, the language and
+        the transcript formats, normalized so that spelling variants of the
+        same request match.
+        """
+        normalized = json.dumps([
+            (self.video_uuid or "").strip(),
+            (self.language or "").strip().upper(),
+            sorted({f.strip().lower() for f in self.transcript_fmts}),
+        ])
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
     @classmethod
     def from_json(cls, json_str: str) -> "Args":
         arg = cls(
@@ -67,16 +102,17 @@ class Args(BaseModel):
             arg = cls.model_validate_json(json_str)
         except ValidationError as e:
             logger.exception(
-                f"Failed to parse: {json_str} as Args objection "
-                f"due to exp: {e}, fallback to default values"
+                "Failed to parse: %s as Args objection due "
+                "to exp: %s, fallback to default values",
+                json_str, e,
             )
             parsed = {}
             try:
                 parsed = json.dumps(json_str)
             except Exception as e:
                 logger.exception(
-                    f"Failed to parse {json_str} as "
-                    f"a json due to exp: {e}"
+                    "Failed to parse %s as a json due to exp: %s",
+                    json_str, e,
                 )
                 arg.video_uuid = parsed.get("video_uuid", None)
                 arg.auto_upload = parsed.get("auto_upload", False)
@@ -87,6 +123,7 @@ class Args(BaseModel):
         return arg
 
 
+@traced_methods
 class Workflow(BaseModel):
     """
     A workflow instance in the sql table 'workflow'.
@@ -99,7 +136,14 @@ class Workflow(BaseModel):
         -- 1: video_workflow
         type INTEGER,
         -- 0: todo --1 locked --2 claimed ...
-        status INTEGER
+        status INTEGER,
+        version INTEGER NOT NULL DEFAULT 0,
+        -- `Args.fingerprint`
+        fingerprint TEXT,
+        -- higher first within the user's queue
+        priority INTEGER NOT NULL DEFAULT 0,
+        -- set by a trigger when the status becomes DELETED
+        delete_at INTEGER
     )
 
     'args' is a json string repsentation of `Args`. see `class Args`
@@ -117,6 +161,7 @@ class Workflow(BaseModel):
     def __repr__(self) -> str:
         return self.__str__()
 
+    @untraced
     def to_values(self) -> Tuple[Any]:
         return (
             self.user_id,
@@ -124,9 +169,11 @@ class Workflow(BaseModel):
             self.args.to_json(),
             self.type.value,
             self.status.value,
+            self.args.fingerprint(),
         )
 
     @classmethod
+    @untraced
     def from_values(cls, values: Tuple[Any]) -> "Workflow":
         return Workflow(
             id=values[0],
@@ -165,49 +212,289 @@ class Workflow(BaseModel):
         return None
 
     @classmethod
-    def new(cls, user: User, args: Args, type: WorkflowType) -> "Workflow":
+    def new_many(
+        cls,
+        user: User,
+        args_list: List[Args],
+        type: WorkflowType,
+        priority: int = 0,
+    ) -> List["Workflow"]:
+        """
+        Insert one workflow per args, all with `priority`, in a single
+        transaction, a multi-row INSERT per chunk of at most
+        `MAX_SQL_VARIABLES` values. A chunk's rows get consecutive ids
+        ending at its `lastrowid`, the statement holding the write lock.
+        """
         sqlite = SQLiteConnectionManager()
-
-        workflow = Workflow(
-            id=-1,
-            user_id=user.id,
-            create_at=now(),
-            args=args,
-            type=type,
-            status=Status.TODO,
-        )
+        create_at = now()
+        workflows = [
+            Workflow(
+                id=-1,
+                user_id=user.id,
+                create_at=create_at,
+                args=args,
+                type=type,
+                status=Status.TODO,
+            )
+            for args in args_list
+        ]
         sql = """
             INSERT INTO
-                workflow (user_id, create_at, args, type, status)
+                workflow (
+                    user_id, create_at, args, type, status, fingerprint,
+                    priority
+                )
             VALUES
-                (?, ?, ?, ?, ?)
+                {}
         """
+        columns = 7
 
         try:
             with sqlite.connect() as connection:
                 cursor = connection.cursor()
-                cursor.execute(
-                    sql,
-                    workflow.to_values()
-                )
-                workflow.id = cursor.lastrowid
+                for chunk in chunks(workflows, MAX_SQL_VARIABLES // columns):
+                    cursor.execute(
+                        sql.format(", ".join(
+                            ["(?, ?, ?, ?, ?, ?, ?)"] * len(chunk)
+                        )),
+                        [
+                            v
+                            for workflow in chunk
+                            for v in (*workflow.to_values(), priority)
+                        ]
+                    )
+                    first_id = cursor.lastrowid - len(chunk) + 1
+                    for i, workflow in enumerate(chunk):
+                        workflow.id = first_id + i
                 connection.commit()
-                logger.debug(
-                    f"inserted new workflow with id: {workflow.id} "
-                )
         except Exception as e:
             raise Exception(
-                f"Failed to insert workflow with sql:\n{sql}, "
-                f"values={workflow.to_values()} due to error:\n {e}"
+                f"Failed to insert {len(workflows)} workflows for user: "
+                f"{user.id} due to error:\n {e}"
             ) from e
+        logger.debug("inserted %s workflows for %s", len(workflows), user.id)
+        return workflows
 
-        return workflow
+    @classmethod
+    def get_many(cls, ids: List[int], user_id: int) -> Dict[int, "Workflow"]:
+        """
+        Return the user's not deleted workflows among `ids`, by id.
+        """
+        sqlite = SQLiteConnectionManager()
+        workflows = {}
+        try:
+            with sqlite.connect() as connection:
+                cursor = connection.cursor()
+                for chunk in chunks(ids, MAX_SQL_VARIABLES):
+                    cursor.execute(
+                        """
+                            SELECT
+                                id, user_id, create_at, args, type, status
+                            FROM
+                                workflow
+                            WHERE
+                                user_id = ?
+                                AND status != ?
+                                AND id IN ( {} )
+                        """.format(', '.join(['?'] * len(chunk))),
+                        (user_id, Status.DELETED.value, *chunk)
+                    )
+                    for row in cursor.fetchall():
+                        workflows[row[0]] = cls.from_values(row)
+        except Exception as e:
+            raise Exception(
+                f"Failed to get {len(ids)} workflows of user: {user_id} "
+                f"due to error:\n {e}"
+            ) from e
+        return workflows
 
     @classmethod
-    def delete(cls, ids: List[int], user_id: int) -> None:
-        if not ids:
-            return None
+    def find_live(
+        cls,
+        user_id: int,
+        type: WorkflowType,
+        fingerprints: List[str],
+    ) -> Dict[str, "Workflow"]:
+        """
+        Return the user's latest live workflow by fingerprint, for the
+        fingerprints having one.
+        """
         sql = """
+            SELECT
+                id, user_id, create_at, args, type, status, fingerprint
+            FROM
+                workflow
+            WHERE
+                user_id = ?
+                AND fingerprint IN ( {} )
+                AND type = ?
+                AND status IN ( {} )
+            ORDER BY id
+        """
+        statuses = [s.value for s in LIVE_STATUSES]
+        workflows = {}
+        sqlite = SQLiteConnectionManager()
+        try:
+            with sqlite.connect() as connection:
+                cursor = connection.cursor()
+                for chunk in chunks(fingerprints, MAX_SQL_VARIABLES):
+                    cursor.execute(
+                        sql.format(
+                            ', '.join(['?'] * len(chunk)),
+                            ', '.join(['?'] * len(statuses)),
+                        ),
+                        (user_id, *chunk, type.value, *statuses)
+                    )
+                    for row in cursor.fetchall():
+                        workflows[row[6]] = cls.from_values(row)
+        except Exception as e:
+            raise Exception(
+                f"Failed to find live workflows of user: {user_id} "
+                f"due to error:\n {e}"
+            ) from e
+        return workflows
+
+    @classmethod
+    def list_todo(
+        cls,
+        after_id: int,
+        limit: int,
+    ) -> List[Tuple[int, int, int, int]]:
+        """
+        Return (id, user_id, user credit, priority) of the TODO workflows
+        after `after_id`, by id.
+        """
+        sql = """
+            SELECT
+                w.id, w.user_id, u.credit, w.priority
+            FROM workflow as w JOIN users as u
+                ON w.user_id = u.id
+            WHERE
+                w.status = ?
+                AND w.id > ?
+            ORDER BY w.id
+            LIMIT ?
+        """
+        sqlite = SQLiteConnectionManager()
+        try:
+            with sqlite.connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(sql, (Status.TODO.value, after_id, limit))
+                return cursor.fetchall()
+        except Exception as e:
+            raise Exception(
+                f"Failed to list todo workflows after: {after_id} "
+                f"due to error:\n {e}"
+            ) from e
+
+    @classmethod
+    def list_archivable(
+        cls,
+        deleted_before: int,
+        done_before: Optional[int],
+        limit: int,
+    ) -> List[int]:
+        """
+        Return the ids of the workflows deleted before `deleted_before` and,
+        unless `done_before` is None, of the DONE ones created before it.
+        """
+        sql = """
+            SELECT
+                id
+            FROM
+                workflow
+            WHERE
+                (status = ? AND delete_at < ?)
+                OR (status = ? AND create_at < ?)
+            ORDER BY id
+            LIMIT ?
+        """
+        values = (
+            Status.DELETED.value,
+            deleted_before,
+            Status.DONE.value,
+            -1 if done_before is None else done_before,
+            limit,
+        )
+        sqlite = SQLiteConnectionManager()
+        try:
+            with sqlite.connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(sql, values)
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            raise Exception(
+                f"Failed to list archivable workflows due to error:\n {e}"
+            ) from e
+
+    @classmethod
+    def count_running(cls) -> Dict[int, int]:
+        """
+        Return the number of workflows held by a worker by user id.
+        """
+        statuses = [s.value for s in RUNNING_STATUSES]
+        sql = """
+            SELECT
+                user_id, COUNT(*)
+            FROM
+                workflow
+            WHERE
+                status IN ( {} )
+            GROUP BY user_id
+        """.format(', '.join(['?'] * len(statuses)))
+        sqlite = SQLiteConnectionManager()
+        try:
+            with sqlite.connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(sql, statuses)
+                return dict(cursor.fetchall())
+        except Exception as e:
+            raise Exception(
+                f"Failed to count running workflows due to error:\n {e}"
+            ) from e
+
+    @classmethod
+    def transition(
+        cls,
+        cursor: Any,
+        ids: List[int],
+        from_status: Status,
+        to_status: Status,
+    ) -> List[int]:
+        """
+        Move the workflows still in `from_status` to `to_status` within the
+        caller's transaction. Return the ids moved, in `ids` order.
+        """
+        moved = []
+        for id in ids:
+            cursor.execute(
+                "UPDATE workflow SET status = ? WHERE id = ? AND status = ?",
+                (to_status.value, id, from_status.value)
+            )
+            if cursor.rowcount:
+                moved.append(id)
+        return moved
+
+    @classmethod
+    def delete(cls, ids: List[int], user_id: int) -> Set[int]:
+        """
+        Mark the user's workflows among `ids` as deleted, in chunks of at
+        most `MAX_SQL_VARIABLES` ids within one transaction.
+        Return the ids actually deleted.
+        """
+        if not ids:
+            return set()
+        select_sql = """
+            SELECT
+                id
+            FROM
+                workflow
+            WHERE
+                user_id = ?
+                AND status != ?
+                AND id IN ( {} )
+        """
+        update_sql = """
             UPDATE
                 workflow
             SET
@@ -215,64 +502,102 @@ class Workflow(BaseModel):
             WHERE
                 user_id = ?
                 AND id IN ( {} )
-        """.format(', '.join(['?'] * len(ids)))
+        """
+        deleted: Set[int] = set()
         sqlite = SQLiteConnectionManager()
         try:
             with sqlite.connect() as connection:
                 cursor = connection.cursor()
-                cursor.execute(
-                    sql,
-                    (Status.DELETED.value, user_id, *ids)
-                )
+                for chunk in chunks(ids, MAX_SQL_VARIABLES):
+                    placeholders = ', '.join(['?'] * len(chunk))
+                    cursor.execute(
+                        select_sql.format(placeholders),
+                        (user_id, Status.DELETED.value, *chunk)
+                    )
+                    found = [row[0] for row in cursor.fetchall()]
+                    if not found:
+                        continue
+                    cursor.execute(
+                        update_sql.format(', '.join(['?'] * len(found))),
+                        (Status.DELETED.value, user_id, *found)
+                    )
+                    deleted.update(found)
                 connection.commit()
                 logger.info(
-                    f"Success delete workflow: {ids} "
-                    f"from user: {user_id}"
+                    "Success delete %s workflows from user: %s",
+                    len(deleted), user_id,
                 )
         except Exception as e:
             raise Exception(
-                f"Failed to update workflow: {id} as deleted.") from e
+                f"Failed to update {len(ids)} workflows as deleted."
+            ) from e
+        return deleted
 
 
-class WorkflowMetadata(BaseModel):
+@traced_methods
+class WorkflowSummary(BaseModel):
+    """
+    What the listings return: the transcripts are fetched one format at a
+    time, on demand, see `Transcript`.
+    """
     id: int
     create_at: int
     status: int
     uuid: Optional[str]
-    snippt: Mapping[str, Any]
-    transcript: Mapping[str, str]
+    # Available transcript formats and their sizes in bytes.
+    formats: Mapping[str, int]
+    # User version of the last change, see models/user_version.py.
+    version: int
 
     @classmethod
-    def from_values(cls, values: Tuple[Any]) -> "WorkflowMetadata":
-        def json_to_map(values, i) -> Mapping[str, Any]:
-            map = {}
-            if len(values) > i and values[i]:
-                map = json.loads(values[i])
-            return map
-
-        uuid = values[3]
-        if not uuid:
-            args = json_to_map(values, 6)
-            uuid = args.get("video_uuid", None)
-        return WorkflowMetadata(
-            id=values[0],
-            create_at=values[1],
-            status=values[2],
-            uuid=uuid,
-            snippt=json_to_map(values, 4),
-            transcript=json_to_map(values, 5),
-        )
+    def from_rows(cls, rows: List[Tuple[Any]]) -> List["WorkflowSummary"]:
+        sizes = Transcript.sizes([row[0] for row in rows])
+        summaries = []
+        for id, create_at, status, uuid, args, version in rows:
+            if not uuid and args:
+                uuid = json.loads(args).get("video_uuid", None)
+            summaries.append(WorkflowSummary(
+                id=id,
+                create_at=create_at,
+                status=status,
+                uuid=uuid,
+                formats=sizes.get(id, {}),
+                version=version,
+            ))
+        return summaries
+
+    @classmethod
+    def get_version(cls, id: int, user_id: int) -> Optional[int]:
+        """
+        Version of the user's workflow, None if not found or deleted.
+        """
+        with SQLiteConnectionManager().connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                    SELECT
+                        version
+                    FROM
+                        workflow
+                    WHERE
+                        id = ?
+                        AND user_id = ?
+                        AND status != ?
+                """,
+                (id, user_id, Status.DELETED.value)
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
 
     @classmethod
     def list(
         cls,
         user_id: int,
         type: WorkflowType,
-    ) -> List["WorkflowMetadata"]:
+    ) -> List["WorkflowSummary"]:
         sql = """
             SELECT
-                w.id, w.create_at, w.status,
-                v.uuid, v.snippt, v.transcript, w.args
+                w.id, w.create_at, w.status, v.uuid, w.args, w.version
             FROM workflow as w LEFT JOIN video as v
                 ON w.id = v.workflow_id AND w.user_id = v.user_id
             WHERE
@@ -293,11 +618,171 @@ class WorkflowMetadata(BaseModel):
                 f"Failed to list workflow with sql:\n{sql} "
                 f"due to exp: {e}"
             ) from e
+        return cls.from_rows(rows)
+
+    @classmethod
+    def list_changed(
+        cls,
+        user_id: int,
+        type: WorkflowType,
+        since: int,
+        limit: int,
+    ) -> List["WorkflowSummary"]:
+        """
+        Return the user's workflows changed after version `since`, oldest
+        change first. Deleted workflows are included, so the clients can
+        drop them.
+        """
+        sql = """
+            SELECT
+                w.id, w.create_at, w.status, v.uuid, w.args, w.version
+            FROM workflow as w LEFT JOIN video as v
+                ON w.id = v.workflow_id AND w.user_id = v.user_id
+            WHERE
+                w.user_id = ?
+                AND w.version > ?
+                AND type = ?
+            ORDER BY w.version
+            LIMIT ?
+        """
+        sqlite = SQLiteConnectionManager()
+        values = (user_id, since, type.value, limit)
+
+        try:
+            with sqlite.connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(sql, values)
+                rows = cursor.fetchall()
+        except Exception as e:
+            raise Exception(
+                f"Failed to list changed workflows with sql:\n{sql} "
+                f"due to exp: {e}"
+            ) from e
+        return cls.from_rows(rows)
+
 
-        metadatas = [WorkflowMetadata.from_values(r) for r in rows]
-        if len(metadatas) == 0:
-            logger.warning(
-                "Found new workflow for "
-                f"user_id: {user_id}, type: {type}"
+# Characters of context around a search match.
+SNIPPET_CHARS = 64
+
+
+def snippt_text(snippt: Optional[str]) -> str:
+    """
+    The text values of a video snippet, at any depth, as indexed.
+    """
+    def texts(value: Any) -> Iterator[str]:
+        if isinstance(value, str):
+            yield value
+        elif isinstance(value, dict):
+            for v in value.values():
+                yield from texts(v)
+        elif isinstance(value, list):
+            for v in value:
+                yield from texts(v)
+
+    try:
+        return "\n".join(texts(json.loads(snippt or "null")))
+    except ValueError:
+        return snippt or ""
+
+
+def excerpt(text: str, query: str) -> str:
+    """
+    About `SNIPPET_CHARS` characters on each side of the first match of
+    `query` in `text`, "..." marking the cuts, see `Transcript.excerpts`.
+    """
+    match = re.search(re.escape(query), text, re.IGNORECASE)
+    start = max(match.start() - SNIPPET_CHARS, 0) if match else 0
+    end = (match.end() if match else 0) + SNIPPET_CHARS
+    return (
+        ("..." if start > 0 else "")
+        + text[start:end]
+        + ("..." if end < len(text) else "")
+    )
+
+
+def highlight(text: str, query: str) -> str:
+    """
+    `text` HTML escaped, the matches of `query` wrapped in <mark></mark>.
+    """
+    parts = []
+    last = 0
+    for match in re.finditer(re.escape(query), text, re.IGNORECASE):
+        parts.append(html.escape(text[last:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group())}</mark>")
+        last = match.end()
+    parts.append(html.escape(text[last:]))
+    return "".join(parts)
+
+
+@traced_methods
+class SearchHit(BaseModel):
+    """
+    A video of the user matching a search, with the best matching part of
+    its transcript or snippet.
+    """
+    workflow_id: int
+    create_at: int
+    status: int
+    uuid: Optional[str]
+    # HTML escaped, the matches wrapped in <mark></mark>.
+    snippet: str
+    # bm25, lower is more relevant.
+    rank: float
+
+    @classmethod
+    def search(
+        cls,
+        user_id: int,
+        query: str,
+        limit: int,
+        offset: int,
+    ) -> List["SearchHit"]:
+        """
+        Return the user's videos containing `query`, most relevant first.
+        """
+        sql = """
+            SELECT
+                v.workflow_id, w.create_at, w.status, v.uuid, v.snippt,
+                bm25(video_fts)
+            FROM video_fts
+                JOIN video as v ON v.rowid = video_fts.rowid
+                JOIN workflow as w ON w.id = v.workflow_id
+            WHERE
+                video_fts MATCH ?
+                AND v.user_id = ?
+                AND w.status != ?
+            ORDER BY bm25(video_fts)
+            LIMIT ? OFFSET ?
+        """
+        # One quoted phrase, so the query syntax is never interpreted.
+        phrase = '"{}"'.format(query.replace('"', '""'))
+        values = (phrase, user_id, Status.DELETED.value, limit, offset)
+        sqlite = SQLiteConnectionManager()
+        try:
+            with sqlite.connect() as connection:
+                cursor = connection.cursor()
+                cursor.execute(sql, values)
+                rows = cursor.fetchall()
+            excerpts = Transcript.excerpts(
+                [row[0] for row in rows], query, SNIPPET_CHARS
+            )
+        except Exception as e:
+            raise Exception(
+                f"Failed to search: {query} for user: {user_id} "
+                f"due to error:\n {e}"
+            ) from e
+        return [
+            SearchHit(
+                workflow_id=row[0],
+                create_at=row[1],
+                status=row[2],
+                uuid=row[3],
+                snippet=highlight(
+                    excerpts.get(row[0])
+                    or excerpt(snippt_text(row[4]), query),
+                    query,
+                ),
+                rank=row[5],
             )
-        return metadatas
+            for row in rows
+        ]
@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from lib.exception import HTTP_SERVICE_UNAVAILABLE
+from lib.load_shedder import load_shedder
+
+
+router = APIRouter()
+
+
+@router.get("/health")
+async def health():
+    """
+    Liveness, 200 as long as the loop answers, with the load shedding state.
+    """
+    return {"status": "ok", **load_shedder.state()}
+
+
+@router.get("/ready")
+async def ready():
+    """
+    Readiness, 503 while shedding load so the load balancer sends the new
+    requests elsewhere.
+    """
+    state = load_shedder.state()
+    if state["shedding"]:
+        return JSONResponse(
+            {"status": "shedding", **state},
+            status_code=HTTP_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(load_shedder.retry_after_s)},
+        )
+    return {"status": "ready", **state}
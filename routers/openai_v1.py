@@ -1,11 +1,13 @@
 import logging
 
 from fastapi import APIRouter, Request, Depends, Body
-import aiohttp
 
 from lib.config import OPENAI_API_KEY
 from lib.exception import DependencyException, HTTP_BAD_GATEWAY
+from lib.lazy_import import lazy_import
 from lib.token_util import AccessTokenBearer
+from lib.tracing import span
+from models.api_key import Scope
 from models.user import User
 
 
@@ -13,11 +15,12 @@ OPENAI_DOMAIN = "https://api.openai.com/v1/"
 
 
 logger = logging.getLogger("uvicorn.error")
-logger.setLevel(logging.DEBUG)
+
+aiohttp = lazy_import("aiohttp")
 
 
 router = APIRouter()
-access_token_scheme = AccessTokenBearer()
+access_token_scheme = AccessTokenBearer(scope=Scope.OPENAI)
 
 
 # TODO /docs able to pass Parameters to this.
@@ -59,20 +62,23 @@ async def forward(
     req: Request,
     user: User = Depends(access_token_scheme),
 ):
-    logger.debug(f"user: {user.name} is requesting for: {api_url}")
+    logger.debug("user: %s is requesting for: %s", user.name, api_url)
     headers = {
         "Authorization": f"Bearer {OPENAI_API_KEY}",
     }
     req_json = await req.json()
     rsp_json = None
     try:
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.post(
-                api_url,
-                json=req_json,
-            ) as rsp:
-                rsp_json = await rsp.json()
-                logger.debug(f"Got response:\n {str(rsp_json)[:600]}")
+        with span("openai.forward", url=api_url) as s:
+            async with aiohttp.ClientSession(headers=headers) as session:
+                async with session.post(
+                    api_url,
+                    json=req_json,
+                ) as rsp:
+                    if s:
+                        s.attributes["http.status_code"] = rsp.status
+                    rsp_json = await rsp.json()
+                    logger.debug("Got response:\n %.600s", rsp_json)
     except Exception as e:
         raise DependencyException(
             status_code=HTTP_BAD_GATEWAY,
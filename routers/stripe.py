@@ -1,35 +1,34 @@
+import asyncio
 import logging
-import stripe
+import time
 
 from typing import Optional
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Request, Query
 from fastapi.responses import RedirectResponse
 
 from models.user import User
 from models.payment import Payment, Status
+from models.stripe_event import StripeEvent
+from lib.exception import PaymentException, HTTP_BAD_REQUEST, UserFaceException
+from lib.lazy_import import lazy_import
+from lib.payment_reconciler import session_payment_status
+from lib.stripe_client import stripe_client
+from lib.stripe_webhook import stripe_event_processor
 from lib.token_util import AccessTokenBearer
-from lib.config import DOMAIN, STRIPE_API_KEY, STRIPE_PRICE_ID
-from . import cache
+from lib.config import (
+    DOMAIN,
+    STRIPE_PRICE_ID,
+    STRIPE_CHECKOUT_EXPIRE_S,
+    STRIPE_CHECKOUT_REUSE_MIN_TTL_S,
+    STRIPE_WEBHOOK_SECRET,
+    PAYMENT_HISTORY_MAX_LIMIT,
+)
 
 logger = logging.getLogger("uvicorn.error")
-logger.setLevel(logging.DEBUG)
 
+stripe = lazy_import("stripe")
 router = APIRouter()
 access_token_scheme = AccessTokenBearer()
-stripe.api_key = STRIPE_API_KEY
-
-
-async def cache_payment(payment: Payment):
-    await cache.set(f"pay_{payment.id}", payment)
-
-
-async def get_payment_cached(id: int) -> Optional[Payment]:
-    payment = await cache.get(f"pay_{id}")
-    if not payment:
-        logger.warning(f"Payment {id} is not cached!")
-        payment = Payment.get(id=id)
-
-    return payment
 
 
 @router.get("/stripe/create")
@@ -38,6 +37,18 @@ async def create(
         _req: Request,
         user: User = Depends(access_token_scheme),
 ):
+    open_payment = Payment.find_open(
+        user_id=user.id,
+        quantity=quantity,
+        min_ttl_s=STRIPE_CHECKOUT_REUSE_MIN_TTL_S,
+    )
+    if open_payment:
+        logger.info(
+            "[payment id: %s] Reuse checkout session: %s",
+            open_payment.id, open_payment.session_id,
+        )
+        return RedirectResponse(open_payment.session_url)
+
     payment = Payment.create(
         user_id=user.id,
         quantity=quantity
@@ -45,33 +56,40 @@ async def create(
     checkout_session = None
 
     try:
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = await stripe_client.create_checkout_session(
             line_items=[{
                 "price": f"{STRIPE_PRICE_ID}",
                 "quantity": quantity,
             }],
             mode="payment",
             customer_email=user.name,
+            client_reference_id=str(payment.id),
             success_url=f"{DOMAIN}/payment/stripe/succes?id={payment.id}",
             cancel_url=(
                 f"{DOMAIN}/payment/stripe/fail?id={payment.id}"
                 f"&status={Status.CANCELED.value}"
             ),
             automatic_tax={"enabled": True},
+            expires_at=int(time.time()) + STRIPE_CHECKOUT_EXPIRE_S,
         )
-    except stripe.StripeError as e:
+    except stripe.error.StripeError as e:
         logger.error(
-            f"Failed to create checkout session due to StripeError: {e}"
+            "Failed to create checkout session due to StripeError: %s",
+            e,
         )
+    except asyncio.TimeoutError:
+        logger.error("Failed to create checkout session due to timeout")
     except Exception as e:
-        logger.error(
-            f"Failed to create checkout session due to unknown: {e}"
-        )
+        logger.error("Failed to create checkout session due to unknown: %s", e)
     if checkout_session:
-        await cache_payment(payment)
+        payment.set_checkout_session(
+            session_id=checkout_session.id,
+            session_url=checkout_session.url,
+            session_expire_at=checkout_session.expires_at,
+        )
         logger.info(
-            f"[payment id: {payment.id}] "
-            f"Redirecto to url: {checkout_session.url}"
+            "[payment id: %s] Redirecto to url: %s",
+            payment.id, checkout_session.url,
         )
         return RedirectResponse(checkout_session.url)
     return RedirectResponse(
@@ -82,30 +100,38 @@ async def create(
 
 @router.get("/stripe/succes")
 async def succes(
-    id: str,
+    id: int,
     _req: Request,
     user: User = Depends(access_token_scheme),
 ):
-    payment = await get_payment_cached(id)
+    payment = Payment.get(id)
     if not payment:
-        logger.error(f"Can not find the cached payment with id: {id}")
+        logger.error("Can not find the payment with id: %s", id)
         return RedirectResponse(
-            f"{DOMAIN}/payment/stripe/fail?id={payment.id}"
+            f"{DOMAIN}/payment/stripe/fail?id={id}"
             f"&status={Status.FAILED.value}"
         )
     if (user.id != payment.user_id):
         logger.warn(
-            "payee is not current user!!! "
-            f"current login user is: {user.id} but payee is: {payment.user_id}"
+            "payee is not current user!!! current "
+            "login user is: %s but payee is: %s",
+            user.id, payment.user_id,
+        )
+    # The webhook is the source of truth: only settle a PENDING payment
+    # here once Stripe says it is paid, and never credit twice.
+    if (
+        payment.status == Status.PENDING
+        and payment.session_id
+        and await session_status(payment) == Status.SUCCESS
+        and payment.settle_status(Status.SUCCESS)
+    ):
+        old_credit = user.credit
+        user.credit += payment.quantity
+        logger.info(
+            "[Cha-ching!!] Payment(%s) success for user: %s. "
+            "Updated user credit from: %s to %s.",
+            id, user.name, old_credit, user.credit,
         )
-    payment.set_status(Status.SUCCESS)
-    old_credit = user.credit
-    user.set_credit(user.credit + payment.quantity)
-    logger.info(
-        f"[Cha-ching!!] "
-        f"Payment({id}) success for user: {user.name}. "
-        f"Updated user credit from: {old_credit} to {user.credit}."
-    )
     return RedirectResponse(
         f"{DOMAIN}?payment={payment.simple_json()}"
     )
@@ -113,15 +139,128 @@ async def succes(
 
 @router.get("/stripe/fail")
 async def fail(
-    id: str,
+    id: int,
     status: int,
     _req: Request,
     user: User = Depends(access_token_scheme),
 ):
-    payment = await get_payment_cached(id)
-    if payment:
-        payment.status = Status(status)
-    logger.info(f"User: {user} attempt to pay and canceled.")
+    if status not in (Status.CANCELED.value, Status.FAILED.value):
+        raise UserFaceException(
+            status_code=HTTP_BAD_REQUEST,
+            detail=f"Invalid payment status: {status}",
+        )
+    payment = Payment.get(id)
+    if not payment:
+        logger.error("Can not find the payment with id: %s", id)
+        # Not back to this page, that would loop.
+        return RedirectResponse(DOMAIN)
+    if user.id != payment.user_id:
+        logger.warning(
+            "User: %s attempt to fail the payment: %s of user: %s.",
+            user.id, id, payment.user_id,
+        )
+    elif payment.status == Status.PENDING and await expire_session(payment):
+        payment.settle_status(Status(status))
+    logger.info("User: %s attempt to pay and canceled.", user)
     return RedirectResponse(
         f"{DOMAIN}?payment={payment.simple_json()}"
     )
+
+
+async def session_status(payment: Payment) -> Optional[Status]:
+    """
+    Final status of the payment's checkout session, None while open or
+    when Stripe can not be reached.
+    """
+    try:
+        session = await stripe_client.retrieve_checkout_session(
+            payment.session_id
+        )
+    except Exception as e:
+        logger.error(
+            "[payment id: %s] Failed to retrieve checkout session: %s "
+            "due to: %r", payment.id, payment.session_id, e,
+        )
+        return None
+    return session_payment_status(session)
+
+
+async def expire_session(payment: Payment) -> bool:
+    """
+    Expire the payment's checkout session, if any, so it can no longer be
+    paid once the payment is settled as failed. False if it could not be,
+    e.g. it was paid meanwhile: the webhook will settle it.
+    """
+    if not payment.session_id:
+        return True
+    try:
+        await stripe_client.expire_checkout_session(payment.session_id)
+    except Exception as e:
+        logger.info(
+            "[payment id: %s] Failed to expire checkout session: %s "
+            "due to: %r", payment.id, payment.session_id, e,
+        )
+        return False
+    return True
+
+
+@router.post("/stripe/webhook")
+async def webhook(req: Request):
+    """
+    Stripe webhook. Verify the signature, store the event once per event id
+    and hand it to the background processor, see lib/stripe_webhook.py.
+    """
+    payload = await req.body()
+    try:
+        event = stripe.Webhook.construct_event(
+            payload,
+            req.headers.get("stripe-signature"),
+            STRIPE_WEBHOOK_SECRET,
+        )
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        logger.error("Rejected Stripe webhook due to: %s", e)
+        raise PaymentException("Invalid Stripe event.") from e
+
+    stripe_event = StripeEvent(
+        id=event["id"],
+        type=event["type"],
+        payload=payload.decode("utf-8"),
+        create_at=event["created"],
+    )
+    if stripe_event.save_if_new():
+        stripe_event_processor.submit(stripe_event)
+    else:
+        logger.info("Skipped duplicated Stripe event: %s", stripe_event.id)
+    return {"received": True}
+
+
+@router.get("/history")
+async def history(
+    limit: int = Query(default=20, gt=0, le=PAYMENT_HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    user: User = Depends(access_token_scheme),
+):
+    """
+    The user's payments, newest first.
+    - cursor: 'next_cursor' of the previous page, omit for the first page.
+    """
+    before = None
+    if cursor:
+        try:
+            create_at, id = cursor.split("_")
+            before = (int(create_at), int(id))
+        except ValueError as e:
+            raise UserFaceException(
+                status_code=HTTP_BAD_REQUEST,
+                detail=f"Invalid cursor: {cursor}",
+            ) from e
+
+    payments = Payment.list_by_user(user.id, limit, before)
+    next_cursor = None
+    if len(payments) == limit:
+        last = payments[-1]
+        next_cursor = f"{last.create_at}_{last.id}"
+    return {
+        "payments": [p.simple_dict() for p in payments],
+        "next_cursor": next_cursor,
+    }
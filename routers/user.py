@@ -1,35 +1,65 @@
 import logging
 import uuid
-import google_auth_oauthlib.flow
 
 from . import cache
 from auth.google_open_id import GoogleOpenIdClient
-from fastapi import APIRouter, Request, Depends
-from fastapi.responses import RedirectResponse
-from lib.config import GOOGLE_CLIENT_SECRETS_FILE, GOOGLE_SCOPES, DOMAIN
-from lib.const import USER_NAME_COOKIE_KEY
+from fastapi import APIRouter, Request, Response, Depends, Body
+from fastapi.security.utils import get_authorization_scheme_param
+from fastapi.responses import RedirectResponse, JSONResponse
+from lib.api_key_index import api_key_index
+from lib.blocking_detector import blocking_detector
+from lib.lazy_import import lazy_import
+from lib.sql_profiler import sql_profiler
+from lib.etag import user_etag, not_modified, not_modified_response, set_etag
+from lib.config import (
+    ADMIN_EMAILS,
+    GOOGLE_CLIENT_SECRETS_FILE,
+    GOOGLE_SCOPES,
+    DOMAIN,
+    API_KEY_DEFAULT_RATE_LIMIT,
+    API_KEY_MAX_RATE_LIMIT,
+)
+from lib.const import (
+    COOKIE_TOKEN_KEY,
+    USER_NAME_COOKIE_KEY,
+    REFRESH_COOKIE_KEY,
+)
+from models.api_key import ApiKey, Scope
+from models.session import RefreshSession
 from models.user import User
-from typing import Optional
+from typing import Optional, List
 
 from lib.exception import (
+    HTTP_BAD_REQUEST,
+    ResourceNotFoundException,
     UserAuthorizationException,
+    UserAuthorizationExpiredException,
+    UserFaceException,
+    UserForbiddenException,
 )
 from lib.token_util import (
+    AdminTokenBearer,
     AuthTokenBearer,
     AuthToken,
     AccessToken,
     AccessTokenBearer,
     set_cookie_token,
     delete_cookie_token,
+    set_cookie_refresh_token,
+    delete_cookie_refresh_token,
+    refresh_access_token,
+    revoke_token,
 )
+from lib.tracing import span
 
 
 auth_token_scheme = AuthTokenBearer()
 access_token_scheme = AccessTokenBearer()
+admin_token_scheme = AdminTokenBearer()
 
 logger = logging.getLogger("uvicorn.error")
-logger.setLevel(logging.DEBUG)
 router = APIRouter()
+oauth_flow = lazy_import("google_auth_oauthlib.flow")
 
 
 @router.get("/login-redirect")
@@ -40,12 +70,12 @@ async def login_redirect():
     - pass callback url and wait for callback.
     """
     auth_uuid = uuid.uuid4().hex
-    flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
+    flow = oauth_flow.Flow.from_client_secrets_file(
         GOOGLE_CLIENT_SECRETS_FILE,
         scopes=GOOGLE_SCOPES,
     )
     flow.redirect_uri = f"{DOMAIN}/user/oauth2-callback"
-    logger.debug(f"flow.redirect_uri={flow.redirect_uri}")
+    logger.debug("flow.redirect_uri=%s", flow.redirect_uri)
 
     auth_url: str
     state: str
@@ -55,8 +85,10 @@ async def login_redirect():
     )
     await cache.set(state, auth_uuid)
     logger.debug(
-        f"Redirect to url: {auth_url} with "
-        f"auth uuid: {auth_uuid} and state: {state}"
+        "Redirect to url: %s with auth uuid: %s and state: %s",
+        auth_url,
+        auth_uuid,
+        state,
     )
     return RedirectResponse(auth_url)
 
@@ -80,14 +112,14 @@ async def oauth2callback(state: str, code: str, req: Request):
 
     if not auth_uuid:
         logger.error(
-            f"Can't find auth status: {state} "
-            f"from cache: {cache._cache}"
+            "Can't find auth status: %s from cache: %s",
+            state, cache._cache,
         )
         raise UserAuthorizationException()
 
     # Specify the state when creating the flow in the callback so that it can
     # verified in the authorization server response.
-    flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
+    flow = oauth_flow.Flow.from_client_secrets_file(
         GOOGLE_CLIENT_SECRETS_FILE,
         scopes=GOOGLE_SCOPES,
         state=state,
@@ -95,21 +127,23 @@ async def oauth2callback(state: str, code: str, req: Request):
     flow.redirect_uri = f"{DOMAIN}/user/oauth2-callback"
     try:
         logger.debug(
-            f"fetch token req.url={req.url} and "
-            f"flow.redirect_uri={flow.redirect_uri}"
+            "fetch token req.url=%s and flow.redirect_uri=%s",
+            req.url,
+            flow.redirect_uri,
         )
-        flow.fetch_token(code=code)
+        with span("google.fetch_token"):
+            flow.fetch_token(code=code)
     except Exception as e:
-        logger.error(f"Fetch token failed with error: \n{e}")
+        logger.error("Fetch token failed with error: \n%s", e)
         raise UserAuthorizationException() from e
 
     # flow.credentials is google.oauth2.credentials.Credentials
     email = await GoogleOpenIdClient(flow.credentials).get_user_email()
-    logger.debug(f"Got user email: {email} from Google.")
+    logger.debug("Got user email: %s from Google.", email)
 
     user: Optional[User] = User.get_by_name(email)
     if not user:
-        logger.info(f"new user with email: {email}. Creating record.")
+        logger.info("new user with email: %s. Creating record.", email)
         user = User.new(email)
 
     user.set_credentials(flow.credentials)
@@ -124,13 +158,15 @@ async def oauth2callback(state: str, code: str, req: Request):
 async def login(user: User = Depends(auth_token_scheme)):
     """
     [3] Re-create user from auth_token, generate access
-    token and then set cookie's user statu and return.
+    token and refresh session, then set cookie's user statu and return.
     """
-    logger.debug(f"Login invoked with user.name={user.name}")
+    logger.debug("Login invoked with user.name=%s", user.name)
     rsp = RedirectResponse(url=DOMAIN)
 
     access_token = AccessToken(user.id)
     rsp = await set_cookie_token(rsp, access_token)
+    _session, refresh_token = RefreshSession.new(user.id)
+    rsp = set_cookie_refresh_token(rsp, refresh_token)
     rsp.set_cookie(
         key=USER_NAME_COOKIE_KEY,
         value=user.name,
@@ -140,16 +176,176 @@ async def login(user: User = Depends(auth_token_scheme)):
     return rsp
 
 
+@router.post("/refresh")
+async def refresh(req: Request):
+    """
+    Issue a new access token from the refresh session cookie, without
+    going through Google. Falls back to the Google login flow once the
+    refresh session is revoked or expired.
+    """
+    refresh_token = req.cookies.get(REFRESH_COOKIE_KEY)
+    access_token = None
+    if refresh_token:
+        access_token = await refresh_access_token(refresh_token)
+    if not access_token:
+        raise UserAuthorizationExpiredException()
+
+    rsp = JSONResponse({"expire_after": access_token.expire_after})
+    return await set_cookie_token(rsp, access_token)
+
+
 @router.get("/logout")
-async def logout(user: User = Depends(access_token_scheme)):
+async def logout(req: Request, user: User = Depends(access_token_scheme)):
+    _scheme, access_token = get_authorization_scheme_param(
+        req.cookies.get(COOKIE_TOKEN_KEY)
+    )
+    await revoke_token(access_token)
+    refresh_token = req.cookies.get(REFRESH_COOKIE_KEY)
+    if refresh_token:
+        session = RefreshSession.get(refresh_token)
+        if session:
+            session.revoke()
     rsp = RedirectResponse(url=DOMAIN)
     delete_cookie_token(rsp)
+    delete_cookie_refresh_token(rsp)
     rsp.delete_cookie(key=USER_NAME_COOKIE_KEY)
     return rsp
 
 
+@router.post("/api-key/create")
+async def create_api_key(
+    scopes: List[str] = Body(),
+    name: Optional[str] = Body(default=None),
+    rate_limit: int = Body(default=API_KEY_DEFAULT_RATE_LIMIT),
+    user: User = Depends(access_token_scheme),
+):
+    """
+    Create an API key for programmatic clients. The key is only returned
+    by this call, keep it safe. Use it as `Authorization: Bearer <key>`.
+
+    - scopes: routers the key can call, among "workflow", "openai"
+      and, for the admins, "worker".
+    - rate_limit: requests per minute.
+    """
+    try:
+        scope_set = {Scope(s) for s in scopes}
+    except ValueError as e:
+        raise UserFaceException(
+            status_code=HTTP_BAD_REQUEST,
+            detail=f"Unknown scope in: {scopes}",
+        ) from e
+    if not scope_set or not 0 < rate_limit <= API_KEY_MAX_RATE_LIMIT:
+        raise UserFaceException(
+            status_code=HTTP_BAD_REQUEST,
+            detail=(
+                "At least one scope and a rate_limit between 1 and "
+                f"{API_KEY_MAX_RATE_LIMIT} are expected."
+            ),
+        )
+    if Scope.WORKER in scope_set and user.name not in ADMIN_EMAILS:
+        logger.error("User: %s asked a worker key, not an admin.", user.name)
+        raise UserForbiddenException()
+
+    api_key, key = ApiKey.new(user.id, name, scope_set, rate_limit)
+    api_key_index.add(api_key)
+    logger.info("User: %s created api key: %s", user.name, api_key.id)
+    return {**api_key.simple_json(), "key": key}
+
+
+@router.get("/api-key/list")
+async def list_api_keys(user: User = Depends(access_token_scheme)):
+    return [k.simple_json() for k in ApiKey.list(user.id)]
+
+
+@router.post("/api-key/revoke")
+async def revoke_api_key(
+    id: int,
+    user: User = Depends(access_token_scheme),
+):
+    key_hash = ApiKey.revoke(id, user.id)
+    if not key_hash:
+        raise ResourceNotFoundException(f"Can not found api key with id {id}")
+    api_key_index.remove(key_hash)
+    logger.info("User: %s revoked api key: %s", user.name, id)
+
+
+@router.post("/admin/revoke-token")
+async def admin_revoke_token(
+    token: str = Body(embed=True),
+    admin: User = Depends(admin_token_scheme),
+):
+    """
+    Revoke one access token, e.g. a leaked one, until it expires.
+    """
+    revoked = await revoke_token(token)
+    logger.info("Admin: %s revoked token: %s", admin.name, revoked)
+    return {"revoked": revoked}
+
+
+@router.post("/admin/revoke-sessions")
+async def admin_revoke_sessions(
+    user_id: int,
+    admin: User = Depends(admin_token_scheme),
+):
+    """
+    Revoke all refresh sessions of a user, who has to log in with Google
+    again once the current access token expires.
+    """
+    RefreshSession.revoke_all(user_id)
+    logger.info("Admin: %s revoked sessions of user: %s", admin.name, user_id)
+
+
+@router.get("/admin/sql-profile")
+async def admin_sql_profile(
+    top: int = 20,
+    order: str = "total",
+    reset: bool = False,
+    admin: User = Depends(admin_token_scheme),
+):
+    """
+    The `top` SQL statements by "total", "p99", "count" or "max" time since
+    the start or the last `reset`, and the latest slow ones with their
+    query plan. Format it with scripts/sql_profile.py.
+    """
+    try:
+        report = sql_profiler.report(top, order)
+    except ValueError as e:
+        raise UserFaceException(
+            status_code=HTTP_BAD_REQUEST,
+            detail=str(e),
+        ) from e
+    if reset:
+        sql_profiler.reset()
+        logger.info("Admin: %s reset the SQL profile.", admin.name)
+    return report
+
+
+@router.get("/admin/blocking-calls")
+async def admin_blocking_calls(
+    reset: bool = False,
+    admin: User = Depends(admin_token_scheme),
+):
+    """
+    The call sites found blocking the event loop, with BLOCKING_DETECTOR_
+    ENABLED, since the start or the last `reset`.
+    """
+    report = blocking_detector.report()
+    if reset:
+        blocking_detector.reset()
+        logger.info("Admin: %s reset the blocking calls.", admin.name)
+    return report
+
+
 @router.get("/status")
-async def status(user: User = Depends(access_token_scheme)):
+async def status(
+    req: Request,
+    rsp: Response,
+    user: User = Depends(access_token_scheme),
+):
+    etag = user_etag(user.id)
+    if not_modified(req, etag):
+        return not_modified_response(etag)
+    set_etag(rsp, etag)
     return {
         "name": user.name,
         "credit": user.credit,
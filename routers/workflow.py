@@ -1,33 +1,142 @@
+import json
 import logging
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Body,
+    Header,
+    Request,
+    Response,
+)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from typing import List, Any, Mapping, Optional, Set, Tuple
 
-from lib.config import EMAIL
-from lib.exception import HTTP_INTERNAL_SERVER_ERROR, HTTP_BAD_REQUEST
-from lib.token_util import AccessTokenBearer
+from lib.config import (
+    EMAIL,
+    WORKFLOW_BULK_MAX_ITEMS,
+    WORKFLOW_FEED_MAX_ITEMS,
+    WORKFLOW_FEED_MAX_WAIT_S,
+    WORKFLOW_FEED_HEARTBEAT_S,
+    SCHEDULER_MAX_CLAIM,
+    SCHEDULER_MAX_PRIORITY,
+    WORKFLOW_SEARCH_MAX_LIMIT,
+    COMPRESSION_MIN_BYTES,
+)
+from lib.compression import compressed_cache, compressed_response, negotiate
+from lib.etag import user_etag, not_modified, not_modified_response, set_etag
+from lib.exception import (
+    HTTP_INTERNAL_SERVER_ERROR,
+    HTTP_BAD_REQUEST,
+    HTTP_NOT_FOUND,
+)
+from lib.token_util import AccessTokenBearer, AdminTokenBearer
+from lib.transcript_format import (
+    MEDIA_TYPES,
+    rendition_cache,
+    render,
+    source_format,
+)
+from lib.workflow_feed import workflow_feed
+from lib.workflow_scheduler import workflow_scheduler
+from models.api_key import Scope
+from models.resource import Format
+from models.transcript import Transcript
 from models.user import User
-from models.workflow import Workflow, WorkflowType, Args, WorkflowMetadata
+from models.workflow import (
+    Workflow,
+    WorkflowType,
+    Args,
+    WorkflowSummary,
+    SearchHit,
+)
 
 
 logger = logging.getLogger("uvicorn.error")
-logger.setLevel(logging.DEBUG)
 
 
 router = APIRouter()
-access_token_scheme = AccessTokenBearer()
+access_token_scheme = AccessTokenBearer(scope=Scope.WORKFLOW)
+worker_token_scheme = AdminTokenBearer(scope=Scope.WORKER)
+
+
+def workflow_type(type: int) -> WorkflowType:
+    try:
+        return WorkflowType(type)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=HTTP_BAD_REQUEST,
+            detail=f"Unknown workflow type: {type}",
+        ) from e
+
+
+def check_priority(priority: int) -> None:
+    if not 0 <= priority <= SCHEDULER_MAX_PRIORITY:
+        raise HTTPException(
+            status_code=HTTP_BAD_REQUEST,
+            detail=f"Expect a priority from 0 to {SCHEDULER_MAX_PRIORITY}.",
+        )
+
+
+def create_workflows(
+    user: User,
+    args_list: List[Args],
+    type: WorkflowType,
+    force: bool,
+    priority: int = 0,
+) -> List[Tuple[Workflow, bool]]:
+    """
+    Return (workflow, created) per args. Unless `force`, args matching a
+    live workflow of the user, or an earlier item, get that workflow
+    instead of a new one, with its own priority.
+    """
+    fingerprints = [args.fingerprint() for args in args_list]
+    found = {}
+    if not force:
+        found = Workflow.find_live(user.id, type, sorted(set(fingerprints)))
+    to_create: List[Args] = []
+    slots: List[Any] = []
+    for args, fingerprint in zip(args_list, fingerprints):
+        if fingerprint in found:
+            slots.append(found[fingerprint])
+            continue
+        if not force:
+            found[fingerprint] = len(to_create)
+        slots.append(len(to_create))
+        to_create.append(args)
+
+    created = []
+    if to_create:
+        created = Workflow.new_many(user, to_create, type, priority)
+    results = []
+    returned: Set[int] = set()
+    for slot in slots:
+        if isinstance(slot, Workflow):
+            results.append((slot, False))
+        else:
+            results.append((created[slot], slot not in returned))
+            returned.add(slot)
+    return results
 
 
 @router.post("/add", status_code=201)
 async def add(
     args: str,  # json args
     type: int,  # WorkflowType
+    force: bool = False,  # create even if a live duplicate exists
+    priority: int = 0,  # run first among the user's workflows if higher
     user: User = Depends(access_token_scheme),
 ):
+    check_priority(priority)
+    workflow_type_ = workflow_type(type)
     try:
         arg_obj = Args.from_json(args)
     except Exception as e:
         logger.exception(
-            f"Failed to parse args: {args} as json due to exp: {e}"
+            "Failed to parse args: %s as json due to exp: %s",
+            args, e,
         )
         raise HTTPException(
             status_code=HTTP_BAD_REQUEST,
@@ -35,38 +144,177 @@ async def add(
         ) from e
 
     try:
-        workflow = Workflow.new(user, arg_obj, type)
+        [(workflow, created)] = create_workflows(
+            user, [arg_obj], workflow_type_, force, priority
+        )
     except Exception as e:
-        logger.exception(f"create new workfow failed with the exp: {e}")
+        logger.exception("create new workfow failed with the exp: %s", e)
         raise HTTPException(
             status_code=HTTP_INTERNAL_SERVER_ERROR,
             detail=str(e)
         ) from e
-    logger.info(f"workflow: {workflow.id} created.")
+    if created:
+        logger.info("workflow: %s created.", workflow.id)
+        workflow_feed.notify(user.id)
 
-    return {"workflow_id": workflow.id}
+    return {"workflow_id": workflow.id, "created": created}
 
 
-@router.post("/list")
+@router.api_route("/list", methods=["GET", "POST"])
 async def list(
+    req: Request,
+    rsp: Response,
     type: int,
     user: User = Depends(access_token_scheme),
-) -> List[WorkflowMetadata]:
+) -> List[WorkflowSummary]:
+    """
+    List the user's workflows, with the available transcript formats but
+    not the transcripts, see `/{workflow_id}/transcript`.
+    With an `If-None-Match` of the ETag returned before, answer 304 when
+    nothing changed for the user, without listing.
+    Large lists are compressed as per `Accept-Encoding`, once per ETag.
+    """
+    etag = user_etag(user.id)
+    if not_modified(req, etag):
+        return not_modified_response(etag)
+    set_etag(rsp, etag)
+    rsp.headers["Vary"] = "Accept-Encoding"
+
+    encoding = negotiate(req.headers.get("Accept-Encoding"))
+    key = ("list", user.id, type, etag)
+    if encoding:
+        body = compressed_cache.get(key, encoding)
+        if body is not None:
+            return compressed_response(
+                body, encoding, "application/json", rsp.headers
+            )
+
     metadatas = []
     try:
-        metadatas = WorkflowMetadata.list(user.id, WorkflowType(type))
+        metadatas = WorkflowSummary.list(user.id, WorkflowType(type))
     except Exception as e:
-        logger.exception(f"Get workfows failed with the exp: {e} "
-                         f"for type: {type} and user: {user}")
+        logger.exception(
+            "Get workfows failed with the exp: %s for type: %s and user: %s",
+            e, type, user,
+        )
         raise HTTPException(
             status_code=HTTP_INTERNAL_SERVER_ERROR, detail=str(e)
         ) from e
 
     if len(metadatas) == 0:
-        logger.warning(f"Found no workflow for type: {type} and user: {user}")
+        logger.warning(
+            "Found no workflow for type: %s and user: %s",
+            type, user,
+        )
+    if encoding:
+        data = json.dumps(jsonable_encoder(metadatas)).encode()
+        if len(data) >= COMPRESSION_MIN_BYTES:
+            return compressed_response(
+                compressed_cache.compress(key, encoding, data),
+                encoding,
+                "application/json",
+                rsp.headers,
+            )
     return metadatas
 
 
+@router.get("/search")
+async def search(
+    q: str,
+    limit: int = 20,
+    offset: int = 0,
+    user: User = Depends(access_token_scheme),
+):
+    """
+    Find the user's videos whose transcript or snippet contains `q`, at
+    least 3 characters, most relevant first. Pass "next_offset" back as
+    `offset` for the next page, it is null on the last one.
+    """
+    if len(q.strip()) < 3:
+        raise HTTPException(
+            status_code=HTTP_BAD_REQUEST,
+            detail="Search at least 3 characters.",
+        )
+    if not 0 < limit <= WORKFLOW_SEARCH_MAX_LIMIT or offset < 0:
+        raise HTTPException(
+            status_code=HTTP_BAD_REQUEST,
+            detail=f"Expect limit from 1 to {WORKFLOW_SEARCH_MAX_LIMIT}.",
+        )
+    try:
+        # One more to know if there is a next page.
+        hits = SearchHit.search(user.id, q.strip(), limit + 1, offset)
+    except Exception as e:
+        logger.exception("Search failed with the exp: %s for: %s", e, user)
+        raise HTTPException(
+            status_code=HTTP_INTERNAL_SERVER_ERROR, detail=str(e)
+        ) from e
+    return {
+        "results": hits[:limit],
+        "next_offset": offset + limit if len(hits) > limit else None,
+    }
+
+
+@router.get("/{workflow_id}/transcript")
+async def transcript(
+    req: Request,
+    workflow_id: int,
+    fmt: Format = Format.SRT,
+    user: User = Depends(access_token_scheme),
+):
+    """
+    Download the transcript of a workflow as `fmt`, converted from the
+    stored transcript on first request then served from cache until the
+    video changes. Compressed as per `Accept-Encoding`, the compressed
+    copy is cached too.
+    """
+    version = WorkflowSummary.get_version(workflow_id, user.id)
+    if version is None:
+        raise HTTPException(
+            status_code=HTTP_NOT_FOUND,
+            detail=f"Can not find workflow with id {workflow_id}.",
+        )
+    key = (workflow_id, version, fmt)
+    headers = {
+        "Content-Disposition":
+            f'attachment; filename="{workflow_id}.{fmt.value}"',
+        "Vary": "Accept-Encoding",
+    }
+    encoding = negotiate(req.headers.get("Accept-Encoding"))
+    if encoding:
+        body = compressed_cache.get(key, encoding)
+        if body is not None:
+            return compressed_response(
+                body, encoding, MEDIA_TYPES[fmt], headers
+            )
+
+    def make():
+        # Only the one stored format rendered from is loaded.
+        sizes = Transcript.sizes([workflow_id]).get(workflow_id, {})
+        source = source_format([f for f, n in sizes.items() if n], fmt)
+        content = Transcript.get(workflow_id, source) if source else None
+        return render({source: content} if content else {}, fmt)
+
+    try:
+        chunks: Any = rendition_cache.stream(key, make)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=HTTP_NOT_FOUND,
+            detail=f"Workflow {workflow_id} has no transcript yet.",
+        ) from e
+    if encoding:
+        chunks = compressed_cache.stream(key, encoding, chunks)
+        headers["Content-Encoding"] = encoding
+
+    async def body():
+        # On the loop, like the sqlite reads; chunks are small.
+        for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(
+        body(), media_type=MEDIA_TYPES[fmt], headers=headers
+    )
+
+
 @router.post("/delete")
 async def delete(
     workflow_ids: List[int],
@@ -74,6 +322,7 @@ async def delete(
 ) -> None:
     try:
         Workflow.delete(workflow_ids, user.id)
+        workflow_feed.notify(user.id)
     except Exception as e:
         error_msg = (
             f"Failed to delete workflow: {workflow_ids} for"
@@ -88,20 +337,283 @@ async def delete(
 @router.post("/retry")
 async def retry(
         workflow_id: int,
+        force: bool = False,
         user: User = Depends(access_token_scheme),
 ) -> None:
-    workflow = Workflow.get(workflow_id)
+    workflow = Workflow.get_many([workflow_id], user.id).get(workflow_id)
     if not workflow:
         raise HTTPException(
             status_code=HTTP_BAD_REQUEST,
             detail=(
-                f"Can not find workflow with id {id}. "
+                f"Can not find workflow with id {workflow_id}. "
                 f"Please reach out to {EMAIL} for helps."
             )
         )
-    retry_workflow = Workflow.new(
+    [(retry_workflow, created)] = create_workflows(
         user=user,
-        args=workflow.args,
-        type=workflow.type
+        args_list=[workflow.args],
+        type=workflow.type,
+        force=force,
+    )
+    if created:
+        workflow_feed.notify(user.id)
+    return {"workflow_id": retry_workflow.id, "created": created}
+
+
+def check_bulk_size(items: List[Any]) -> None:
+    if not 0 < len(items) <= WORKFLOW_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=HTTP_BAD_REQUEST,
+            detail=(
+                f"Expect 1 to {WORKFLOW_BULK_MAX_ITEMS} items, "
+                f"got {len(items)}."
+            )
+        )
+
+
+@router.post("/bulk/add", status_code=201)
+async def bulk_add(
+    type: int,  # WorkflowType
+    args_list: List[Mapping[str, Any]] = Body(),
+    force: bool = False,
+    priority: int = 0,
+    user: User = Depends(access_token_scheme),
+):
+    """
+    Create one workflow per `Args` of the json array body, in one
+    transaction. Invalid items are reported and skipped, the others are
+    created unless they duplicate a live workflow or an earlier item, see
+    `create_workflows`. Results are per item, in the body order.
+    """
+    check_bulk_size(args_list)
+    check_priority(priority)
+    workflow_type_ = workflow_type(type)
+    results: List[Mapping[str, Any]] = [{} for _ in args_list]
+    valid: List[Args] = []
+    valid_index: List[int] = []
+    for i, raw in enumerate(args_list):
+        try:
+            valid.append(Args.model_validate(raw))
+            valid_index.append(i)
+        except ValidationError as e:
+            results[i] = {
+                "index": i,
+                "error": e.errors(include_url=False, include_context=False),
+            }
+
+    try:
+        workflows = create_workflows(
+            user, valid, workflow_type_, force, priority
+        )
+    except Exception as e:
+        logger.exception("create workfows failed with the exp: %s", e)
+        raise HTTPException(
+            status_code=HTTP_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        ) from e
+    for i, (workflow, created) in zip(valid_index, workflows):
+        results[i] = {
+            "index": i, "workflow_id": workflow.id, "created": created
+        }
+    created_count = sum(created for _, created in workflows)
+    logger.info("%s workflows created for user: %s", created_count, user.id)
+    workflow_feed.notify(user.id)
+    return {"results": results}
+
+
+@router.post("/bulk/delete")
+async def bulk_delete(
+    workflow_ids: List[int],
+    user: User = Depends(access_token_scheme),
+):
+    check_bulk_size(workflow_ids)
+    try:
+        deleted = Workflow.delete(workflow_ids, user.id)
+    except Exception as e:
+        logger.exception("Failed to delete workflows due to error: %s", e)
+        raise HTTPException(
+            status_code=HTTP_INTERNAL_SERVER_ERROR, detail=str(e)
+        ) from e
+    workflow_feed.notify(user.id)
+    return {
+        "results": [
+            {"workflow_id": id, "deleted": id in deleted}
+            for id in workflow_ids
+        ]
+    }
+
+
+@router.post("/bulk/retry")
+async def bulk_retry(
+    workflow_ids: List[int],
+    force: bool = False,
+    user: User = Depends(access_token_scheme),
+):
+    """
+    Create a new workflow from the args of each of the user's workflows,
+    unless a live one with the same args exists, see `create_workflows`.
+    """
+    check_bulk_size(workflow_ids)
+    retried_by_id = {}
+    try:
+        found = Workflow.get_many(workflow_ids, user.id)
+        for type in {w.type for w in found.values()}:
+            ids = [id for id, w in found.items() if w.type == type]
+            retried = create_workflows(
+                user, [found[id].args for id in ids], type, force
+            )
+            retried_by_id.update(zip(ids, retried))
+    except Exception as e:
+        logger.exception("Failed to retry workflows due to error: %s", e)
+        raise HTTPException(
+            status_code=HTTP_INTERNAL_SERVER_ERROR, detail=str(e)
+        ) from e
+    workflow_feed.notify(user.id)
+
+    results = []
+    for id in workflow_ids:
+        if id in retried_by_id:
+            retry_workflow, created = retried_by_id[id]
+            results.append({
+                "workflow_id": id,
+                "retry_id": retry_workflow.id,
+                "created": created,
+            })
+        else:
+            results.append({"workflow_id": id, "error": "Not found."})
+    return {"results": results}
+
+
+def changes_since(
+    user_id: int,
+    type: WorkflowType,
+    since: int,
+    version: int,
+) -> Mapping[str, Any]:
+    """
+    The user's workflows changed after `since`. `version` is the user
+    version read before, the client sends the returned "version" back as
+    `since` next time. With "more" there are more changes to fetch now.
+    """
+    metadatas = WorkflowSummary.list_changed(
+        user_id, type, since, WORKFLOW_FEED_MAX_ITEMS
+    )
+    more = len(metadatas) == WORKFLOW_FEED_MAX_ITEMS
+    if more:
+        version = metadatas[-1].version
+    elif metadatas:
+        # Changes committed after `version` was read are in the list.
+        version = max(version, metadatas[-1].version)
+    return {"version": version, "more": more, "workflows": metadatas}
+
+
+@router.get("/changes")
+async def changes(
+    type: int,
+    since: int = 0,
+    timeout: float = WORKFLOW_FEED_MAX_WAIT_S,
+    user: User = Depends(access_token_scheme),
+):
+    """
+    Long-poll: return the workflows changed since version `since`, waiting
+    up to `timeout` seconds for a change if there is none yet. `since=0`
+    returns all of them, deleted ones included.
+    """
+    timeout = min(max(timeout, 0), WORKFLOW_FEED_MAX_WAIT_S)
+    workflow_type_ = workflow_type(type)
+    try:
+        version = await workflow_feed.wait(user.id, since, timeout)
+        if version <= since:
+            return {"version": since, "more": False, "workflows": []}
+        return changes_since(user.id, workflow_type_, since, version)
+    except Exception as e:
+        logger.exception(
+            "Get workflow changes failed with the "
+            "exp: %s for type: %s and user: %s",
+            e, type, user,
+        )
+        raise HTTPException(
+            status_code=HTTP_INTERNAL_SERVER_ERROR, detail=str(e)
+        ) from e
+
+
+@router.get("/changes/stream")
+async def changes_stream(
+    req: Request,
+    type: int,
+    since: int = 0,
+    last_event_id: Optional[str] = Header(None),
+    user: User = Depends(access_token_scheme),
+):
+    """
+    Server-sent events: one 'workflows' event, with the `changes` payload,
+    per batch of changes. The event id is the version, so a reconnecting
+    EventSource resumes from it through the Last-Event-ID header.
+    """
+    if last_event_id and last_event_id.isdigit():
+        since = max(since, int(last_event_id))
+    workflow_type_ = workflow_type(type)
+
+    async def events():
+        version = since
+        while not await req.is_disconnected():
+            try:
+                current = await workflow_feed.wait(
+                    user.id, version, WORKFLOW_FEED_HEARTBEAT_S
+                )
+                if current <= version:
+                    # Keep the proxies from closing an idle connection.
+                    yield ": keep-alive\n\n"
+                    continue
+                payload = changes_since(
+                    user.id, workflow_type_, version, current
+                )
+            except Exception as e:
+                logger.exception(
+                    "Stream workflow changes failed "
+                    "with the exp: %s for user: %s",
+                    e, user,
+                )
+                return
+            version = payload["version"]
+            data = json.dumps({
+                **payload,
+                "workflows": [m.model_dump() for m in payload["workflows"]],
+            })
+            yield f"id: {version}\nevent: workflows\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/claim")
+async def claim(
+    limit: int = 1,
+    worker: User = Depends(worker_token_scheme),
+) -> List[Workflow]:
+    """
+    For the workers: claim up to `limit` TODO workflows, in fair order
+    across users, see `WorkflowScheduler`. They are CLAIMED on return.
+    """
+    if not 0 < limit <= SCHEDULER_MAX_CLAIM:
+        raise HTTPException(
+            status_code=HTTP_BAD_REQUEST,
+            detail=f"Expect limit from 1 to {SCHEDULER_MAX_CLAIM}.",
+        )
+    try:
+        workflows = workflow_scheduler.claim(limit)
+    except Exception as e:
+        logger.exception("Failed to claim workflows due to error: %s", e)
+        raise HTTPException(
+            status_code=HTTP_INTERNAL_SERVER_ERROR, detail=str(e)
+        ) from e
+    for workflow in workflows:
+        workflow_feed.notify(workflow.user_id)
+    logger.info(
+        "Worker: %s claimed workflows: %s",
+        worker.name, [w.id for w in workflows],
     )
-    return {"workflow_id": retry_workflow.id}
+    return workflows
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Fill the fingerprint of the workflows created before it existed, see
+scripts/migrations/009_workflow_fingerprint.sql. Safe to run again:
+$python3 -m scripts.backfill_workflow_fingerprint
+"""
+
+import argparse
+import logging
+
+from lib.sqlite_connection_manager import SQLiteConnectionManager
+from models.workflow import Args
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="workflows updated per transaction",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    sqlite = SQLiteConnectionManager()
+    total = 0
+    while True:
+        with sqlite.connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                SELECT id, args FROM workflow
+                WHERE fingerprint IS NULL
+                ORDER BY id
+                LIMIT ?
+                """,
+                (args.batch_size,)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany(
+                "UPDATE workflow SET fingerprint = ? WHERE id = ?",
+                [(Args.from_json(a).fingerprint(), id) for id, a in rows]
+            )
+            connection.commit()
+        total += len(rows)
+    print(f"Backfilled {total} workflows.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark the startup: the time of `import app` in fresh interpreters,
+less the interpreter's own startup, relative to importing the lazily
+imported SDKs on their own on the same host, so that the baseline holds
+across machines. The runs alternate both and the median ratio is kept.
+With --check, exit 1 when the ratio is over the baseline plus its
+tolerance, or when a lazily imported SDK is imported at startup again;
+--update records the baseline, to do in the change that moves startup.
+$python3 -m scripts.bench_startup --check
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from typing import List, Tuple
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(ROOT, "scripts", "startup_baseline.json")
+
+# Imported on first use, see lib/lazy_import.py.
+LAZY_MODULES = (
+    "aiohttp",
+    "google.oauth2.credentials",
+    "google_auth_oauthlib",
+    "oauthlib.oauth2",
+    "requests",
+    "stripe",
+)
+
+REFERENCE_SNIPPET = f"import {', '.join(LAZY_MODULES)}"
+
+CHECK_LAZY_SNIPPET = f"""
+import sys
+import app
+print(",".join(m for m in {LAZY_MODULES!r} if m in sys.modules))
+"""
+
+
+def run_ms(code: str) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def bench(runs: int) -> Tuple[float, float, float]:
+    """
+    Return the median `import app` ms, reference ms and ratio of both.
+    """
+    # Warm up the file system cache and the bytecode.
+    run_ms("import app")
+    run_ms(REFERENCE_SNIPPET)
+    app_ms: List[float] = []
+    reference_ms: List[float] = []
+    ratios: List[float] = []
+    for _ in range(runs):
+        base = run_ms("pass")
+        app_ms.append(run_ms("import app") - base)
+        reference_ms.append(run_ms(REFERENCE_SNIPPET) - base)
+        ratios.append(app_ms[-1] / reference_ms[-1])
+    return (
+        statistics.median(app_ms),
+        statistics.median(reference_ms),
+        statistics.median(ratios),
+    )
+
+
+def eager_lazy_modules() -> List[str]:
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK_LAZY_SNIPPET],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return [m for m in result.stdout.strip().split(",") if m]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("-r", "--runs", type=int, default=15)
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument(
+        "--tolerance", type=float, default=None,
+        help="allowed slowdown over the baseline, 0.25 for 25%%",
+    )
+    args = parser.parse_args()
+
+    ms, reference_ms, ratio = bench(args.runs)
+    print(f"import app: {ms:.1f} ms, reference: {reference_ms:.1f} ms, "
+          f"ratio: {ratio:.3f} (median of {args.runs})")
+
+    baseline = {"import_app_ratio": None, "tolerance": 0.25}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline.update(json.load(f))
+    if args.tolerance is not None:
+        baseline["tolerance"] = args.tolerance
+
+    if args.update:
+        baseline["import_app_ratio"] = round(ratio, 3)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baseline, f, indent=4)
+            f.write("\n")
+        print(f"Updated {BASELINE_FILE}")
+
+    if args.check:
+        failures = []
+        eager = eager_lazy_modules()
+        if eager:
+            failures.append(f"imported at startup: {', '.join(eager)}")
+        if baseline["import_app_ratio"]:
+            limit = baseline["import_app_ratio"] * (1 + baseline["tolerance"])
+            print(f"baseline: {baseline['import_app_ratio']}, "
+                  f"limit: {limit:.3f}")
+            if ratio > limit:
+                failures.append(
+                    f"ratio {ratio:.3f} over the {limit:.3f} limit"
+                )
+        if failures:
+            print(f"Startup regressed: {'; '.join(failures)}")
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Archive the deleted and old workflows and vacuum the DB once, as the proxy
+does every ARCHIVE_INTERVAL_S:
+$python3 -m scripts.compact_db
+"""
+
+import argparse
+import asyncio
+import logging
+
+from lib.db_compactor import db_compactor
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(db_compactor.run())
+    print(dict(report))
+
+
+if __name__ == "__main__":
+    main()
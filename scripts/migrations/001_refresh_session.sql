@@ -0,0 +1,12 @@
+-- Server side refresh records backing the sliding session, see
+-- models/session.py.
+CREATE TABLE IF NOT EXISTS refresh_session (
+    -- sha256 hex digest of the refresh token kept in the user's cookie.
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    create_at INTEGER NOT NULL,
+    expire_at INTEGER NOT NULL,
+    revoked INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS refresh_session_user_id
+    ON refresh_session (user_id);
@@ -0,0 +1,12 @@
+-- Revoked JWTs by 'jti' claim, see models/revoked_token.py.
+CREATE TABLE IF NOT EXISTS token_revocation (
+    -- AUTOINCREMENT so ids are never reused after purges, processes sync
+    -- new revocations with 'id > last seen id'.
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jti TEXT NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL,
+    -- The token 'exp', the row is useless afterwards.
+    expire_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS token_revocation_expire_at
+    ON token_revocation (expire_at);
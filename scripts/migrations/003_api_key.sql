@@ -0,0 +1,17 @@
+-- Per user API keys, see models/api_key.py. Only the key hash is stored.
+CREATE TABLE IF NOT EXISTS api_key (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    name TEXT,
+    -- First characters of the key, to tell keys apart in listings.
+    prefix TEXT NOT NULL,
+    -- sha256 hex digest of the key.
+    key_hash TEXT NOT NULL UNIQUE,
+    -- json list of `models.api_key.Scope` values.
+    scopes TEXT NOT NULL,
+    -- requests per minute.
+    rate_limit INTEGER NOT NULL,
+    create_at INTEGER NOT NULL,
+    revoked INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS api_key_user_id ON api_key (user_id);
@@ -0,0 +1,7 @@
+-- Remember the Stripe checkout session of a payment, so an open session is
+-- reused instead of created again, see models/payment.py.
+ALTER TABLE payment ADD COLUMN session_id TEXT;
+ALTER TABLE payment ADD COLUMN session_url TEXT;
+ALTER TABLE payment ADD COLUMN session_expire_at INTEGER;
+CREATE INDEX IF NOT EXISTS payment_user_status_quantity
+    ON payment (user_id, status, quantity);
@@ -0,0 +1,15 @@
+-- Stripe webhook events, stored once per event id, see
+-- models/stripe_event.py.
+CREATE TABLE IF NOT EXISTS stripe_event (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    create_at INTEGER NOT NULL,
+    -- 1: pending 2: done 3: failed 4: ignored
+    status INTEGER NOT NULL DEFAULT 1,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    processed_at INTEGER
+);
+CREATE INDEX IF NOT EXISTS stripe_event_status ON stripe_event (status);
+-- Events without client_reference_id are matched by checkout session.
+CREATE INDEX IF NOT EXISTS payment_session_id ON payment (session_id);
@@ -0,0 +1,3 @@
+-- Paginated payment history per user, see Payment.list_by_user.
+CREATE INDEX IF NOT EXISTS payment_user_create_at
+    ON payment (user_id, create_at);
@@ -0,0 +1,8 @@
+-- Progress of resumable background jobs, see models/job_checkpoint.py.
+CREATE TABLE IF NOT EXISTS job_checkpoint (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    update_at INTEGER NOT NULL
+);
+-- Page through the payments of one status by id.
+CREATE INDEX IF NOT EXISTS payment_status ON payment (status);
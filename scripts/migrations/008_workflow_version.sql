@@ -0,0 +1,60 @@
+-- Per user change counter for the workflow change feed, see
+-- lib/workflow_feed.py. Triggers keep it current whoever writes: this
+-- proxy or the workers.
+CREATE TABLE IF NOT EXISTS user_version (
+    user_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+-- The user version of the last change of the workflow or its video.
+ALTER TABLE workflow ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS workflow_user_version
+    ON workflow (user_id, version);
+
+CREATE TRIGGER IF NOT EXISTS workflow_version_insert
+AFTER INSERT ON workflow
+BEGIN
+    INSERT INTO user_version (user_id, version) VALUES (NEW.user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    UPDATE workflow
+        SET version = (
+            SELECT version FROM user_version WHERE user_id = NEW.user_id
+        )
+        WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS workflow_version_update
+AFTER UPDATE OF status ON workflow
+WHEN OLD.status IS NOT NEW.status
+BEGIN
+    INSERT INTO user_version (user_id, version) VALUES (NEW.user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    UPDATE workflow
+        SET version = (
+            SELECT version FROM user_version WHERE user_id = NEW.user_id
+        )
+        WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS video_version_insert
+AFTER INSERT ON video
+BEGIN
+    INSERT INTO user_version (user_id, version) VALUES (NEW.user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    UPDATE workflow
+        SET version = (
+            SELECT version FROM user_version WHERE user_id = NEW.user_id
+        )
+        WHERE id = NEW.workflow_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS video_version_update
+AFTER UPDATE OF uuid, snippt, transcript ON video
+BEGIN
+    INSERT INTO user_version (user_id, version) VALUES (NEW.user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    UPDATE workflow
+        SET version = (
+            SELECT version FROM user_version WHERE user_id = NEW.user_id
+        )
+        WHERE id = NEW.workflow_id;
+END;
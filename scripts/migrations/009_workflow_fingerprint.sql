@@ -0,0 +1,6 @@
+-- Normalized args hash, to find a user's duplicate workflows, see
+-- `Args.fingerprint`. Fill the existing rows with
+-- scripts/backfill_workflow_fingerprint.py.
+ALTER TABLE workflow ADD COLUMN fingerprint TEXT;
+CREATE INDEX IF NOT EXISTS workflow_user_fingerprint
+    ON workflow (user_id, fingerprint);
@@ -0,0 +1,3 @@
+-- The scheduler reads the TODO and running workflows, a small part of the
+-- table, see lib/workflow_scheduler.py.
+CREATE INDEX IF NOT EXISTS workflow_status_id ON workflow (status, id);
@@ -0,0 +1,5 @@
+-- Let lib/db_compactor.py give the pages of the archived rows back to the
+-- file system in small steps. The VACUUM applying the mode rewrites the
+-- whole DB file once: run this migration while the proxy is stopped.
+PRAGMA auto_vacuum = INCREMENTAL;
+VACUUM;
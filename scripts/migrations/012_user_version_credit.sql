@@ -0,0 +1,17 @@
+-- Also bump the user version, see 008_workflow_version.sql, when the credit
+-- changes or a workflow leaves the table (lib/db_compactor.py), so the
+-- ETags built from it, see lib/etag.py, cover all the user's data.
+CREATE TRIGGER IF NOT EXISTS users_version_credit
+AFTER UPDATE OF credit ON users
+WHEN OLD.credit IS NOT NEW.credit
+BEGIN
+    INSERT INTO user_version (user_id, version) VALUES (NEW.id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS workflow_version_delete
+AFTER DELETE ON workflow
+BEGIN
+    INSERT INTO user_version (user_id, version) VALUES (OLD.user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+END;
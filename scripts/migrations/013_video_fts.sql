@@ -0,0 +1,74 @@
+-- Full text index of the transcripts and snippets, see
+-- `SearchHit.search` in models/workflow.py. The trigram tokenizer (sqlite
+-- 3.34+) matches any substring of 3+ characters, Chinese included.
+-- Triggers keep it in sync with 'video', whoever writes it.
+CREATE VIRTUAL TABLE IF NOT EXISTS video_fts USING fts5(
+    user_id UNINDEXED,
+    workflow_id UNINDEXED,
+    transcript,
+    snippt,
+    tokenize = 'trigram'
+);
+
+-- Index the text values of the json columns, at any depth.
+CREATE TRIGGER IF NOT EXISTS video_fts_insert
+AFTER INSERT ON video
+BEGIN
+    INSERT INTO video_fts (rowid, user_id, workflow_id, transcript, snippt)
+    VALUES (
+        NEW.rowid,
+        NEW.user_id,
+        NEW.workflow_id,
+        CASE WHEN json_valid(NEW.transcript) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(NEW.transcript) WHERE type = 'text'
+        ) ELSE NEW.transcript END,
+        CASE WHEN json_valid(NEW.snippt) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(NEW.snippt) WHERE type = 'text'
+        ) ELSE NEW.snippt END
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS video_fts_update
+AFTER UPDATE OF transcript, snippt ON video
+BEGIN
+    DELETE FROM video_fts WHERE rowid = OLD.rowid;
+    INSERT INTO video_fts (rowid, user_id, workflow_id, transcript, snippt)
+    VALUES (
+        NEW.rowid,
+        NEW.user_id,
+        NEW.workflow_id,
+        CASE WHEN json_valid(NEW.transcript) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(NEW.transcript) WHERE type = 'text'
+        ) ELSE NEW.transcript END,
+        CASE WHEN json_valid(NEW.snippt) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(NEW.snippt) WHERE type = 'text'
+        ) ELSE NEW.snippt END
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS video_fts_delete
+AFTER DELETE ON video
+BEGIN
+    DELETE FROM video_fts WHERE rowid = OLD.rowid;
+END;
+
+-- The videos written before.
+INSERT INTO video_fts (rowid, user_id, workflow_id, transcript, snippt)
+SELECT
+    v.rowid,
+    v.user_id,
+    v.workflow_id,
+    CASE WHEN json_valid(v.transcript) THEN (
+        SELECT group_concat(value, char(10))
+        FROM json_tree(v.transcript) WHERE type = 'text'
+    ) ELSE v.transcript END,
+    CASE WHEN json_valid(v.snippt) THEN (
+        SELECT group_concat(value, char(10))
+        FROM json_tree(v.snippt) WHERE type = 'text'
+    ) ELSE v.snippt END
+FROM video AS v
+WHERE v.rowid NOT IN (SELECT rowid FROM video_fts);
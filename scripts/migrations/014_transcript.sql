@@ -0,0 +1,50 @@
+-- One row per transcript format, see models/transcript.py, so listings
+-- read the formats and sizes without loading 'video.transcript'. The
+-- workers, out of this repository, keep writing 'video.transcript',
+-- the canonical copy; triggers split it here.
+CREATE TABLE IF NOT EXISTS transcript (
+    workflow_id INTEGER NOT NULL,
+    fmt TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (workflow_id, fmt)
+);
+
+CREATE TRIGGER IF NOT EXISTS transcript_insert
+AFTER INSERT ON video
+BEGIN
+    INSERT OR REPLACE INTO transcript (workflow_id, fmt, size, content)
+    SELECT NEW.workflow_id, key, length(CAST(value AS BLOB)), value
+    FROM json_each(
+        CASE WHEN json_valid(NEW.transcript) THEN NEW.transcript
+        ELSE '{}' END
+    )
+    WHERE type = 'text';
+END;
+
+CREATE TRIGGER IF NOT EXISTS transcript_update
+AFTER UPDATE OF transcript ON video
+BEGIN
+    DELETE FROM transcript WHERE workflow_id = OLD.workflow_id;
+    INSERT OR REPLACE INTO transcript (workflow_id, fmt, size, content)
+    SELECT NEW.workflow_id, key, length(CAST(value AS BLOB)), value
+    FROM json_each(
+        CASE WHEN json_valid(NEW.transcript) THEN NEW.transcript
+        ELSE '{}' END
+    )
+    WHERE type = 'text';
+END;
+
+CREATE TRIGGER IF NOT EXISTS transcript_delete
+AFTER DELETE ON video
+BEGIN
+    DELETE FROM transcript WHERE workflow_id = OLD.workflow_id;
+END;
+
+-- The videos written before.
+INSERT OR IGNORE INTO transcript (workflow_id, fmt, size, content)
+SELECT v.workflow_id, t.key, length(CAST(t.value AS BLOB)), t.value
+FROM video AS v, json_each(
+    CASE WHEN json_valid(v.transcript) THEN v.transcript ELSE '{}' END
+) AS t
+WHERE t.type = 'text';
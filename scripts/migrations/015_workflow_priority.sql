@@ -0,0 +1,3 @@
+-- Order of the TODO workflows within a user's queue, higher first, see
+-- lib/workflow_scheduler.py.
+ALTER TABLE workflow ADD COLUMN priority INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,17 @@
+-- When the workflow was deleted. lib/db_compactor.py archives it only
+-- ARCHIVE_DELETED_AFTER_S later, so the clients of the change feed, see
+-- lib/workflow_feed.py, see the deletion first. The rows deleted before
+-- this migration count from now.
+ALTER TABLE workflow ADD COLUMN delete_at INTEGER;
+UPDATE workflow
+    SET delete_at = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE status = 20 AND delete_at IS NULL;
+
+CREATE TRIGGER IF NOT EXISTS workflow_delete_at
+AFTER UPDATE OF status ON workflow
+WHEN NEW.status = 20 AND OLD.status IS NOT 20
+BEGIN
+    UPDATE workflow
+        SET delete_at = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE id = NEW.id;
+END;
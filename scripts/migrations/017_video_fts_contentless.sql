@@ -0,0 +1,94 @@
+-- Stop storing a copy of the indexed text in video_fts, see
+-- 013_video_fts.sql: the index is contentless, the snippets of
+-- `SearchHit.search` come from the 'transcript' rows. A contentless
+-- index is told the old values to remove. Rebuilds the index.
+DROP TRIGGER IF EXISTS video_fts_insert;
+DROP TRIGGER IF EXISTS video_fts_update;
+DROP TRIGGER IF EXISTS video_fts_delete;
+DROP TABLE IF EXISTS video_fts;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS video_fts USING fts5(
+    transcript,
+    snippt,
+    tokenize = 'trigram',
+    content = ''
+);
+
+-- Index the text values of the json columns, at any depth.
+CREATE TRIGGER IF NOT EXISTS video_fts_insert
+AFTER INSERT ON video
+BEGIN
+    INSERT INTO video_fts (rowid, transcript, snippt)
+    VALUES (
+        NEW.rowid,
+        CASE WHEN json_valid(NEW.transcript) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(NEW.transcript) WHERE type = 'text'
+        ) ELSE NEW.transcript END,
+        CASE WHEN json_valid(NEW.snippt) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(NEW.snippt) WHERE type = 'text'
+        ) ELSE NEW.snippt END
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS video_fts_update
+AFTER UPDATE OF transcript, snippt ON video
+BEGIN
+    INSERT INTO video_fts (video_fts, rowid, transcript, snippt)
+    VALUES (
+        'delete',
+        OLD.rowid,
+        CASE WHEN json_valid(OLD.transcript) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(OLD.transcript) WHERE type = 'text'
+        ) ELSE OLD.transcript END,
+        CASE WHEN json_valid(OLD.snippt) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(OLD.snippt) WHERE type = 'text'
+        ) ELSE OLD.snippt END
+    );
+    INSERT INTO video_fts (rowid, transcript, snippt)
+    VALUES (
+        NEW.rowid,
+        CASE WHEN json_valid(NEW.transcript) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(NEW.transcript) WHERE type = 'text'
+        ) ELSE NEW.transcript END,
+        CASE WHEN json_valid(NEW.snippt) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(NEW.snippt) WHERE type = 'text'
+        ) ELSE NEW.snippt END
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS video_fts_delete
+AFTER DELETE ON video
+BEGIN
+    INSERT INTO video_fts (video_fts, rowid, transcript, snippt)
+    VALUES (
+        'delete',
+        OLD.rowid,
+        CASE WHEN json_valid(OLD.transcript) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(OLD.transcript) WHERE type = 'text'
+        ) ELSE OLD.transcript END,
+        CASE WHEN json_valid(OLD.snippt) THEN (
+            SELECT group_concat(value, char(10))
+            FROM json_tree(OLD.snippt) WHERE type = 'text'
+        ) ELSE OLD.snippt END
+    );
+END;
+
+INSERT INTO video_fts (rowid, transcript, snippt)
+SELECT
+    v.rowid,
+    CASE WHEN json_valid(v.transcript) THEN (
+        SELECT group_concat(value, char(10))
+        FROM json_tree(v.transcript) WHERE type = 'text'
+    ) ELSE v.transcript END,
+    CASE WHEN json_valid(v.snippt) THEN (
+        SELECT group_concat(value, char(10))
+        FROM json_tree(v.snippt) WHERE type = 'text'
+    ) ELSE v.snippt END
+FROM video AS v;
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Write the .gz variants, and the .br ones if brotli is installed, of the
+UI bundle files, served instead of them by lib/static_files.py. Run after
+each build of the bundle:
+$python3 -m scripts.precompress_static static/build
+"""
+
+import argparse
+import gzip
+import os
+
+from lib.compression import BROTLI, GZIP, brotli
+from lib.config import COMPRESSION_MIN_BYTES
+from lib.static_files import VARIANTS
+
+
+# Already compressed, or not worth it.
+SKIPPED_EXTENSIONS = (
+    ".br", ".gz", ".zip", ".png", ".jpg", ".jpeg", ".gif", ".webp",
+    ".avif", ".woff", ".woff2", ".mp3", ".mp4",
+)
+
+
+def compress_best(data: bytes, encoding: str) -> bytes:
+    # Once per build, so the slowest levels.
+    if encoding == GZIP:
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=11)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("directory", nargs="?", default="static/build")
+    args = parser.parse_args()
+
+    encodings = [GZIP, BROTLI] if brotli else [GZIP]
+    written = saved = 0
+    for root, _dirs, files in os.walk(args.directory):
+        for name in files:
+            if name.lower().endswith(SKIPPED_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) < COMPRESSION_MIN_BYTES:
+                continue
+            for encoding in encodings:
+                variant = path + VARIANTS[encoding]
+                compressed = compress_best(data, encoding)
+                if len(compressed) >= len(data):
+                    continue
+                with open(variant, "wb") as f:
+                    f.write(compressed)
+                written += 1
+                saved += len(data) - len(compressed)
+    print(f"Wrote {written} variants, {saved / 1024:.1f} KB saved.")
+
+
+if __name__ == "__main__":
+    main()
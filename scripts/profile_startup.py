@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Report where the startup time goes: import time per module, from
+`python -X importtime`, and init time per router, each imported in turn
+in a fresh interpreter, so a router is only charged for what the routers
+before it did not import yet:
+$python3 -m scripts.profile_startup -n 15
+"""
+
+import argparse
+import json
+import os
+import pkgutil
+import subprocess
+import sys
+
+from typing import Dict, List, Tuple
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter, prints {step: ms}.
+ROUTERS_SNIPPET = """
+import importlib, json, sys, time
+times = {}
+start = time.perf_counter()
+import fastapi
+times["fastapi"] = (time.perf_counter() - start) * 1000
+for name in sys.argv[1:]:
+    start = time.perf_counter()
+    importlib.import_module(f"routers.{name}")
+    times[f"routers.{name}"] = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+import app
+times["app"] = (time.perf_counter() - start) * 1000
+print(json.dumps(times))
+"""
+
+
+def import_times() -> List[Tuple[str, int, int, int]]:
+    """
+    (module, depth, self us, cumulative us) of the modules `import app`
+    imports, in import order.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    times: List[Tuple[str, int, int, int]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append(
+            (name.strip(), depth, int(self_us), int(cumulative_us))
+        )
+        if depth == 0:
+            # A parent comes after its imports: done, or the interpreter's
+            # own imports, like site, to leave out.
+            if name.strip() == "app":
+                break
+            times = []
+    return times
+
+
+def router_times() -> Dict[str, float]:
+    routers = sorted(
+        module.name
+        for module in pkgutil.iter_modules([os.path.join(ROOT, "routers")])
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", ROUTERS_SNIPPET, *routers],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("-n", "--top", type=int, default=20)
+    args = parser.parse_args()
+
+    times = import_times()
+    total_us = sum(t[2] for t in times)
+    print(f"Imported {len(times)} modules in {total_us / 1000:.1f} ms.")
+
+    # Top level packages, as their first import pulls their dependencies.
+    packages: Dict[str, int] = {}
+    for name, depth, _self_us, cumulative_us in times:
+        if depth == 1:
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0) + cumulative_us
+    print(f"\nTop {args.top} packages by cumulative import time:")
+    for package, us in sorted(
+        packages.items(), key=lambda p: p[1], reverse=True
+    )[:args.top]:
+        print(f"{us / 1000:>9.1f} ms  {package}")
+
+    print(f"\nTop {args.top} modules by self import time:")
+    for name, _depth, self_us, _cumulative_us in sorted(
+        times, key=lambda t: t[2], reverse=True
+    )[:args.top]:
+        print(f"{self_us / 1000:>9.1f} ms  {name}")
+
+    print("\nInit time per router, in import order:")
+    for step, ms in router_times().items():
+        print(f"{ms:>9.1f} ms  {step}")
+
+
+if __name__ == "__main__":
+    main()
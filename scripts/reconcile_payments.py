@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Settle the payments left PENDING against their Stripe checkout sessions.
+Safe to run from cron, an interrupted run resumes where it stopped:
+$python3 -m scripts.reconcile_payments
+"""
+
+import argparse
+import asyncio
+import logging
+
+from lib.config import (
+    RECONCILE_BATCH_SIZE,
+    RECONCILE_CONCURRENCY,
+    RECONCILE_MIN_AGE_S,
+)
+from lib.payment_reconciler import PaymentReconciler
+from lib.stripe_client import stripe_client
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="ignore the checkpoint and start from the first payment",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    reconciler = PaymentReconciler(
+        client=stripe_client,
+        batch_size=RECONCILE_BATCH_SIZE,
+        concurrency=RECONCILE_CONCURRENCY,
+        min_age_s=RECONCILE_MIN_AGE_S,
+    )
+    report = asyncio.run(reconciler.run(resume=not args.restart))
+    print(dict(report))
+
+
+if __name__ == "__main__":
+    main()
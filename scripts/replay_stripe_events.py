@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Replay Stripe events, signed like Stripe does, against a local webhook.
+
+Events are read as json lines, e.g. exported from the Stripe dashboard, or
+from the 'stripe_event.payload' column:
+$python3 -m scripts.replay_stripe_events events.jsonl \
+    --url https://127.0.0.1:8000/payment/stripe/webhook
+"""
+
+import argparse
+import json
+import requests
+
+from lib.config import STRIPE_WEBHOOK_SECRET
+from lib.stripe_stub import signed_event
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("events", help="json lines file of Stripe events")
+    parser.add_argument(
+        "--url",
+        default="https://127.0.0.1:8000/payment/stripe/webhook",
+    )
+    parser.add_argument("--secret", default=STRIPE_WEBHOOK_SECRET)
+    parser.add_argument(
+        "--insecure",
+        action="store_true",
+        help="skip the TLS check of the local self signed cert",
+    )
+    args = parser.parse_args()
+
+    with open(args.events) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            payload, signature = signed_event(event, args.secret)
+            rsp = requests.post(
+                args.url,
+                data=payload,
+                headers={
+                    "Content-Type": "application/json",
+                    "Stripe-Signature": signature,
+                },
+                verify=not args.insecure,
+            )
+            print(f"{event['id']} {event['type']}: {rsp.status_code}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Show the top SQL statements of a profile, as written by the proxy on
+shutdown to SQL_PROFILER_REPORT_FILE or returned by /user/admin/sql-profile:
+$python3 -m scripts.sql_profile --order p99
+$curl -b "Authorization=..." $DOMAIN/user/admin/sql-profile?top=100 \\
+    | python3 -m scripts.sql_profile -
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from lib.config import SQL_PROFILER_REPORT_FILE
+from lib.sql_profiler import ORDERS
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "file", nargs="?", default=SQL_PROFILER_REPORT_FILE,
+        help="report file, - for stdin",
+    )
+    parser.add_argument("-n", "--top", type=int, default=20)
+    parser.add_argument("-o", "--order", choices=ORDERS, default="total")
+    parser.add_argument(
+        "--slow", action="store_true", help="show the slow statements"
+    )
+    args = parser.parse_args()
+
+    if args.file == "-":
+        report = json.load(sys.stdin)
+    else:
+        with open(args.file, encoding="utf-8") as f:
+            report = json.load(f)
+
+    since = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(report["since"]))
+    print(f"Since {since}, by {args.order} time:")
+    field = {"total": "total_ms", "p99": "p99_ms", "max": "max_ms"}
+    statements = sorted(
+        report["statements"],
+        key=lambda s: s[field.get(args.order, args.order)],
+        reverse=True,
+    )
+    print(f"{'count':>8} {'total ms':>11} {'p99 ms':>9} {'max ms':>9} "
+          f"{'rows':>9}  statement")
+    for s in statements[:args.top]:
+        print(
+            f"{s['count']:>8} {s['total_ms']:>11.1f} {s['p99_ms']:>9.2f} "
+            f"{s['max_ms']:>9.2f} {s['rows']:>9}  {s['sql'][:200]}"
+        )
+        for site, count in s["sites"].items():
+            print(f"{'':>50}{count:>8} from {site}")
+
+    if args.slow:
+        print("\nSlow statements, latest first:")
+        for s in report["slow"]:
+            at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(s["at"]))
+            print(f"\n{at} {s['duration_ms']} ms, {s['rows']} rows, "
+                  f"from {s['site']}\n{s['sql']}")
+            for line in s["plan"].splitlines():
+                print(f"    {line}")
+
+
+if __name__ == "__main__":
+    main()
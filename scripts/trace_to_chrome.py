@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Convert the traces exported to TRACE_FILE into the Chrome trace event
+format, to open in https://ui.perfetto.dev or chrome://tracing:
+$python3 -m scripts.trace_to_chrome traces.jsonl -o trace.json
+"""
+
+import argparse
+import json
+
+from typing import Any, Dict, List
+
+
+def convert(lines: List[str], trace_ids: List[str]) -> Dict[str, Any]:
+    events = []
+    threads: Dict[str, int] = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        span = json.loads(line)
+        trace_id = span["traceId"]
+        if trace_ids and trace_id not in trace_ids:
+            continue
+        # One row per trace.
+        if trace_id not in threads:
+            threads[trace_id] = len(threads) + 1
+            events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 1,
+                "tid": threads[trace_id],
+                "args": {"name": trace_id},
+            })
+        start_us = span["startTimeUnixNano"] / 1000
+        events.append({
+            "name": span["name"],
+            "ph": "X",
+            "pid": 1,
+            "tid": threads[trace_id],
+            "ts": start_us,
+            "dur": span["endTimeUnixNano"] / 1000 - start_us,
+            "args": {
+                "span_id": span["spanId"],
+                "parent_id": span["parentSpanId"],
+                **span["attributes"],
+            },
+        })
+    return {"traceEvents": events}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="+", help="exported trace files")
+    parser.add_argument("-o", "--output", default="trace.json")
+    parser.add_argument(
+        "-t", "--trace-id", action="append", default=[],
+        help="only this trace, repeatable",
+    )
+    args = parser.parse_args()
+
+    lines: List[str] = []
+    for file in args.files:
+        with open(file, encoding="utf-8") as f:
+            lines.extend(f)
+    chrome = convert(lines, args.trace_id)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(chrome, f)
+    print(f"Wrote {len(chrome['traceEvents'])} events to {args.output}")
+
+
+if __name__ == "__main__":
+    main()